@@ -1,14 +1,56 @@
 import sqlite3
 import telegram
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import InlineQueryResultArticle, InputTextMessageContent
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, time as dtime
+import asyncio
+import atexit
+import bisect
+import calendar
+import cProfile
+import functools
+import heapq
+from itertools import islice
+import contextvars
 import logging
+from logging.handlers import QueueHandler, QueueListener
 import uuid
 import json
+import io
 import os
+import pstats
+import queue
+import random
+import re
+import threading
+import tracemalloc
+import pandas as pd
+from collections import defaultdict
+from dataclasses import dataclass
+from time import monotonic
 from config import BOT_TOKEN, ADMIN_IDS, DATABASE_PATH, DEFAULT_WORKING_HOURS, WELCOME_MESSAGE, SUPPORT_CONTACT, SUPPORT_MESSAGE_RU, SUPPORT_MESSAGE_EN
-from telegram.ext import ConversationHandler
+from config import ARCHIVE_RETENTION_DAYS, ARCHIVE_COLD_DIR, ARCHIVE_MAINTENANCE_HOUR
+from config import BACKUP_DIR, BACKUP_KEEP, BACKUP_HOUR
+from config import IMPORT_MAX_ERRORS_SHOWN
+from config import FLOOD_RATE, FLOOD_BURST, DUPLICATE_CALLBACK_WINDOW, MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES
+from config import TELEGRAM_GLOBAL_RATE, TELEGRAM_GROUP_CHAT_RATE, TELEGRAM_MAX_RETRIES
+from config import METRICS_HOST, METRICS_PORT, EVENT_LOOP_LAG_INTERVAL
+from config import LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_DEBUG_SAMPLE_RATE
+from config import PROFILE_DIR, PROFILE_SAMPLE_RATE
+from config import AVAILABILITY_CACHE_SIZE
+from config import SLOT_HOLD_SECONDS, CLIENT_CACHE_SIZE
+from config import LIST_PAGE_SIZE
+from config import INLINE_SLOT_DAYS, INLINE_MAX_RESULTS, INLINE_CACHE_SECONDS
+from config import CALENDAR_MONTHS_AHEAD
+from config import SHOP_TIMEZONE
+from config import WAITLIST_OFFER_MINUTES, WAITLIST_EXPIRE_INTERVAL
+from config import RECURRING_INTERVALS, RECURRING_MATERIALIZE_DAYS, RECURRING_HORIZON_DAYS, RECURRING_MATERIALIZE_HOUR
+from config import OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL, OUTBOX_LEASE_SECONDS, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE, OUTBOX_KEEP_DAYS
+from telegram.ext import ConversationHandler, TypeHandler, ApplicationHandlerStop, BaseRateLimiter, InlineQueryHandler, Defaults
+from telegram.ext import BaseUpdateProcessor
+from telegram.error import RetryAfter
+from telegram.helpers import escape_markdown
 import pytz
 
 # Barbershop Telegram Bot
@@ -16,11 +58,74 @@ import pytz
 # Support and custom development: t.me/werybos
 
 # Set up logging
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+current_update_id = contextvars.ContextVar('current_update_id', default=None)
+current_user_id = contextvars.ContextVar('current_user_id', default=None)
+
+class UpdateContextFilter(logging.Filter):
+    # Runs on the producing side of the queue, where the context variables
+    # of the update being processed are still visible
+    def filter(self, record):
+        record.update_id = current_update_id.get()
+        record.user_id = current_user_id.get()
+        return True
+
+class DebugSamplingFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+class DeferredQueueHandler(QueueHandler):
+    # The stock prepare() formats the message on the calling thread; records
+    # stay in-process here, so formatting is left to the listener thread
+    def prepare(self, record):
+        return record
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'update_id': getattr(record, 'update_id', None),
+            'user_id': getattr(record, 'user_id', None),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def setup_logging():
+    output = logging.FileHandler(LOG_FILE, encoding='utf-8') if LOG_FILE else logging.StreamHandler()
+    if LOG_FORMAT == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(update_id)s] %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(DebugSamplingFilter(LOG_DEBUG_SAMPLE_RATE))
+    queue_handler.addFilter(UpdateContextFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+    # httpx logs every Bot API request at INFO, which dominates log volume
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
 logger = logging.getLogger(__name__)
 
 # States for conversation handlers
 ENTER_NAME, ENTER_PHONE = range(2)
+CONFIRM_PROFILE = 3
+ENTER_VACATION = 4
 
 # Database setup
 def init_db():
@@ -28,6 +133,9 @@ def init_db():
     c = conn.cursor()
     
     try:
+        # WAL lets readers, including the backup snapshot, run alongside writers
+        c.execute("PRAGMA journal_mode=WAL")
+
         # Check and update services table
         c.execute("PRAGMA table_info(services)")
         columns = [col[1] for col in c.fetchall()]
@@ -72,9 +180,52 @@ def init_db():
             date TEXT NOT NULL,
             time TEXT NOT NULL,
             status TEXT NOT NULL,
+            duration INTEGER,
+            price INTEGER,
+            day_num INTEGER,
+            start_min INTEGER,
             FOREIGN KEY (barber_id) REFERENCES barbers(id),
             FOREIGN KEY (service_id) REFERENCES services(id)
         )''')
+        # Multi-service bookings: total chair time and price live on the appointment
+        c.execute("PRAGMA table_info(appointments)")
+        columns = [col[1] for col in c.fetchall()]
+        if 'duration' not in columns:
+            c.execute("ALTER TABLE appointments ADD COLUMN duration INTEGER")
+            c.execute("ALTER TABLE appointments ADD COLUMN price INTEGER")
+            c.execute(
+                "UPDATE appointments SET duration = (SELECT duration FROM services WHERE services.id = appointments.service_id), "
+                "price = (SELECT price FROM services WHERE services.id = appointments.service_id)"
+            )
+        # Compact time columns: lookups and ordering use integers, the text
+        # date and time are kept for display
+        if 'day_num' not in columns:
+            c.execute("ALTER TABLE appointments ADD COLUMN day_num INTEGER")
+            c.execute("ALTER TABLE appointments ADD COLUMN start_min INTEGER")
+            c.execute(f"UPDATE appointments SET day_num = {DAY_NUM_SQL}, start_min = {START_MIN_SQL}")
+        # Rows written by older code or by hand get the columns filled in
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS appointments_fill_day AFTER INSERT ON appointments
+            WHEN NEW.day_num IS NULL OR NEW.start_min IS NULL
+            BEGIN
+                UPDATE appointments SET day_num = {DAY_NUM_SQL}, start_min = {START_MIN_SQL} WHERE id = NEW.id;
+            END''')
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS appointments_move_day AFTER UPDATE OF date, time ON appointments
+            BEGIN
+                UPDATE appointments SET day_num = {DAY_NUM_SQL}, start_min = {START_MIN_SQL} WHERE id = NEW.id;
+            END''')
+        c.execute("DROP INDEX IF EXISTS idx_appointments_barber_date")
+        c.execute("DROP INDEX IF EXISTS idx_appointments_user")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_appointments_barber_day ON appointments (barber_id, day_num, start_min)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_appointments_user_day ON appointments (user_id, day_num, start_min)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_appointments_day ON appointments (day_num, start_min)")
+
+        # Create appointment_services table
+        c.execute('''CREATE TABLE IF NOT EXISTS appointment_services (
+            appointment_id INTEGER NOT NULL,
+            service_id INTEGER NOT NULL,
+            PRIMARY KEY (appointment_id, service_id),
+            FOREIGN KEY (service_id) REFERENCES services(id)
+        )''')
         
         # Create archive_appointments table
         c.execute('''CREATE TABLE IF NOT EXISTS archive_appointments (
@@ -88,10 +239,89 @@ def init_db():
             time TEXT NOT NULL,
             status TEXT NOT NULL,
             archived_at TEXT NOT NULL,
+            services TEXT,
+            duration INTEGER,
+            price INTEGER,
             FOREIGN KEY (barber_id) REFERENCES barbers(id),
             FOREIGN KEY (service_id) REFERENCES services(id)
         )''')
-        
+        add_archive_totals(c, 'main')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_archive_date ON archive_appointments (date)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_archive_user ON archive_appointments (user_id, date, time)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_archive_barber ON archive_appointments (barber_id, date, time)")
+
+        # Create outbox table
+        c.execute('''CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            reply_markup TEXT,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            next_attempt_at TEXT NOT NULL,
+            locked_until TEXT,
+            sent_at TEXT,
+            last_error TEXT
+        )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (status, next_attempt_at)")
+        c.execute("PRAGMA table_info(outbox)")
+        if 'reply_markup' not in [col[1] for col in c.fetchall()]:
+            c.execute("ALTER TABLE outbox ADD COLUMN reply_markup TEXT")
+
+        # Create waitlist table
+        c.execute('''CREATE TABLE IF NOT EXISTS waitlist (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            barber_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            time_from TEXT NOT NULL,
+            time_to TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            offered_time TEXT,
+            offer_expires_at TEXT,
+            FOREIGN KEY (barber_id) REFERENCES barbers(id)
+        )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_waitlist_barber_date ON waitlist (barber_id, date, status)")
+
+        # Create recurring_rules table
+        c.execute('''CREATE TABLE IF NOT EXISTS recurring_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            client_name TEXT NOT NULL,
+            client_phone TEXT NOT NULL,
+            barber_id INTEGER NOT NULL,
+            service_id INTEGER NOT NULL,
+            duration INTEGER,
+            price INTEGER,
+            start_date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            interval_weeks INTEGER NOT NULL,
+            materialized_until TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (barber_id) REFERENCES barbers(id),
+            FOREIGN KEY (service_id) REFERENCES services(id)
+        )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_recurring_barber ON recurring_rules (barber_id, status)")
+        c.execute("PRAGMA table_info(recurring_rules)")
+        if 'duration' not in [col[1] for col in c.fetchall()]:
+            c.execute("ALTER TABLE recurring_rules ADD COLUMN duration INTEGER")
+            c.execute("ALTER TABLE recurring_rules ADD COLUMN price INTEGER")
+
+        # Create time_off table: whole days off, both ends included
+        c.execute('''CREATE TABLE IF NOT EXISTS time_off (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            barber_id INTEGER NOT NULL,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL,
+            reason TEXT,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (barber_id) REFERENCES barbers(id)
+        )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_time_off_barber ON time_off (barber_id, start_date)")
+
         # Create reviews table
         c.execute('''CREATE TABLE IF NOT EXISTS reviews (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -103,6 +333,21 @@ def init_db():
             FOREIGN KEY (barber_id) REFERENCES barbers(id)
         )''')
         
+        # Create clients table, seeded once from each client's latest booking
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'clients'")
+        clients_missing = c.fetchone() is None
+        c.execute('''CREATE TABLE IF NOT EXISTS clients (
+            user_id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )''')
+        if clients_missing:
+            c.execute(
+                "INSERT OR IGNORE INTO clients (user_id, name, phone, updated_at) "
+                "SELECT user_id, client_name, client_phone, MAX(date || ' ' || time) FROM appointments GROUP BY user_id"
+            )
+        
         # Create settings table
         c.execute('''CREATE TABLE IF NOT EXISTS settings (
             key TEXT PRIMARY KEY,
@@ -127,16 +372,508 @@ def init_db():
                       ('working_hours', DEFAULT_WORKING_HOURS))
         
         conn.commit()
+        repair_archive_ids(conn)
         logger.debug("init_db: Database initialized successfully")
     except sqlite3.OperationalError as e:
-        logger.error(f"init_db: Database initialization failed: {e}")
+        logger.error("init_db: Database initialization failed: %s", e)
         raise
     finally:
         conn.close()
 
+# Metrics
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else float('inf')
+        return float('inf')
+
+class Metrics:
+    HELP = {
+        'barbershop_handler_seconds': 'Handler latency by callback pattern or command',
+        'barbershop_handler_errors_total': 'Handler exceptions by callback pattern or command',
+        'barbershop_db_query_seconds': 'SQLite statement execution time',
+        'barbershop_db_fetch_seconds': 'SQLite result fetching time',
+        'barbershop_db_rows_total': 'SQLite rows fetched',
+        'barbershop_telegram_api_seconds': 'Telegram Bot API call latency by endpoint',
+        'barbershop_telegram_api_errors_total': 'Telegram Bot API call errors by endpoint',
+        'barbershop_cache_hits_total': 'Cache hits by cache name',
+        'barbershop_cache_misses_total': 'Cache misses by cache name',
+        'barbershop_event_loop_lag_seconds': 'Last measured event loop lag',
+        'barbershop_outbound_queue': 'Outbound Telegram request limiter state',
+        'barbershop_events_total': 'Published domain events by type',
+        'barbershop_event_subscriber_seconds': 'Event subscriber run time',
+        'barbershop_event_subscriber_errors_total': 'Event subscriber exceptions',
+        'barbershop_outbox_messages_total': 'Outbox deliveries by outcome',
+        'barbershop_slot_holds_total': 'Slot hold acquisitions, conflicts and expiries',
+    }
+    LABELS = {
+        'barbershop_handler_seconds': 'handler',
+        'barbershop_handler_errors_total': 'handler',
+        'barbershop_db_query_seconds': 'statement',
+        'barbershop_db_fetch_seconds': 'statement',
+        'barbershop_db_rows_total': 'statement',
+        'barbershop_telegram_api_seconds': 'endpoint',
+        'barbershop_telegram_api_errors_total': 'endpoint',
+        'barbershop_cache_hits_total': 'cache',
+        'barbershop_cache_misses_total': 'cache',
+        'barbershop_outbound_queue': 'state',
+        'barbershop_events_total': 'event',
+        'barbershop_event_subscriber_seconds': 'subscriber',
+        'barbershop_event_subscriber_errors_total': 'subscriber',
+        'barbershop_outbox_messages_total': 'outcome',
+        'barbershop_slot_holds_total': 'outcome',
+    }
+
+    def __init__(self):
+        self.histograms = defaultdict(dict)
+        self.counters = defaultdict(lambda: defaultdict(int))
+        self.gauges = {}
+        # Database work also runs in asyncio.to_thread workers
+        self.lock = threading.RLock()
+
+    def observe(self, name, label, seconds):
+        with self.lock:
+            histogram = self.histograms[name].get(label)
+            if histogram is None:
+                histogram = self.histograms[name][label] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name, label='', value=1):
+        with self.lock:
+            self.counters[name][label] += value
+
+    def cache_ratio(self, cache):
+        hits = self.counters['barbershop_cache_hits_total'].get(cache, 0)
+        misses = self.counters['barbershop_cache_misses_total'].get(cache, 0)
+        return hits / (hits + misses) if hits + misses else 0.0
+
+    def series(self, name, label, suffix='', extra=''):
+        label_name = self.LABELS.get(name)
+        labels = []
+        if label_name:
+            escaped = str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+            labels.append(f'{label_name}="{escaped}"')
+        if extra:
+            labels.append(extra)
+        return f"{name}{suffix}{{{','.join(labels)}}}" if labels else f"{name}{suffix}"
+
+    def render(self):
+        with self.lock:
+            return self.render_locked()
+
+    def render_locked(self):
+        self.gauges['barbershop_outbound_queue'] = rate_limiter.stats()
+        lines = []
+        for name, by_label in self.histograms.items():
+            lines += [f"# HELP {name} {self.HELP.get(name, name)}", f"# TYPE {name} histogram"]
+            for label, histogram in by_label.items():
+                cumulative = 0
+                for bound, bucket_count in zip(LATENCY_BUCKETS + (float('inf'),), histogram.counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    bucket = self.series(name, label, '_bucket', f'le="{le}"')
+                    lines.append(f"{bucket} {cumulative}")
+                lines.append(f"{self.series(name, label, '_sum')} {histogram.total:.6f}")
+                lines.append(f"{self.series(name, label, '_count')} {histogram.count}")
+        for name, by_label in self.counters.items():
+            lines += [f"# HELP {name} {self.HELP.get(name, name)}", f"# TYPE {name} counter"]
+            lines += [f"{self.series(name, label)} {value}" for label, value in by_label.items()]
+        for name, value in self.gauges.items():
+            lines += [f"# HELP {name} {self.HELP.get(name, name)}", f"# TYPE {name} gauge"]
+            if isinstance(value, dict):
+                lines += [f"{self.series(name, label)} {item}" for label, item in value.items()]
+            else:
+                lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+class InstrumentedCursor(sqlite3.Cursor):
+    # SQLite produces most result rows while they are fetched, so fetch time
+    # and row counts are recorded under the statement that produced them
+    statement = None
+
+    def execute(self, sql, parameters=()):
+        self.statement = statement_label(sql)
+        started = monotonic()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.observe('barbershop_db_query_seconds', self.statement, monotonic() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        self.statement = statement_label(sql)
+        started = monotonic()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.observe('barbershop_db_query_seconds', self.statement, monotonic() - started)
+
+    def timed_fetch(self, fetch, *args):
+        started = monotonic()
+        result = fetch(*args)
+        metrics.observe('barbershop_db_fetch_seconds', self.statement, monotonic() - started)
+        if result is not None:
+            metrics.inc('barbershop_db_rows_total', self.statement, len(result) if isinstance(result, list) else 1)
+        return result
+
+    def fetchone(self):
+        return self.timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self.timed_fetch(super().fetchmany, size or self.arraysize)
+
+    def fetchall(self):
+        return self.timed_fetch(super().fetchall)
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+STATEMENT_LITERALS = re.compile(r"\bIN \((?:\?, )*\?\)|\b\d+\b")
+
+@functools.lru_cache(maxsize=512)
+def statement_label(sql):
+    # Numbers built into the SQL (LIMIT n) and IN lists of varying length
+    # would make every call a new series
+    return STATEMENT_LITERALS.sub(lambda match: 'IN (...)' if match.group().startswith('IN') else '?', ' '.join(sql.split()))[:120]
+
+def handler_label(handler):
+    if isinstance(handler, CallbackQueryHandler) and handler.pattern is not None:
+        return getattr(handler.pattern, 'pattern', str(handler.pattern))
+    if isinstance(handler, CommandHandler):
+        return '/' + ','.join(sorted(handler.commands))
+    return handler.callback.__name__
+
+def instrument_handler(handler):
+    if isinstance(handler, ConversationHandler):
+        for nested in handler.entry_points + handler.fallbacks:
+            instrument_handler(nested)
+        for state_handlers in handler.states.values():
+            for nested in state_handlers:
+                instrument_handler(nested)
+        return
+
+    callback = handler.callback
+    label = handler_label(handler)
+
+    @functools.wraps(callback)
+    async def timed_callback(update, context):
+        profiled = profiler.enter(label, callback.__name__)
+        started = monotonic()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            # flood_guard and other middleware stop updates on purpose
+            raise
+        except Exception:
+            metrics.inc('barbershop_handler_errors_total', label)
+            raise
+        finally:
+            metrics.observe('barbershop_handler_seconds', label, monotonic() - started)
+            if profiled:
+                profiler.exit()
+
+    handler.callback = timed_callback
+
+def instrument_handlers(application):
+    for group_handlers in application.handlers.values():
+        for handler in group_handlers:
+            instrument_handler(handler)
+
+# Profiling
+class HandlerProfiler:
+    # cProfile (and optionally tracemalloc) around selected handlers, switched
+    # on and off at runtime. Coroutines that run while a profiled handler is
+    # awaiting are captured too, which is the price of profiling async code
+    def __init__(self):
+        self.profile = None
+        self.selected = None
+        self.active_calls = 0
+        self.started_at = None
+        self.memory = False
+
+    @property
+    def running(self):
+        return self.profile is not None
+
+    def start(self, selected=None, memory=False):
+        self.profile = cProfile.Profile()
+        self.selected = set(selected) if selected else None
+        self.active_calls = 0
+        self.started_at = datetime.now()
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+
+    def enter(self, label, name):
+        if self.profile is None:
+            return False
+        if self.selected is not None and label not in self.selected and name not in self.selected:
+            return False
+        if PROFILE_SAMPLE_RATE < 1 and random.random() >= PROFILE_SAMPLE_RATE:
+            return False
+        if self.active_calls == 0:
+            self.profile.enable()
+        self.active_calls += 1
+        return True
+
+    def exit(self):
+        self.active_calls -= 1
+        if self.active_calls == 0 and self.profile is not None:
+            self.profile.disable()
+
+    def stop(self):
+        # Must run on the event loop thread: cProfile hooks are per thread
+        profile, self.profile = self.profile, None
+        if profile is not None and self.active_calls:
+            profile.disable()
+        self.active_calls = 0
+        snapshot = None
+        if self.memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        return profile, snapshot
+
+def dump_profile(profile, snapshot):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    prof_path = os.path.join(PROFILE_DIR, f"handlers_{stamp}.prof")
+    text_path = os.path.join(PROFILE_DIR, f"handlers_{stamp}.txt")
+    profile.dump_stats(prof_path)
+    with open(text_path, 'w', encoding='utf-8') as f:
+        pstats.Stats(profile, stream=f).sort_stats('cumulative').print_stats(40)
+    paths = [text_path, prof_path]
+
+    if snapshot is not None:
+        memory_path = os.path.join(PROFILE_DIR, f"memory_{stamp}.txt")
+        with open(memory_path, 'w', encoding='utf-8') as f:
+            for stat in snapshot.statistics('lineno')[:40]:
+                f.write(f"{stat}\n")
+        paths.append(memory_path)
+    return paths
+
+profiler = HandlerProfiler()
+
+async def monitor_event_loop_lag():
+    while True:
+        started = monotonic()
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        metrics.gauges['barbershop_event_loop_lag_seconds'] = max(monotonic() - started - EVENT_LOOP_LAG_INTERVAL, 0.0)
+
+async def serve_metrics_request(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        path = request_line.decode('latin-1').split(' ')[1] if request_line.count(b' ') >= 2 else ''
+        if path == '/metrics':
+            status, body = '200 OK', metrics.render().encode()
+        else:
+            status, body = '404 Not Found', b'Not Found\n'
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics(application: Application):
+    # post_init runs before the application is started, so the task is kept
+    # in bot_data rather than handed to application.create_task
+    application.bot_data['event_loop_lag_task'] = asyncio.create_task(monitor_event_loop_lag())
+    if METRICS_PORT:
+        application.bot_data['metrics_server'] = await asyncio.start_server(serve_metrics_request, METRICS_HOST, METRICS_PORT)
+        logger.info("start_metrics: Serving metrics on http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
+
+async def stop_metrics(application: Application):
+    application.bot_data['event_loop_lag_task'].cancel()
+    server = application.bot_data.get('metrics_server')
+    if server:
+        server.close()
+        await server.wait_closed()
+
+def format_perf_summary():
+    with metrics.lock:
+        return format_perf_summary_locked()
+
+def format_perf_summary_locked():
+    lines = ["📊 Производительность (p50 / p95, мс, вызовов)", ""]
+
+    def top(name, limit=10):
+        by_label = metrics.histograms.get(name, {})
+        ranked = sorted(by_label.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+        return [
+            f"{histogram.quantile(0.5) * 1000:g} / {histogram.quantile(0.95) * 1000:g} ({histogram.count}) {label[:60]}"
+            for label, histogram in ranked
+        ] or ["нет данных"]
+
+    lines += ["Обработчики:"] + top('barbershop_handler_seconds') + [""]
+    lines += ["SQL (по суммарному времени):"] + top('barbershop_db_query_seconds') + [""]
+    lines += ["Telegram API:"] + top('barbershop_telegram_api_seconds') + [""]
+
+    api_errors = metrics.counters.get('barbershop_telegram_api_errors_total', {})
+    handler_errors = metrics.counters.get('barbershop_handler_errors_total', {})
+    lines.append(f"Ошибки API: {sum(api_errors.values())}, ошибки обработчиков: {sum(handler_errors.values())}")
+    caches = set(metrics.counters.get('barbershop_cache_hits_total', {})) | set(metrics.counters.get('barbershop_cache_misses_total', {}))
+    for cache in sorted(caches):
+        lines.append(f"Кэш {cache}: попаданий {metrics.cache_ratio(cache):.0%}")
+    queue = rate_limiter.stats()
+    lines.append(f"Очередь исходящих: {queue['queued']}, в полёте: {queue['in_flight']}, объединено правок: {queue['coalesced']}")
+    lines.append(f"Задержка event loop: {metrics.gauges.get('barbershop_event_loop_lag_seconds', 0.0) * 1000:.1f} мс")
+    return '\n'.join(lines)
+
+# Domain events
+@dataclass(frozen=True)
+class AppointmentBooked:
+    appointment_id: int
+    barber_id: int
+    date: str
+    time: str
+    user_id: str
+
+@dataclass(frozen=True)
+class AppointmentCancelled:
+    appointment_id: int
+    barber_id: int
+    date: str
+    time: str
+    user_id: str
+
+@dataclass(frozen=True)
+class AppointmentCompleted:
+    appointment_id: int
+    barber_id: int
+    date: str
+    time: str
+    user_id: str
+
+@dataclass(frozen=True)
+class ScheduleChanged:
+    barber_id: int
+    date: str = None  # None: the whole schedule changed
+
+@dataclass(frozen=True)
+class CatalogChanged:
+    kind: str  # 'barbers', 'categories', 'services' or 'appointments'
+
+class EventBus:
+    # Events are published after the transaction that caused them has been
+    # committed. Plain functions run inline (cache invalidation must not lag
+    # behind the commit); coroutines run as background tasks, concurrently
+    # and off the request path.
+    def __init__(self):
+        self.subscribers = defaultdict(list)
+        self.tasks = set()
+
+    def subscribe(self, event_type, callback):
+        self.subscribers[event_type].append(callback)
+
+    def publish(self, bot, event):
+        name = type(event).__name__
+        metrics.inc('barbershop_events_total', name)
+        for callback in self.subscribers[type(event)]:
+            if asyncio.iscoroutinefunction(callback):
+                task = asyncio.create_task(self.run(callback, bot, event))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+            else:
+                try:
+                    callback(event)
+                except Exception:
+                    metrics.inc('barbershop_event_subscriber_errors_total', callback.__name__)
+                    logger.exception("EventBus: %s failed on %s", callback.__name__, event)
+
+    async def run(self, callback, bot, event):
+        started = monotonic()
+        try:
+            await callback(bot, event)
+        except Exception:
+            metrics.inc('barbershop_event_subscriber_errors_total', callback.__name__)
+            logger.exception("EventBus: %s failed on %s", callback.__name__, event)
+        finally:
+            metrics.observe('barbershop_event_subscriber_seconds', callback.__name__, monotonic() - started)
+
+    async def drain(self):
+        # Used on shutdown and by benchmarks to wait for pending subscribers
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks), return_exceptions=True)
+
+event_bus = EventBus()
+
+def subscribe(*event_types):
+    def decorator(callback):
+        for event_type in event_types:
+            event_bus.subscribe(event_type, callback)
+        return callback
+    return decorator
+
+def appointment_event(event_type, c, appointment_id):
+    c.execute("SELECT barber_id, date, time, user_id FROM appointments WHERE id = ?", (appointment_id,))
+    barber_id, date, time, user_id = c.fetchone()
+    return event_type(int(appointment_id), barber_id, date, time, user_id)
+
 # Helper functions
 def get_db_connection():
-    return sqlite3.connect(DATABASE_PATH)
+    return sqlite3.connect(DATABASE_PATH, factory=InstrumentedConnection)
+
+# Shop clock: dates and times are stored as the shop's local wall clock
+# ('YYYY-MM-DD', 'HH:MM', both sortable as text), so "today" and "now" come
+# from SHOP_TIMEZONE rather than from whatever zone the server runs in
+SHOP_TZ = pytz.timezone(SHOP_TIMEZONE)
+
+def now_local():
+    return datetime.now(SHOP_TZ)
+
+# Compact appointment time: day_num counts days since 1970-01-01 and
+# start_min is the minute of the day
+EPOCH = datetime(1970, 1, 1)
+DAY_NUM_SQL = "CAST(julianday(date) - julianday('1970-01-01') AS INTEGER)"
+START_MIN_SQL = "CAST(substr(time, 1, 2) AS INTEGER) * 60 + CAST(substr(time, 4, 2) AS INTEGER)"
+
+@functools.lru_cache(maxsize=4096)
+def day_number(date):
+    return (datetime.strptime(date, '%Y-%m-%d') - EPOCH).days
+
+def day_date(day_num):
+    return (EPOCH + timedelta(days=day_num)).strftime('%Y-%m-%d')
+
+# An appointment's services, duration and price: the basket when it has one,
+# otherwise its single service_id (imported and generated rows have no basket)
+APPOINTMENT_SERVICES_SQL = (
+    "COALESCE((SELECT group_concat(x.name, ' + ') FROM appointment_services aps "
+    "JOIN services x ON aps.service_id = x.id WHERE aps.appointment_id = a.id), s.name)"
+)
+APPOINTMENT_DURATION_SQL = "COALESCE(a.duration, s.duration)"
+APPOINTMENT_PRICE_SQL = "COALESCE(a.price, s.price)"
 
 def is_admin(update: Update):
     return str(update.effective_user.id) in ADMIN_IDS
@@ -149,59 +886,307 @@ def is_barber(update: Update):
     conn.close()
     return bool(result)
 
+# Domain models
+# Compact value objects for the booking hot path. Barbers and services are
+# loaded once into in-memory catalogs, and a barber's schedule is parsed once
+# into one bitmask of working minutes per weekday. Chair time taken by
+# bookings is a bitmask of the same shape, so free-slot and overlap tests are
+# integer bit operations instead of JSON parsing and tuple scans.
+WEEKDAY_NAMES = ('Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс')
+
+def minute_mask(start, end):
+    # Bits start..end-1 set
+    return ((1 << (end - start)) - 1) << start if end > start else 0
+
+def weekday_of(day_num):
+    # 1970-01-01 was a Thursday
+    return (day_num + 3) % 7
+
+def parse_workdays(days):
+    # 'Пн-Пт', 'Пн,Ср,Пт' or a mix such as 'Пн-Ср,Сб'; ranges may wrap ('Сб-Вт').
+    # Raises ValueError on unknown day names.
+    workdays = set()
+    for part in days.split(','):
+        first, _, last = part.partition('-')
+        first = WEEKDAY_NAMES.index(first.strip().capitalize())
+        last = WEEKDAY_NAMES.index(last.strip().capitalize()) if last else first
+        workdays.update((first + offset) % 7 for offset in range((last - first) % 7 + 1))
+    return workdays
+
+class Schedule:
+    __slots__ = ('days', 'hours', 'weekday_minutes')
+
+    def __init__(self, days, hours, strict=True):
+        start_time, end_time = hours.split('-')
+        start = datetime.strptime(start_time.strip(), '%H:%M')
+        end = datetime.strptime(end_time.strip(), '%H:%M')
+        working = minute_mask(start.hour * 60 + start.minute, end.hour * 60 + end.minute)
+        try:
+            workdays = parse_workdays(days)
+        except ValueError:
+            if strict:
+                raise
+            # Schedules saved before day names were validated: every day is a workday
+            workdays = set(range(7))
+        self.days = days
+        self.hours = hours
+        self.weekday_minutes = tuple(working if weekday in workdays else 0 for weekday in range(7))
+
+    @classmethod
+    def from_json(cls, text):
+        schedule = json.loads(text)
+        return cls(schedule['days'], schedule['hours'], strict=False)
+
+    def to_json(self):
+        return json.dumps({'days': self.days, 'hours': self.hours})
+
+    def working_minutes(self, date):
+        return self.weekday_minutes[weekday_of(day_number(date))]
+
+class Barber:
+    __slots__ = ('id', 'name', 'telegram_id', 'is_active', 'schedule')
+
+    def __init__(self, id, name, telegram_id, is_active, schedule):
+        self.id = id
+        self.name = name
+        self.telegram_id = telegram_id
+        self.is_active = is_active
+        self.schedule = schedule
+
+class Service:
+    __slots__ = ('id', 'category_id', 'name', 'price', 'duration')
+
+    def __init__(self, id, category_id, name, price, duration):
+        self.id = id
+        self.category_id = category_id
+        self.name = name
+        self.price = price
+        self.duration = duration
+
+class Appointment:
+    # One booking as shown in a barber's day view
+    __slots__ = ('id', 'time', 'client_name', 'client_phone', 'services', 'duration', 'status')
+
+    def __init__(self, id, time, client_name, client_phone, services, duration, status):
+        self.id = id
+        self.time = time
+        self.client_name = client_name
+        self.client_phone = client_phone
+        self.services = services
+        self.duration = duration
+        self.status = status
+
+    def __eq__(self, other):
+        return isinstance(other, Appointment) and all(
+            getattr(self, field) == getattr(other, field) for field in self.__slots__
+        )
+
+# Barbers and services by id, loaded on first use and dropped when they change
+barber_models = {}
+service_models = {}
+
+def load_barber(barber_id):
+    barber_id = int(barber_id)
+    barber = barber_models.get(barber_id)
+    if barber is None:
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("SELECT id, name, telegram_id, is_active, schedule FROM barbers WHERE id = ?", (barber_id,))
+        row = c.fetchone()
+        conn.close()
+        if not row:
+            return None
+        barber = barber_models[barber_id] = Barber(row[0], row[1], row[2], row[3], Schedule.from_json(row[4]))
+    return barber
+
+def get_services():
+    if not service_models:
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("SELECT id, category_id, name, price, duration FROM services ORDER BY id")
+        service_models.update((row[0], Service(*row)) for row in c.fetchall())
+        conn.close()
+    return service_models
+
+@subscribe(ScheduleChanged)
+def drop_barber_model(event):
+    if event.date is None:
+        barber_models.pop(event.barber_id, None)
+
+@subscribe(CatalogChanged)
+def drop_catalog_models(event):
+    if event.kind == 'barbers':
+        barber_models.clear()
+    elif event.kind in ('services', 'categories'):
+        service_models.clear()
+
+# Availability cache: (barber_id, date) -> slots, kept coherent by events.
+# The month cache holds (barber_id, 'YYYY-MM') -> bitmask of days with a free slot.
+availability_cache = {}
+month_availability_cache = {}
+
+@subscribe(AppointmentBooked, AppointmentCancelled, AppointmentCompleted)
+def invalidate_appointment_day(event):
+    availability_cache.pop((event.barber_id, event.date), None)
+    month_availability_cache.pop((event.barber_id, event.date[:7]), None)
+
+@subscribe(ScheduleChanged)
+def invalidate_barber_schedule(event):
+    if event.date is not None:
+        availability_cache.pop((event.barber_id, event.date), None)
+        month_availability_cache.pop((event.barber_id, event.date[:7]), None)
+        return
+    for cache in (availability_cache, month_availability_cache):
+        for key in [key for key in cache if key[0] == event.barber_id]:
+            del cache[key]
+
+@subscribe(CatalogChanged)
+def invalidate_availability(event):
+    if event.kind in ('barbers', 'appointments'):
+        availability_cache.clear()
+        month_availability_cache.clear()
+
 def get_available_time_slots(barber_id, date):
+    key = (int(barber_id), date)
+    slots = availability_cache.get(key)
+    if slots is not None:
+        metrics.inc('barbershop_cache_hits_total', 'availability')
+        return slots
+    metrics.inc('barbershop_cache_misses_total', 'availability')
+    slots = load_available_time_slots(barber_id, date)
+    if len(availability_cache) >= AVAILABILITY_CACHE_SIZE:
+        availability_cache.clear()
+    availability_cache[key] = slots
+    return slots
+
+SLOT_MINUTES = 30
+
+def load_available_time_slots(barber_id, date):
+    barber = load_barber(barber_id)
+    if not barber:
+        return []
+    working = barber.schedule.working_minutes(date)
+    if not working or on_time_off(barber_id, day_number(date)):
+        return []
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT schedule FROM barbers WHERE id = ?", (barber_id,))
-    result = c.fetchone()
-    if not result:
-        conn.close()
+    busy = day_busy_mask(c, barber_id, date)
+    conn.close()
+    return build_slots(working, busy)
+
+def build_slots(working, busy):
+    # A slot every SLOT_MINUTES from the first working minute, offered only
+    # when the whole slot is working time; it is taken when any booking's
+    # real chair time overlaps it, not only when a booking starts there
+    if not working:
         return []
-    
-    schedule = json.loads(result[0])
-    hours = schedule['hours'].split('-')
-    start_hour = int(hours[0].split(':')[0])
-    end_hour = int(hours[1].split(':')[0])
-    
-    c.execute("SELECT time FROM appointments WHERE barber_id = ? AND date = ? AND status = 'pending'", 
-              (barber_id, date))
-    booked_slots = [row[0] for row in c.fetchall()]
-    
-    # Generate all possible time slots
+    slot = (1 << SLOT_MINUTES) - 1
     all_slots = []
-    current_time = datetime.strptime(f"{date} {start_hour:02d}:00", '%Y-%m-%d %H:%M')
-    end_time = datetime.strptime(f"{date} {end_hour:02d}:00", '%Y-%m-%d %H:%M')
-    
-    while current_time < end_time:
-        time_str = current_time.strftime('%H:%M')
-        is_booked = time_str in booked_slots
-        all_slots.append((time_str, is_booked))
-        current_time += timedelta(minutes=30)  # 30-minute intervals
-    
-    conn.close()
+    for start in range((working & -working).bit_length() - 1, working.bit_length(), SLOT_MINUTES):
+        if (working >> start) & slot == slot:
+            all_slots.append((f"{start // 60:02d}:{start % 60:02d}", bool(busy >> start & slot)))
     return all_slots
 
-def archive_past_appointments():
+def day_busy_mask(c, barber_id, date):
+    # Minutes of the day taken by bookings, materialized or not
+    c.execute(
+        f"SELECT a.start_min, {APPOINTMENT_DURATION_SQL} FROM appointments a JOIN services s ON a.service_id = s.id "
+        "WHERE a.barber_id = ? AND a.day_num = ? AND a.status = 'pending'",
+        (barber_id, day_number(date))
+    )
+    busy = 0
+    for start, duration in c.fetchall():
+        busy |= minute_mask(start, start + duration)
+    for start, end in recurring_intervals(c, barber_id, date):
+        busy |= minute_mask(start, end)
+    return busy
+
+def get_month_availability(barber_id, month):
+    key = (int(barber_id), month)
+    mask = month_availability_cache.get(key)
+    if mask is not None:
+        metrics.inc('barbershop_cache_hits_total', 'month_availability')
+        return mask
+    metrics.inc('barbershop_cache_misses_total', 'month_availability')
+    mask = load_month_availability(barber_id, month)
+    if len(month_availability_cache) >= AVAILABILITY_CACHE_SIZE:
+        month_availability_cache.clear()
+    month_availability_cache[key] = mask
+    return mask
+
+def load_month_availability(barber_id, month):
+    # Bit d-1 is set when day d of the month has at least one free slot. The
+    # whole month's bookings come from one range scan over
+    # idx_appointments_barber_day; unmaterialized recurring rules are
+    # expanded in memory instead of being queried day by day.
+    barber = load_barber(barber_id)
+    if not barber:
+        return 0
+    first, after = f"{month}-01", next_month_start(month)
+    last = (datetime.strptime(after, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+
     conn = get_db_connection()
     c = conn.cursor()
-    now = datetime.now()
-    current_date = now.strftime('%Y-%m-%d')
-    current_time = now.strftime('%H:%M')
-    
+    busy = defaultdict(int)
+    c.execute(
+        f"SELECT a.day_num, a.start_min, {APPOINTMENT_DURATION_SQL} FROM appointments a JOIN services s ON a.service_id = s.id "
+        "WHERE a.barber_id = ? AND a.day_num >= ? AND a.day_num < ? AND a.status = 'pending'",
+        (barber_id, day_number(first), day_number(after))
+    )
+    for day_num, start, duration in c.fetchall():
+        busy[day_num] |= minute_mask(start, start + duration)
     c.execute(
-        "SELECT id, user_id, client_name, client_phone, barber_id, service_id, date, time, status "
-        "FROM appointments WHERE status = 'pending' AND (date < ? OR (date = ? AND time < ?))",
-        (current_date, current_date, current_time)
+        "SELECT r.start_date, r.interval_weeks, r.materialized_until, r.time, COALESCE(r.duration, s.duration) "
+        "FROM recurring_rules r JOIN services s ON r.service_id = s.id "
+        "WHERE r.barber_id = ? AND r.status = 'active' AND r.start_date < ?",
+        (barber_id, after)
     )
-    past_appointments = c.fetchall()
+    for start_date, interval_weeks, materialized_until, time, duration in c.fetchall():
+        for date in rule_occurrences(start_date, interval_weeks, first, last):
+            if date > materialized_until:
+                busy[day_number(date)] |= minute_mask(to_minutes(time), to_minutes(time) + duration)
+    conn.close()
+
+    mask = 0
+    first_day = day_number(first)
+    for day in range(int(last[-2:])):
+        if on_time_off(barber_id, first_day + day):
+            continue
+        working = barber.schedule.weekday_minutes[weekday_of(first_day + day)]
+        if any(not is_booked for _, is_booked in build_slots(working, busy[first_day + day])):
+            mask |= 1 << day
+    return mask
+
+def free_run_minutes(barber_id, date, time, user_id=None):
+    # Working minutes available from `time` until the next taken or held slot
+    # or the end of the working run, whichever comes first
+    barber = load_barber(barber_id)
+    slots = get_available_time_slots(barber_id, date)
+    if not barber or not slots:
+        return 0
+    held = get_offered_slots(barber_id, date, user_id) | slot_holds.held(barber_id, date, user_id)
+    start = to_minutes(time)
+    free = barber.schedule.working_minutes(date) >> start
+    run = ((free + 1) & ~free).bit_length() - 1
+    for slot, is_booked in slots:
+        if slot >= time and (is_booked or slot in held):
+            return max(min(run, to_minutes(slot) - start), 0)
+    return run
+
+def archive_past_appointments():
+    conn = get_db_connection()
+    c = conn.cursor()
+    now = now_local()
+    today = day_number(now.strftime('%Y-%m-%d'))
+    current_minute = now.hour * 60 + now.minute
     
-    for appt in past_appointments:
-        c.execute(
-            "INSERT INTO archive_appointments (id, user_id, client_name, client_phone, barber_id, service_id, date, time, status, archived_at) "
-            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            appt + (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),)
-        )
-        c.execute("DELETE FROM appointments WHERE id = ?", (appt[0],))
+    # Today's rows leave only once they are over: a running appointment still
+    # occupies the chair in the busy mask
+    move_to_archive(
+        c, "a.status IN ('pending', 'completed') AND (a.day_num < ? OR (a.day_num = ? AND "
+           "a.start_min + COALESCE(a.duration, (SELECT duration FROM services WHERE id = a.service_id)) <= ?))",
+        [today, today, current_minute], now.strftime('%Y-%m-%d %H:%M:%S')
+    )
     
     conn.commit()
     conn.close()
@@ -212,13 +1197,15 @@ def generate_appointments_excel(user_id=None, is_admin=False):
     
     if is_admin:
         c.execute(
-            "SELECT a.id, b.name AS barber, a.client_name, s.name AS service, a.date, a.time, s.price, s.duration "
+            f"SELECT a.id, b.name AS barber, a.client_name, {APPOINTMENT_SERVICES_SQL} AS service, a.date, a.time, "
+            f"{APPOINTMENT_PRICE_SQL}, {APPOINTMENT_DURATION_SQL} "
             "FROM appointments a JOIN barbers b ON a.barber_id = b.id JOIN services s ON a.service_id = s.id "
             "WHERE a.status = 'pending'"
         )
     else:
         c.execute(
-            "SELECT a.id, b.name AS barber, a.client_name, s.name AS service, a.date, a.time, s.price, s.duration "
+            f"SELECT a.id, b.name AS barber, a.client_name, {APPOINTMENT_SERVICES_SQL} AS service, a.date, a.time, "
+            f"{APPOINTMENT_PRICE_SQL}, {APPOINTMENT_DURATION_SQL} "
             "FROM appointments a JOIN barbers b ON a.barber_id = b.id JOIN services s ON a.service_id = s.id "
             "WHERE a.status = 'pending' AND a.user_id = ?",
             (str(user_id),)
@@ -249,937 +1236,3345 @@ def generate_appointments_excel(user_id=None, is_admin=False):
     df.to_excel(excel_path, index=False)
     return excel_path
 
-# Client Menu
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message:
-        user = update.effective_user
-    else:
-        query = update.callback_query
-        await query.answer()
-        user = query.from_user
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("📅 Записаться на стрижку", callback_data='book_appointment'),
-            InlineKeyboardButton("📋 Мои записи", callback_data='my_appointments')
-        ],
-        [
-            InlineKeyboardButton("🕒 Часы работы", callback_data='working_hours'),
-            InlineKeyboardButton("⭐ Оценить мастера", callback_data='rate_barber')
-        ],
-        [
-            InlineKeyboardButton("ℹ️ О нас", callback_data='about_us'),
-            InlineKeyboardButton("💬 Поддержка", callback_data='support_info')
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    if update.message:
-        await update.message.reply_text(WELCOME_MESSAGE, reply_markup=reply_markup, parse_mode='Markdown')
-    else:
-        await query.edit_message_text(WELCOME_MESSAGE, reply_markup=reply_markup, parse_mode='Markdown')
-    
-    if is_admin(update):
-        if update.message:
-            await update.message.reply_text("👑 *Вы администратор!* Введите /admin для доступа к панели управления.", parse_mode='Markdown')
-    if is_barber(update):
-        if update.message:
-            await update.message.reply_text("💇‍♂️ *Вы мастер!* Введите /barber для доступа к меню мастера.", parse_mode='Markdown')
+# Archive cold storage
+ARCHIVE_COLUMNS = "id, user_id, client_name, client_phone, barber_id, service_id, date, time, status, archived_at, services, duration, price"
 
-async def about_us(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    about_text = (
-        "💈 *О нашем барбершопе* 💈\n\n"
-        "Мы - команда профессионалов, которые любят своё дело! "
-        "Создаём стильные стрижки и комфортную атмосферу. "
-        "Приходите, чтобы почувствовать себя на высоте! 😊\n\n"
-        "📍 Адрес: ул. Примерная, д. 10\n"
-        "📞 Телефон: +79991234567\n\n"
-        f"💬 Техническая поддержка и разработка: @werybos\n"
-        "🌐 Поддержка: Русский, English"
+def fill_archive_totals(c, schema='main'):
+    # Rows archived without a basket (older archives, imported and generated
+    # history) had a single service, so its name, duration and price fill them
+    c.execute(
+        f"UPDATE {schema}.archive_appointments SET "
+        "services = (SELECT name FROM main.services WHERE main.services.id = archive_appointments.service_id), "
+        "duration = (SELECT duration FROM main.services WHERE main.services.id = archive_appointments.service_id), "
+        "price = (SELECT price FROM main.services WHERE main.services.id = archive_appointments.service_id) "
+        "WHERE services IS NULL"
     )
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='back_to_start')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(about_text, reply_markup=reply_markup, parse_mode='Markdown')
 
-async def support_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
+def add_archive_totals(c, schema):
+    c.execute(f"PRAGMA {schema}.table_info(archive_appointments)")
+    if 'services' in [col[1] for col in c.fetchall()]:
+        return
+    c.execute(f"ALTER TABLE {schema}.archive_appointments ADD COLUMN services TEXT")
+    c.execute(f"ALTER TABLE {schema}.archive_appointments ADD COLUMN duration INTEGER")
+    c.execute(f"ALTER TABLE {schema}.archive_appointments ADD COLUMN price INTEGER")
+    fill_archive_totals(c, schema)
+
+def attach_cold_archive(c, path):
+    # Attaches one month file as "cold", creating or upgrading its table. Only
+    # the archiver and the startup repair call it, so every file is current
+    # and readers attach without DDL or commits.
+    c.execute("ATTACH DATABASE ? AS cold", (path,))
+    c.execute('''CREATE TABLE IF NOT EXISTS cold.archive_appointments (
+        id INTEGER PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        client_name TEXT NOT NULL,
+        client_phone TEXT NOT NULL,
+        barber_id INTEGER NOT NULL,
+        service_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        time TEXT NOT NULL,
+        status TEXT NOT NULL,
+        archived_at TEXT NOT NULL,
+        services TEXT,
+        duration INTEGER,
+        price INTEGER
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS cold.idx_archive_date ON archive_appointments (date)")
+    c.execute("CREATE INDEX IF NOT EXISTS cold.idx_archive_user ON archive_appointments (user_id, date, time)")
+    c.execute("CREATE INDEX IF NOT EXISTS cold.idx_archive_barber ON archive_appointments (barber_id, date, time)")
+    add_archive_totals(c, 'cold')
+    c.connection.commit()
+
+def move_to_archive(c, where, params, archived_at, status=None):
+    # Moves the matching appointments (alias a) into the archive with their
+    # services, duration and price, and drops their basket rows. status
+    # overrides the appointments' own status.
+    c.execute(
+        f"INSERT INTO archive_appointments ({ARCHIVE_COLUMNS}) "
+        f"SELECT a.id, a.user_id, a.client_name, a.client_phone, a.barber_id, a.service_id, a.date, a.time, "
+        f"COALESCE(?, a.status), ?, {APPOINTMENT_SERVICES_SQL}, {APPOINTMENT_DURATION_SQL}, {APPOINTMENT_PRICE_SQL} "
+        f"FROM appointments a LEFT JOIN services s ON a.service_id = s.id WHERE {where}",
+        [status, archived_at] + list(params)
+    )
+    c.execute(f"DELETE FROM appointment_services WHERE appointment_id IN (SELECT a.id FROM appointments a WHERE {where})", params)
+    c.execute(f"DELETE FROM appointments WHERE id IN (SELECT a.id FROM appointments a WHERE {where})", params)
+    return c.rowcount
+
+def get_cold_archive_path(month):
+    return os.path.join(ARCHIVE_COLD_DIR, f"archive_{month}.db")
+
+def list_cold_archive_months():
+    if not os.path.isdir(ARCHIVE_COLD_DIR):
+        return []
+    months = []
+    for name in os.listdir(ARCHIVE_COLD_DIR):
+        match = re.match(r'^archive_(\d{4}-\d{2})\.db$', name)
+        if match:
+            months.append(match.group(1))
+    return sorted(months)
+
+def next_month_start(month):
+    year, month_num = map(int, month.split('-'))
+    if month_num == 12:
+        return f"{year + 1}-01-01"
+    return f"{year}-{month_num + 1:02d}-01"
+
+def reserve_appointment_ids(c, count):
+    # Archived rows keep their appointment's id, so rows that go straight to
+    # the archive take ids from the appointments sequence too. Returns the
+    # first of count consecutive ids.
+    c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'appointments'")
+    row = c.fetchone()
+    last = row[0] if row else 0
+    if row:
+        c.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'appointments'", (last + count,))
+    else:
+        c.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('appointments', ?)", (last + count,))
+    return last + 1
+
+def repair_archive_ids(conn):
+    # Imported history used to get ids from the archive's own sequence, so
+    # they could clash with live appointments that are archived later under
+    # their own id. Such rows are renumbered and the appointments sequence is
+    # moved past every archived id.
+    c = conn.cursor()
+    cold_paths = [get_cold_archive_path(month) for month in list_cold_archive_months()]
+    c.execute("SELECT COALESCE(MAX(id), 0) FROM archive_appointments")
+    top = c.fetchone()[0]
+    hot_clashes = set()
+    for path in cold_paths:
+        attach_cold_archive(c, path)
+        try:
+            c.execute("SELECT COALESCE(MAX(id), 0) FROM cold.archive_appointments")
+            top = max(top, c.fetchone()[0])
+            c.execute("SELECT id FROM main.archive_appointments WHERE id IN (SELECT id FROM cold.archive_appointments)")
+            hot_clashes.update(row[0] for row in c.fetchall())
+        finally:
+            c.execute("DETACH DATABASE cold")
+    c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'appointments'")
+    row = c.fetchone()
+    if not row or row[0] < top:
+        reserve_appointment_ids(c, top - (row[0] if row else 0))
+    conn.commit()
+
+    renumbered = 0
+    for path in cold_paths:
+        attach_cold_archive(c, path)
+        try:
+            c.execute("SELECT id FROM cold.archive_appointments WHERE id IN (SELECT id FROM main.appointments)")
+            for (old_id,) in c.fetchall():
+                c.execute("UPDATE cold.archive_appointments SET id = ? WHERE id = ?", (reserve_appointment_ids(c, 1), old_id))
+                renumbered += 1
+            conn.commit()
+        finally:
+            c.execute("DETACH DATABASE cold")
+    c.execute("SELECT id FROM archive_appointments WHERE id IN (SELECT id FROM appointments)")
+    hot_clashes.update(row[0] for row in c.fetchall())
+    for old_id in sorted(hot_clashes):
+        c.execute("UPDATE archive_appointments SET id = ? WHERE id = ?", (reserve_appointment_ids(c, 1), old_id))
+        renumbered += 1
+    conn.commit()
+    if renumbered:
+        logger.info("repair_archive_ids: Renumbered %d archived appointments", renumbered)
+
+def move_archive_to_cold_storage():
+    cutoff = (now_local() - timedelta(days=ARCHIVE_RETENTION_DAYS)).strftime('%Y-%m-%d')
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT DISTINCT substr(date, 1, 7) FROM archive_appointments WHERE date < ?", (cutoff,))
+    months = [row[0] for row in c.fetchall()]
+    moved = 0
+
+    try:
+        if months:
+            os.makedirs(ARCHIVE_COLD_DIR, exist_ok=True)
+        for month in months:
+            # One attached file per month keeps each segment small and lets
+            # range queries skip whole files by name
+            attach_cold_archive(c, get_cold_archive_path(month))
+            try:
+                month_start = f"{month}-01"
+                month_end = min(next_month_start(month), cutoff)
+                c.execute(
+                    f"INSERT OR REPLACE INTO cold.archive_appointments ({ARCHIVE_COLUMNS}) "
+                    f"SELECT {ARCHIVE_COLUMNS} FROM main.archive_appointments WHERE date >= ? AND date < ?",
+                    (month_start, month_end)
+                )
+                c.execute("DELETE FROM main.archive_appointments WHERE date >= ? AND date < ?", (month_start, month_end))
+                moved += c.rowcount
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            finally:
+                c.execute("DETACH DATABASE cold")
+    finally:
+        conn.close()
+
+    if moved:
+        logger.info("move_archive_to_cold_storage: Moved %d archived appointments older than %s", moved, cutoff)
+    return moved
+
+def fetch_archive_appointments(where="1", params=(), date_from=None, date_to=None, descending=False, limit=None):
+    # Reads archive rows from the hot table and the cold monthly files as if
+    # they were one table. Imported history can land in the hot table next to
+    # cold months, so the hot table is always read and merged by
+    # (date, time, id). Cold months are disjoint and opened in reading order,
+    # stopping once they alone fill the limit: a page costs the same however
+    # many months of history exist.
+    conditions = [f"({where})"]
+    params = list(params)
+    if date_from:
+        conditions.append("date >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("date <= ?")
+        params.append(date_to)
+    direction = 'DESC' if descending else 'ASC'
+    sql = (
+        f"SELECT {ARCHIVE_COLUMNS} FROM {{table}} WHERE {' AND '.join(conditions)} "
+        f"ORDER BY date {direction}, time {direction}, id {direction}"
+    )
+    if limit is not None:
+        sql += " LIMIT ?"
+
+    months = [
+        month for month in list_cold_archive_months()
+        if (not date_from or month >= date_from[:7]) and (not date_to or month <= date_to[:7])
+    ]
+    if descending:
+        months.reverse()
+
+    conn = get_db_connection()
+    c = conn.cursor()
+    cold_rows = []
+    try:
+        c.execute(sql.format(table='main.archive_appointments'), params + ([limit] if limit is not None else []))
+        hot_rows = c.fetchall()
+        for month in months:
+            if limit is not None and len(cold_rows) >= limit:
+                break
+            c.execute("ATTACH DATABASE ? AS cold", (get_cold_archive_path(month),))
+            try:
+                c.execute(
+                    sql.format(table='cold.archive_appointments'),
+                    params + ([limit - len(cold_rows)] if limit is not None else [])
+                )
+                cold_rows += c.fetchall()
+            finally:
+                c.execute("DETACH DATABASE cold")
+    finally:
+        conn.close()
+    rows = heapq.merge(hot_rows, cold_rows, key=lambda row: (row[6], row[7], row[0]), reverse=descending)
+    return list(islice(rows, limit))
+
+def generate_archive_excel(date_from=None, date_to=None):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT id, name FROM barbers")
+    barber_names = dict(c.fetchall())
+    conn.close()
+
+    archived = []
+    for (appt_id, user_id, client_name, client_phone, barber_id, service_id, date, time, status, archived_at,
+            services, duration, price) in fetch_archive_appointments(date_from=date_from, date_to=date_to):
+        archived.append((
+            appt_id, barber_names.get(barber_id, f"#{barber_id}"), client_name, client_phone,
+            services or f"#{service_id}", duration, price, date, time, status, archived_at
+        ))
+
+    df = pd.DataFrame(
+        archived,
+        columns=['ID', 'Мастер', 'Клиент', 'Телефон', 'Услуги', 'Длительность (мин)', 'Цена', 'Дата', 'Время', 'Статус', 'В архиве с']
+    )
+
+    excel_path = 'archive_appointments.xlsx'
+    df.to_excel(excel_path, index=False)
+    return excel_path
+
+async def archive_maintenance_job(context: ContextTypes.DEFAULT_TYPE):
+    # Runs in a worker thread so large moves never stall update processing
+    await asyncio.to_thread(archive_past_appointments)
+    event_bus.publish(context.bot, CatalogChanged('appointments'))
+    await asyncio.to_thread(move_archive_to_cold_storage)
+    await asyncio.to_thread(prune_outbox)
+
+# Database backups
+def list_backups():
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    return sorted(
+        name for name in os.listdir(BACKUP_DIR)
+        if re.match(r'^barbershop_\d{8}_\d{6}\.db$', name)
+    )
+
+def rotate_backups():
+    backups = list_backups()
+    for name in backups[:max(len(backups) - BACKUP_KEEP, 0)]:
+        os.remove(os.path.join(BACKUP_DIR, name))
+        logger.info("rotate_backups: Removed old backup %s", name)
+
+def copy_database(source_path, target_path):
+    # One backup step inside a single read transaction: in WAL mode writers
+    # keep going while the consistent snapshot is copied. A stepped copy would
+    # restart from page 0 after every commit from another connection.
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+        return target.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+
+def backup_cold_archive():
+    # Cold month files only change during archive maintenance, so they are
+    # mirrored into BACKUP_DIR/cold and recopied only when newer
+    cold_dir = os.path.join(BACKUP_DIR, 'cold')
+    os.makedirs(cold_dir, exist_ok=True)
+    copied = 0
+    for month in list_cold_archive_months():
+        source_path = get_cold_archive_path(month)
+        target_path = os.path.join(cold_dir, os.path.basename(source_path))
+        if os.path.exists(target_path) and os.path.getmtime(target_path) >= os.path.getmtime(source_path):
+            continue
+        integrity = copy_database(source_path, target_path + '.part')
+        if integrity != 'ok':
+            os.remove(target_path + '.part')
+            raise sqlite3.DatabaseError(f"Cold archive backup integrity check failed for {month}: {integrity}")
+        os.replace(target_path + '.part', target_path)
+        copied += 1
+    return copied
+
+def backup_database():
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    backup_path = os.path.join(BACKUP_DIR, f"barbershop_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db")
+    partial_path = backup_path + '.part'
+    started = datetime.now()
+
+    integrity = copy_database(DATABASE_PATH, partial_path)
+    if integrity != 'ok':
+        os.remove(partial_path)
+        raise sqlite3.DatabaseError(f"Backup integrity check failed: {integrity}")
+
+    os.replace(partial_path, backup_path)
+    rotate_backups()
+    cold_copied = backup_cold_archive()
+    elapsed = (datetime.now() - started).total_seconds()
+    logger.info("backup_database: Saved %s (%d bytes) and %d cold archive files in %.1fs",
+                backup_path, os.path.getsize(backup_path), cold_copied, elapsed)
+    return backup_path, elapsed
+
+async def backup_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await asyncio.to_thread(backup_database)
+    except (sqlite3.Error, OSError) as e:
+        logger.error("backup_job: Backup failed: %s", e)
+
+async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        await update.message.reply_text("❌ *Доступ запрещён.*", parse_mode='Markdown')
+        return
+
+    await update.message.reply_text("⏳ *Создаю резервную копию базы...*", parse_mode='Markdown')
+    try:
+        backup_path, elapsed = await asyncio.to_thread(backup_database)
+    except (sqlite3.Error, OSError) as e:
+        logger.error("backup_command: Backup failed: %s", e)
+        await update.message.reply_text("❌ *Не удалось создать резервную копию.* Подробности в логах.", parse_mode='Markdown')
+        return
+
+    size_mb = os.path.getsize(backup_path) / (1024 * 1024)
+    await update.message.reply_text(
+        f"✅ *Резервная копия создана:* `{os.path.basename(backup_path)}`\n"
+        f"📦 Размер: {size_mb:.1f} МБ, ⏱ {elapsed:.1f} с\n"
+        f"🗂 Хранится копий: {len(list_backups())} из {BACKUP_KEEP}",
+        parse_mode='Markdown'
+    )
+
+# Bulk import
+IMPORT_COLUMNS = {
+    'barbers': ['name', 'telegram_id'],
+    'services': ['category', 'name', 'price', 'duration'],
+    'appointments': ['user_id', 'client_name', 'client_phone', 'barber', 'service', 'date', 'time'],
+}
+
+def read_import_table(file_name, content):
+    if file_name.lower().endswith(('.xlsx', '.xls')):
+        df = pd.read_excel(io.BytesIO(content), dtype=str, keep_default_na=False)
+    else:
+        df = pd.read_csv(io.BytesIO(content), dtype=str, keep_default_na=False, sep=None, engine='python')
+    df.columns = [str(col).strip().lower() for col in df.columns]
+    return df
+
+def detect_import_kind(columns):
+    # Appointments are checked first: their columns are a superset of the
+    # "name"-style headers used by the other kinds
+    for kind in ('appointments', 'services', 'barbers'):
+        if all(col in columns for col in IMPORT_COLUMNS[kind]):
+            return kind
+    return None
+
+def parse_import_date(value):
+    for fmt in ('%Y-%m-%d', '%d.%m.%Y'):
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    raise ValueError(f"неверная дата '{value}'")
+
+def validate_barber_rows(records, c):
+    c.execute("SELECT telegram_id FROM barbers")
+    known_ids = {row[0] for row in c.fetchall()}
+    rows, errors = [], []
+    for line, record in records:
+        name = record['name'].strip()
+        telegram_id = record['telegram_id'].strip()
+        if not name:
+            errors.append((line, "пустое имя мастера"))
+        elif not (telegram_id.isdigit() or (telegram_id.startswith('@') and len(telegram_id) > 1)):
+            errors.append((line, f"неверный Telegram ID/username '{telegram_id}'"))
+        elif telegram_id in known_ids:
+            errors.append((line, f"мастер {telegram_id} уже существует"))
+        else:
+            known_ids.add(telegram_id)
+            rows.append((name, telegram_id, 1))
+    return rows, errors
+
+def validate_service_rows(records, c):
+    c.execute("SELECT name FROM services")
+    known_names = {row[0] for row in c.fetchall()}
+    rows, errors = [], []
+    for line, record in records:
+        name = record['name'].strip()
+        try:
+            if not name:
+                raise ValueError("пустое название услуги")
+            if name in known_names:
+                raise ValueError(f"услуга '{name}' уже существует")
+            # Prices are whole rubles; spreadsheets often export them as 1000.0
+            price = float(record['price'].replace(',', '.'))
+            if not price.is_integer():
+                raise ValueError(f"цена '{record['price']}' должна быть целым числом")
+            price = int(price)
+            duration = int(record['duration'])
+            if price < 0 or duration <= 0:
+                raise ValueError("цена и длительность должны быть положительными")
+        except ValueError as e:
+            errors.append((line, str(e)))
+            continue
+        known_names.add(name)
+        rows.append((record['category'].strip() or None, name, price, duration))
+    return rows, errors
+
+def validate_appointment_rows(records, c):
+    c.execute("SELECT id, name, telegram_id FROM barbers")
+    barber_ids = {}
+    for barber_id, name, telegram_id in c.fetchall():
+        barber_ids[name] = barber_id
+        barber_ids[telegram_id] = barber_id
+        barber_ids[str(barber_id)] = barber_id
+    c.execute("SELECT id, name FROM services")
+    service_ids = {}
+    for service_id, name in c.fetchall():
+        service_ids[name] = service_id
+        service_ids[str(service_id)] = service_id
+
+    rows, errors = [], []
+    for line, record in records:
+        try:
+            user_id = record['user_id'].strip()
+            client_name = record['client_name'].strip()
+            client_phone = record['client_phone'].strip()
+            if not user_id or not client_name or not client_phone:
+                raise ValueError("пустой user_id, имя или телефон клиента")
+            barber_id = barber_ids.get(record['barber'].strip())
+            if barber_id is None:
+                raise ValueError(f"неизвестный мастер '{record['barber']}'")
+            service_id = service_ids.get(record['service'].strip())
+            if service_id is None:
+                raise ValueError(f"неизвестная услуга '{record['service']}'")
+            date = parse_import_date(record['date'].strip())
+            time = datetime.strptime(record['time'].strip(), '%H:%M').strftime('%H:%M')
+        except ValueError as e:
+            errors.append((line, str(e)))
+            continue
+        status = record.get('status', '').strip() or None
+        rows.append((user_id, client_name, client_phone, barber_id, service_id, date, time, status))
+    return rows, errors
+
+def import_records(kind, df):
+    # Header is line 1 of the file, so data rows start at line 2
+    records = [(index + 2, record) for index, record in enumerate(df.to_dict('records'))]
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        if kind == 'barbers':
+            rows, errors = validate_barber_rows(records, c)
+        elif kind == 'services':
+            rows, errors = validate_service_rows(records, c)
+        else:
+            rows, errors = validate_appointment_rows(records, c)
+
+        # Nothing is written unless the whole file is valid, so a corrected
+        # file can simply be sent again without creating duplicates
+        if errors or not rows:
+            return 0, errors
+
+        if kind == 'barbers':
+            c.executemany("INSERT INTO barbers (name, telegram_id, is_active) VALUES (?, ?, ?)", rows)
+        elif kind == 'services':
+            categories = {row[0] for row in rows if row[0]}
+            c.executemany("INSERT OR IGNORE INTO categories (name) VALUES (?)", [(name,) for name in categories])
+            c.execute("SELECT id, name FROM categories")
+            category_ids = {name: category_id for category_id, name in c.fetchall()}
+            c.executemany(
+                "INSERT INTO services (category_id, name, price, duration) VALUES (?, ?, ?, ?)",
+                [(category_ids.get(category), name, price, duration) for category, name, price, duration in rows]
+            )
+        else:
+            now = now_local()
+            today, current_time = now.strftime('%Y-%m-%d'), now.strftime('%H:%M')
+            archived_at = now.strftime('%Y-%m-%d %H:%M:%S')
+            past, upcoming = [], []
+            for user_id, client_name, client_phone, barber_id, service_id, date, time, status in rows:
+                if date < today or (date == today and time < current_time):
+                    past.append((user_id, client_name, client_phone, barber_id, service_id, date, time,
+                                 status or 'completed', archived_at))
+                else:
+                    upcoming.append((user_id, client_name, client_phone, barber_id, service_id, date, time,
+                                     status or 'pending', day_number(date), to_minutes(time)))
+            first_id = reserve_appointment_ids(c, len(past))
+            c.executemany(
+                "INSERT INTO archive_appointments (id, user_id, client_name, client_phone, barber_id, service_id, date, time, status, archived_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(first_id + index,) + row for index, row in enumerate(past)]
+            )
+            fill_archive_totals(c)
+            c.executemany(
+                "INSERT INTO appointments (user_id, client_name, client_phone, barber_id, service_id, date, time, status, day_num, start_min) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                upcoming
+            )
+        conn.commit()
+        return len(rows), []
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# Per-update logging context
+async def bind_update_context(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Set first thing for every update, so every handler group and every task
+    # started while handling it sees this update's values
+    current_update_id.set(update.update_id)
+    current_user_id.set(update.effective_user.id if update.effective_user else None)
+
+# Flood protection
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, now):
+        self.tokens = float(FLOOD_BURST)
+        self.updated = now
+
+    def consume(self, now):
+        self.tokens = min(FLOOD_BURST, self.tokens + (now - self.updated) * FLOOD_RATE)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+flood_buckets = {}
+last_callbacks = {}
+
+async def flood_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Registered in group -1, so it runs before any other handler; raising
+    # ApplicationHandlerStop drops the update before it touches the database
+    user = update.effective_user
+    if user is None or str(user.id) in ADMIN_IDS:
+        return
+
+    now = monotonic()
+    query = update.callback_query
+    if query:
+        tap = (query.message.message_id if query.message else query.inline_message_id, query.data)
+        previous = last_callbacks.get(user.id)
+        last_callbacks[user.id] = (tap, now)
+        if previous and previous[0] == tap and now - previous[1] < DUPLICATE_CALLBACK_WINDOW:
+            await query.answer()
+            raise ApplicationHandlerStop
+
+    bucket = flood_buckets.get(user.id)
+    if bucket is None:
+        bucket = flood_buckets[user.id] = TokenBucket(now)
+    if not bucket.consume(now):
+        logger.debug("flood_guard: Dropped update %s from user %s", update.update_id, user.id)
+        if query:
+            await query.answer("⏳ Слишком часто, подождите немного")
+        raise ApplicationHandlerStop
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    # Global cap on concurrent update processing. Updates from different
+    # users run side by side, at most MAX_CONCURRENT_UPDATES at a time, while
+    # one user's updates run strictly in order, so conversation state never
+    # sees two of them at once. An update waiting behind its own user's
+    # previous one does not take a running slot, so a flooding client cannot
+    # crowd out everyone else before flood_guard drops its excess.
+    def __init__(self, max_concurrent_updates, max_pending_updates):
+        super().__init__(max_pending_updates)
+        self.running = asyncio.Semaphore(max_concurrent_updates)
+        self.users = {}  # user or chat id -> [lock, updates in flight]
+
+    async def do_process_update(self, update, coroutine):
+        key = None
+        if isinstance(update, Update):
+            key = update.effective_user.id if update.effective_user else (
+                update.effective_chat.id if update.effective_chat else None)
+        entry = self.users.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], self.running:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.users[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+async def prune_flood_state_job(context: ContextTypes.DEFAULT_TYPE):
+    now = monotonic()
+    idle = FLOOD_BURST / FLOOD_RATE
+    for user_id in [uid for uid, bucket in flood_buckets.items() if now - bucket.updated > idle]:
+        del flood_buckets[user_id]
+    for user_id in [uid for uid, (_, tapped) in last_callbacks.items() if now - tapped > DUPLICATE_CALLBACK_WINDOW]:
+        del last_callbacks[user_id]
+    rate_limiter.forget_idle_chats()
+    slot_holds.prune()
+
+# Outbound Telegram API rate limiting
+class BarbershopRateLimiter(BaseRateLimiter):
+    # Edits of a message that is already waiting for its turn are merged
+    # into the waiting request: only the newest content gets sent
+    COALESCED_ENDPOINTS = ('editMessageText', 'editMessageReplyMarkup', 'editMessageCaption')
+
+    def __init__(self):
+        self.global_next = 0.0
+        self.chat_next = {}
+        self.pending_edits = {}
+        self.queued = 0
+        self.in_flight = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.retries = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        return {
+            'queued': self.queued,
+            'in_flight': self.in_flight,
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'retries': self.retries,
+            'chats_tracked': len(self.chat_next),
+        }
+
+    def reserve(self, chat_id):
+        # Hands out send times instead of holding locks, so waiting requests
+        # sleep independently and keep their arrival order. Only groups have a
+        # per-chat limit; private chats share the global one.
+        now = monotonic()
+        start = max(now, self.global_next)
+        # A group waiting for its own slot must not hold up everyone else
+        self.global_next = start + 1 / TELEGRAM_GLOBAL_RATE
+        if chat_id is not None and (isinstance(chat_id, str) or chat_id < 0):
+            start = max(start, self.chat_next.get(chat_id, 0.0))
+            self.chat_next[chat_id] = start + 1 / TELEGRAM_GROUP_CHAT_RATE
+        return start - now
+
+    def forget_idle_chats(self):
+        now = monotonic()
+        for chat_id in [cid for cid, next_time in self.chat_next.items() if next_time < now]:
+            del self.chat_next[chat_id]
+
+    def record_call(self, endpoint, started, failed=False):
+        metrics.observe('barbershop_telegram_api_seconds', endpoint, monotonic() - started)
+        if failed:
+            metrics.inc('barbershop_telegram_api_errors_total', endpoint)
+
+    async def send(self, endpoint, callback, args, kwargs):
+        self.in_flight += 1
+        try:
+            for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+                started = monotonic()
+                try:
+                    result = await callback(*args, **kwargs)
+                except RetryAfter as e:
+                    self.record_call(endpoint, started, failed=True)
+                    if attempt == TELEGRAM_MAX_RETRIES:
+                        raise
+                    self.retries += 1
+                    pause = max(float(e.retry_after), 0.5 * 2 ** attempt)
+                    logger.warning("BarbershopRateLimiter: %s hit flood control, retrying in %.1fs", endpoint, pause)
+                    # Push back everything queued behind this request as well
+                    self.global_next = max(self.global_next, monotonic() + pause)
+                    await asyncio.sleep(pause)
+                    continue
+                except Exception:
+                    self.record_call(endpoint, started, failed=True)
+                    raise
+                self.record_call(endpoint, started)
+                self.sent += 1
+                return result
+        finally:
+            self.in_flight -= 1
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        # Answers to callback/inline queries and read-only calls are not
+        # subject to the messaging limits and must not be delayed
+        if endpoint.startswith(('answer', 'get')):
+            return await self.send(endpoint, callback, args, kwargs)
+
+        chat_id = data.get('chat_id')
+        edit_key = None
+        if endpoint in self.COALESCED_ENDPOINTS and chat_id is not None:
+            edit_key = (endpoint, chat_id, data.get('message_id'))
+            pending = self.pending_edits.get(edit_key)
+            if pending is not None:
+                pending[0] = (callback, args, kwargs)
+                self.coalesced += 1
+                return await asyncio.shield(pending[1])
+            pending = [(callback, args, kwargs), asyncio.get_running_loop().create_future()]
+            # Nobody may be waiting on the shared result, so mark it retrieved
+            pending[1].add_done_callback(lambda future: future.cancelled() or future.exception())
+            self.pending_edits[edit_key] = pending
+
+        try:
+            self.queued += 1
+            try:
+                delay = self.reserve(chat_id)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            finally:
+                self.queued -= 1
+                if edit_key:
+                    # Edits arriving from now on start a new queue entry
+                    del self.pending_edits[edit_key]
+
+            if not edit_key:
+                return await self.send(endpoint, callback, args, kwargs)
+
+            callback, args, kwargs = pending[0]
+            try:
+                result = await self.send(endpoint, callback, args, kwargs)
+            except Exception as e:
+                pending[1].set_exception(e)
+                raise
+            pending[1].set_result(result)
+            return result
+        finally:
+            # The request that owns the merged edit was cancelled: release
+            # the requests merged into it instead of leaving them waiting
+            if edit_key and not pending[1].done():
+                pending[1].cancel()
+
+rate_limiter = BarbershopRateLimiter()
+
+# Notification outbox
+# Notifications are written to the outbox in the same transaction as the
+# change they report, then delivered by a background dispatcher. A crash
+# between commit and send only delays a message; at worst a message whose
+# send succeeded right before a crash is delivered twice.
+outbox_wakeup = asyncio.Event()
+
+def enqueue_notification(c, chat_id, text, reply_markup=None):
+    if not chat_id:
+        return
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    markup = json.dumps(reply_markup.to_dict()) if reply_markup else None
+    c.execute(
+        "INSERT INTO outbox (chat_id, text, reply_markup, status, attempts, created_at, next_attempt_at) "
+        "VALUES (?, ?, ?, 'pending', 0, ?, ?)",
+        (str(chat_id), text, markup, now, now)
+    )
+
+def barber_chat_id(c, barber_id):
+    # Barbers registered by @username cannot be messaged until they share an id
+    c.execute("SELECT telegram_id FROM barbers WHERE id = ?", (barber_id,))
+    result = c.fetchone()
+    return result[0] if result and result[0].isdigit() else None
+
+def enqueue_barber_notification(c, appointment_id, title):
+    c.execute(
+        f"SELECT a.barber_id, a.date, a.time, a.client_name, a.client_phone, {APPOINTMENT_SERVICES_SQL} "
+        "FROM appointments a JOIN services s ON a.service_id = s.id WHERE a.id = ?",
+        (appointment_id,)
+    )
+    barber_id, date, time, client_name, client_phone, service = c.fetchone()
+    enqueue_notification(
+        c, barber_chat_id(c, barber_id),
+        f"{title}\n\n"
+        f"📅 {datetime.strptime(date, '%Y-%m-%d'):%d.%m.%Y} в {time}\n"
+        f"👤 {escape_markdown(client_name)}, {escape_markdown(client_phone)}\n"
+        f"💇 {escape_markdown(service)}"
+    )
+
+def claim_outbox_batch(limit):
+    now = datetime.now()
+    lease = (now + timedelta(seconds=OUTBOX_LEASE_SECONDS)).strftime('%Y-%m-%d %H:%M:%S')
+    now = now.strftime('%Y-%m-%d %H:%M:%S')
+    conn = get_db_connection()
+    c = conn.cursor()
+    # The lease keeps a second dispatcher off these rows; if this one dies
+    # mid-batch they become claimable again once it expires
+    c.execute("BEGIN IMMEDIATE")
+    c.execute(
+        "SELECT id, chat_id, text, reply_markup, attempts FROM outbox "
+        "WHERE status = 'pending' AND next_attempt_at <= ? AND (locked_until IS NULL OR locked_until <= ?) "
+        "ORDER BY id LIMIT ?",
+        (now, now, limit)
+    )
+    rows = c.fetchall()
+    c.executemany("UPDATE outbox SET locked_until = ? WHERE id = ?", [(lease, row[0]) for row in rows])
+    conn.commit()
+    conn.close()
+    return rows
+
+def finish_outbox_batch(results):
+    now = datetime.now()
+    sent, retried, failed = [], [], []
+    for outbox_id, attempts, outcome, error in results:
+        if outcome == 'sent':
+            sent.append((now.strftime('%Y-%m-%d %H:%M:%S'), outbox_id))
+        elif outcome == 'retry' and attempts + 1 < OUTBOX_MAX_ATTEMPTS:
+            next_attempt = now + timedelta(seconds=OUTBOX_RETRY_BASE * 2 ** attempts)
+            retried.append((error, next_attempt.strftime('%Y-%m-%d %H:%M:%S'), outbox_id))
+        else:
+            failed.append((error, outbox_id))
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.executemany("UPDATE outbox SET status = 'sent', sent_at = ?, locked_until = NULL WHERE id = ?", sent)
+    c.executemany(
+        "UPDATE outbox SET attempts = attempts + 1, last_error = ?, next_attempt_at = ?, locked_until = NULL WHERE id = ?",
+        retried
+    )
+    c.executemany(
+        "UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ?, locked_until = NULL WHERE id = ?",
+        failed
+    )
+    conn.commit()
+    conn.close()
+    for outcome, rows in (('sent', sent), ('retry', retried), ('failed', failed)):
+        if rows:
+            metrics.inc('barbershop_outbox_messages_total', outcome, len(rows))
+
+def prune_outbox():
+    cutoff = (datetime.now() - timedelta(days=OUTBOX_KEEP_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("DELETE FROM outbox WHERE status != 'pending' AND created_at < ?", (cutoff,))
+    conn.commit()
+    conn.close()
+
+async def deliver_outbox_message(bot, outbox_id, chat_id, text, markup, attempts):
+    reply_markup = InlineKeyboardMarkup.de_json(json.loads(markup), bot) if markup else None
+    try:
+        await bot.send_message(chat_id, text, reply_markup=reply_markup, parse_mode='Markdown')
+        return outbox_id, attempts, 'sent', None
+    except (telegram.error.Forbidden, telegram.error.BadRequest) as e:
+        # Blocked bot or unknown chat: retrying cannot help
+        return outbox_id, attempts, 'failed', str(e)
+    except telegram.error.TelegramError as e:
+        return outbox_id, attempts, 'retry', str(e)
+
+async def dispatch_outbox(bot):
+    rows = await asyncio.to_thread(claim_outbox_batch, OUTBOX_BATCH_SIZE)
+    if not rows:
+        return 0
+    # Sends go out concurrently; rate_limiter paces them per chat and globally
+    results = await asyncio.gather(*(deliver_outbox_message(bot, *row) for row in rows))
+    await asyncio.to_thread(finish_outbox_batch, results)
+    return len(rows)
+
+async def run_outbox_dispatcher(bot):
+    while True:
+        outbox_wakeup.clear()
+        try:
+            claimed = await dispatch_outbox(bot)
+        except Exception:
+            logger.exception("run_outbox_dispatcher: Dispatch failed")
+            claimed = 0
+        if claimed == OUTBOX_BATCH_SIZE:
+            continue  # more is probably waiting
+        try:
+            await asyncio.wait_for(outbox_wakeup.wait(), OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+@subscribe(AppointmentBooked, AppointmentCancelled)
+def wake_outbox(event):
+    outbox_wakeup.set()
+
+# Paginated lists
+# Keyset pagination over (date, time, id): a page button carries the key of
+# the row it continues from, so every page is one index range scan no matter
+# how deep into the list it is
+def page_key(appt_id, date, time):
+    return f"{date}_{time}_{appt_id}"
+
+def parse_page_request(data, prefix):
+    # 'prefix' -> first page, 'prefix_n_<key>' -> after key, 'prefix_p_<key>' -> before key
+    if not data.startswith(f'{prefix}_'):
+        return None, False
+    direction, _, key = data[len(prefix) + 1:].partition('_')
+    date, time, appt_id = key.split('_')
+    return (date, time, int(appt_id)), direction == 'p'
+
+def page_navigation(prefix, first_key, last_key, has_prev, has_next):
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton("◀️", callback_data=f'{prefix}_p_{first_key}'))
+    if has_next:
+        buttons.append(InlineKeyboardButton("▶️", callback_data=f'{prefix}_n_{last_key}'))
+    return [buttons] if buttons else []
+
+def fetch_appointments_page(where, params, cursor=None, backwards=False):
+    # Pending appointments in (date, time, id) order. Returns the page rows
+    # (id, date, time, client_name, barber, services) and whether rows exist
+    # beyond it in the direction of travel.
+    comparison, direction = ('<', 'DESC') if backwards else ('>', 'ASC')
+    conditions, params = [where], list(params)
+    if cursor:
+        date, time, appt_id = cursor
+        conditions.append(f"(a.day_num, a.start_min, a.id) {comparison} (?, ?, ?)")
+        params += [day_number(date), to_minutes(time), appt_id]
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        f"SELECT a.id, a.date, a.time, a.client_name, b.name, {APPOINTMENT_SERVICES_SQL} FROM appointments a "
+        "JOIN barbers b ON a.barber_id = b.id JOIN services s ON a.service_id = s.id "
+        f"WHERE {' AND '.join(conditions)} "
+        f"ORDER BY a.day_num {direction}, a.start_min {direction}, a.id {direction} LIMIT ?",
+        params + [LIST_PAGE_SIZE + 1]
+    )
+    rows = c.fetchall()
+    conn.close()
+    more = len(rows) > LIST_PAGE_SIZE
+    rows = rows[:LIST_PAGE_SIZE]
+    if backwards:
+        rows.reverse()
+    return rows, more
+
+def fetch_history_page(where, params, cursor=None, backwards=False):
+    # Archived appointments, newest first, across the hot table and the cold
+    # monthly files. The cursor date also bounds which cold months are opened.
+    if backwards:
+        rows = fetch_archive_appointments(
+            f"({where}) AND (date, time, id) > (?, ?, ?)", list(params) + list(cursor),
+            date_from=cursor[0], limit=LIST_PAGE_SIZE + 1
+        )
+    elif cursor:
+        rows = fetch_archive_appointments(
+            f"({where}) AND (date, time, id) < (?, ?, ?)", list(params) + list(cursor),
+            date_to=cursor[0], descending=True, limit=LIST_PAGE_SIZE + 1
+        )
+    else:
+        rows = fetch_archive_appointments(where, params, descending=True, limit=LIST_PAGE_SIZE + 1)
+    more = len(rows) > LIST_PAGE_SIZE
+    rows = rows[:LIST_PAGE_SIZE]
+    if backwards:
+        rows.reverse()
+    return rows, more
+
+def page_flags(cursor, backwards, more):
+    # (has_prev, has_next) of a page reached from cursor
+    if backwards:
+        return more, True
+    return cursor is not None, more
+
+def format_history_rows(rows, show_client=False):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT id, name FROM barbers")
+    barber_names = dict(c.fetchall())
+    conn.close()
+    status_marks = {'completed': '✅', 'cancelled': '❌'}
+    lines = []
+    for (appt_id, user_id, client_name, client_phone, barber_id, service_id, date, time, status, archived_at,
+            services, duration, price) in rows:
+        who = client_name if show_client else barber_names.get(barber_id, '—')
+        total = f", {price}₽" if price is not None else ""
+        lines.append(
+            f"{status_marks.get(status, '•')} {datetime.strptime(date, '%Y-%m-%d'):%d.%m.%Y} {time} — "
+            f"{escape_markdown(who)}, {escape_markdown(services or '—')}{total}"
+        )
+    return lines
+
+# Client Menu
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message:
+        user = update.effective_user
+    else:
+        query = update.callback_query
+        await query.answer()
+        user = query.from_user
+
+    if update.message and context.args and await open_start_link(update, context, context.args[0]):
+        return
+    
+    keyboard = [
+        [
+            InlineKeyboardButton("📅 Записаться на стрижку", callback_data='book_appointment'),
+            InlineKeyboardButton("📋 Мои записи", callback_data='my_appointments')
+        ],
+        [InlineKeyboardButton("🕒 Часы работы", callback_data='working_hours')],
+        [
+            InlineKeyboardButton("ℹ️ О нас", callback_data='about_us'),
+            InlineKeyboardButton("💬 Поддержка", callback_data='support_info')
+        ]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    if update.message:
+        await update.message.reply_text(WELCOME_MESSAGE, reply_markup=reply_markup, parse_mode='Markdown')
+    else:
+        await query.edit_message_text(WELCOME_MESSAGE, reply_markup=reply_markup, parse_mode='Markdown')
+    
+    if is_admin(update):
+        if update.message:
+            await update.message.reply_text("👑 *Вы администратор!* Введите /admin для доступа к панели управления.", parse_mode='Markdown')
+    if is_barber(update):
+        if update.message:
+            await update.message.reply_text("💇‍♂️ *Вы мастер!* Введите /barber для доступа к меню мастера.", parse_mode='Markdown')
+
+async def about_us(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    about_text = (
+        "💈 *О нашем барбершопе* 💈\n\n"
+        "Мы - команда профессионалов, которые любят своё дело! "
+        "Создаём стильные стрижки и комфортную атмосферу. "
+        "Приходите, чтобы почувствовать себя на высоте! 😊\n\n"
+        "📍 Адрес: ул. Примерная, д. 10\n"
+        "📞 Телефон: +79991234567\n\n"
+        f"💬 Техническая поддержка и разработка: @werybos\n"
+        "🌐 Поддержка: Русский, English"
+    )
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='back_to_start')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(about_text, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def working_hours(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT value FROM settings WHERE key = 'working_hours'")
+    row = c.fetchone()
+    c.execute("SELECT id FROM barbers WHERE is_active = 1 ORDER BY id")
+    barber_ids = [row[0] for row in c.fetchall()]
+    conn.close()
+
+    text = f"🕒 *Часы работы*\n\n{escape_markdown(row[0] if row else DEFAULT_WORKING_HOURS)}"
+    barbers = [barber for barber in map(load_barber, barber_ids) if barber]
+    if barbers:
+        text += "\n\n💇‍♂️ *Мастера:*\n" + "\n".join(
+            f"• {escape_markdown(barber.name)}: {escape_markdown(barber.schedule.days)}, {barber.schedule.hours}"
+            for barber in barbers
+        )
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='back_to_start')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def support_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    support_text = (
+        "💬 *Техническая поддержка и разработка* 💬\n\n"
+        "🛠️ **Индивидуальная разработка:**\n"
+        "• Настройка под ваши потребности\n"
+        "• Добавление новых функций\n"
+        "• Интеграция с внешними системами\n"
+        "• Кастомизация интерфейса\n\n"
+        "🔧 **Техническая поддержка:**\n"
+        "• Помощь с установкой и настройкой\n"
+        "• Решение технических проблем\n"
+        "• Консультации по использованию\n"
+        "• Обновления и улучшения\n\n"
+        "📞 **Связь с разработчиком:**\n"
+        f"Telegram: @werybos\n\n"
+        "🌐 **Поддерживаемые языки:**\n"
+        "Русский, English\n\n"
+        "⚡ Быстрый отклик и профессиональный подход!"
+    )
+    keyboard = [[InlineKeyboardButton("📱 Написать в Telegram", url="https://t.me/werybos")],
+                [InlineKeyboardButton("🔙 Назад", callback_data='back_to_start')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(support_text, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def book_appointment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    context.user_data.pop('preset_service', None)
+    
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("SELECT id, name FROM barbers WHERE is_active = 1")
+        barbers = c.fetchall()
+        
+        if not barbers:
+            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='back_to_start')]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await query.edit_message_text(
+                "❌ *Нет доступных мастеров.* Обратитесь к администратору.",
+                reply_markup=reply_markup,
+                parse_mode='Markdown'
+            )
+            return
+        
+        keyboard = [[InlineKeyboardButton(name, callback_data=f"barber_{id}")] for id, name in barbers]
+        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='back_to_start')])
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await query.edit_message_text(
+            "💇‍♂️ *Выберите мастера:*",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+    finally:
+        conn.close()
+
+async def select_date_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    barber_id = query.data.split('_')[1]
+    context.user_data['barber_id'] = barber_id
+    release_slot_hold(context, query.from_user.id)
+    await query.edit_message_text("📅 *Выберите день записи:*", reply_markup=date_picker_keyboard(), parse_mode='Markdown')
+
+async def select_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    date_choice = query.data.split('_', 1)[1]
+    today = now_local()
+    if date_choice == 'today':
+        context.user_data['date'] = today.strftime('%Y-%m-%d')
+    elif date_choice == 'tomorrow':
+        context.user_data['date'] = (today + timedelta(days=1)).strftime('%Y-%m-%d')
+    elif date_choice == 'other':
+        await query.edit_message_text(
+            "📅 *Выберите дату* (· — нет свободного времени):",
+            reply_markup=calendar_keyboard(context.user_data['barber_id'], today.strftime('%Y-%m')),
+            parse_mode='Markdown'
+        )
+        return
+    else:
+        context.user_data['date'] = date_choice
+    
+    time_slots = get_available_time_slots(context.user_data['barber_id'], context.user_data['date'])
+    if not time_slots:
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text("😔 Нет доступного времени на выбранный день.", reply_markup=reply_markup, parse_mode='Markdown')
+        return
+    
+    reply_markup = time_slot_keyboard(context, time_slots, query.from_user.id)
+    await query.edit_message_text("⏰ *Выберите время (❌ - занято):*", reply_markup=reply_markup, parse_mode='Markdown')
+
+MONTH_NAMES = ['Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь',
+               'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
+
+def shift_month(month, months):
+    year, month_num = map(int, month.split('-'))
+    index = year * 12 + month_num - 1 + months
+    return f"{index // 12}-{index % 12 + 1:02d}"
+
+def calendar_keyboard(barber_id, month):
+    # Days with a free slot are buttons that pick the date directly; full and
+    # past days are inert. Built from one cached bitmask per barber and month.
+    today = now_local().strftime('%Y-%m-%d')
+    current_month = today[:7]
+    mask = get_month_availability(barber_id, month)
+    year, month_num = map(int, month.split('-'))
+
+    keyboard = [
+        [InlineKeyboardButton(f"{MONTH_NAMES[month_num - 1]} {year}", callback_data='cal_ignore')],
+        [InlineKeyboardButton(day, callback_data='cal_ignore') for day in ('Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс')]
+    ]
+    for week in calendar.monthcalendar(year, month_num):
+        row = []
+        for day in week:
+            date = f"{month}-{day:02d}"
+            if day == 0 or date < today:
+                row.append(InlineKeyboardButton(" ", callback_data='cal_ignore'))
+            elif mask & (1 << (day - 1)):
+                row.append(InlineKeyboardButton(str(day), callback_data=f'date_{date}'))
+            else:
+                row.append(InlineKeyboardButton("·", callback_data='cal_full'))
+        keyboard.append(row)
+
+    navigation = []
+    if month > current_month:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f'cal_{shift_month(month, -1)}'))
+    if month < shift_month(current_month, CALENDAR_MONTHS_AHEAD):
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f'cal_{shift_month(month, 1)}'))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{barber_id}')])
+    return InlineKeyboardMarkup(keyboard)
+
+async def show_calendar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if query.data == 'cal_ignore':
+        await query.answer()
+        return
+    if query.data == 'cal_full':
+        await query.answer("😔 На этот день нет свободного времени")
+        return
+    await query.answer()
+    await query.edit_message_reply_markup(calendar_keyboard(context.user_data['barber_id'], query.data.split('_')[1]))
+
+async def select_service(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    time_choice = query.data.split('_')[1]
+    if time_choice == 'booked':
+        keyboard = [
+            [InlineKeyboardButton("🔔 Лист ожидания", callback_data='waitlist_join')],
+            [InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text(
+            "❌ Это время уже занято. Выберите другое или встаньте в лист ожидания.",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+        return
+    
+    context.user_data.pop('waitlist_id', None)
+    if not slot_holds.acquire(int(context.user_data['barber_id']), context.user_data['date'], time_choice, query.from_user.id):
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text(
+            "⏳ Это время только что выбрал другой клиент. Выберите другое.",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+        return
+    context.user_data['time'] = time_choice
+    context.user_data['basket'] = []
+    await ask_service(query, context)
+
+async def ask_service(query, context: ContextTypes.DEFAULT_TYPE):
+    # Free chair time from the chosen start is computed once; the service
+    # lists only offer what still fits into it
+    context.user_data['free_minutes'] = free_run_minutes(
+        int(context.user_data['barber_id']), context.user_data['date'], context.user_data['time'], query.from_user.id
+    )
+    context.user_data.pop('category_id', None)
+    # A service chosen through a deep link goes straight into the basket
+    service = get_services().get(context.user_data.pop('preset_service', None))
+    if service and service.duration <= context.user_data['free_minutes']:
+        context.user_data['basket'] = [service.id]
+    await show_service_categories(query, context)
+
+async def show_service_categories(query, context: ContextTypes.DEFAULT_TYPE):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT id, name FROM categories")
+    categories = c.fetchall()
+    
+    if not categories:
+        services = list(get_services().values())
+        if not services:
+            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await query.edit_message_text("😔 Нет доступных услуг.", reply_markup=reply_markup, parse_mode='Markdown')
+            conn.close()
+            return
+        
+        keyboard = service_keyboard(context, services)
+        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')])
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text(service_prompt(context), reply_markup=reply_markup, parse_mode='Markdown')
+    else:
+        keyboard = [[InlineKeyboardButton(name, callback_data=f'category_{id}')] for id, name in categories]
+        if context.user_data.get('basket'):
+            keyboard.append(basket_done_button(context))
+        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')])
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        text = "📋 *Выберите категорию услуг:*" + basket_text(context)
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    
+    conn.close()
+
+def get_basket(context: ContextTypes.DEFAULT_TYPE):
+    # Services picked for this booking, in the order they were picked
+    services = get_services()
+    return [services[service_id] for service_id in context.user_data.get('basket', []) if service_id in services]
+
+def basket_text(context: ContextTypes.DEFAULT_TYPE):
+    services = get_basket(context)
+    if not services:
+        return ""
+    names = ' + '.join(service.name for service in services)
+    return (
+        f"\n\n🧺 *В записи:* {names} — {sum(service.price for service in services)}₽, "
+        f"{sum(service.duration for service in services)} мин"
+        "\n➕ добавляет услугу в эту же запись"
+    )
+
+def basket_done_button(context: ContextTypes.DEFAULT_TYPE):
+    return [InlineKeyboardButton(f"➡️ Далее ({len(context.user_data['basket'])} усл.)", callback_data='service_done')]
+
+def service_prompt(context: ContextTypes.DEFAULT_TYPE):
+    return "✂️ *Выберите услугу:*" + basket_text(context)
+
+def service_keyboard(context: ContextTypes.DEFAULT_TYPE, services):
+    basket = context.user_data.setdefault('basket', [])
+    taken = sum(service.duration for service in get_basket(context))
+    remaining = context.user_data.get('free_minutes', 0) - taken
+    keyboard = []
+    for service in services:
+        label = f"{service.name} ({service.price}₽, {service.duration} мин)"
+        if service.id in basket:
+            keyboard.append([
+                InlineKeyboardButton(f"✅ {label}", callback_data='service_done'),
+                InlineKeyboardButton("➖", callback_data=f'basket_{service.id}')
+            ])
+        elif service.duration <= remaining:
+            keyboard.append([
+                InlineKeyboardButton(label, callback_data=f'service_{service.id}'),
+                InlineKeyboardButton("➕", callback_data=f'basket_{service.id}')
+            ])
+    if basket:
+        keyboard.append(basket_done_button(context))
+    return keyboard
+
+async def toggle_basket_service(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    service_id = int(query.data.split('_')[1])
+    basket = context.user_data.setdefault('basket', [])
+    if service_id in basket:
+        basket.remove(service_id)
+    else:
+        basket.append(service_id)
+    await show_services(query, context)
+
+async def show_categories(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    context.user_data.pop('category_id', None)
+    await show_service_categories(query, context)
+
+async def show_services(query, context: ContextTypes.DEFAULT_TYPE):
+    category_id = context.user_data.get('category_id')
+    if category_id is None:
+        await show_service_categories(query, context)
+        return
+    services = [service for service in get_services().values() if str(service.category_id) == str(category_id)]
+    
+    if not services:
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='categories_list')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text("😔 В этой категории нет услуг.", reply_markup=reply_markup, parse_mode='Markdown')
+        return
+    
+    keyboard = service_keyboard(context, services)
+    keyboard.append([InlineKeyboardButton("📋 Другие категории", callback_data='categories_list')])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='book_appointment')])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(service_prompt(context), reply_markup=reply_markup, parse_mode='Markdown')
+
+async def select_service_from_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    category_id = query.data.split('_')[1]
+    context.user_data['category_id'] = category_id
+    await show_services(query, context)
+
+def service_back_callback(context: ContextTypes.DEFAULT_TYPE):
+    category_id = context.user_data.get('category_id')
+    return f'category_{category_id}' if category_id else 'categories_list'
+
+async def request_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    choice = query.data.split('_')[1]
+    basket = context.user_data.setdefault('basket', [])
+    if choice != 'done' and int(choice) not in basket:
+        basket.append(int(choice))
+    services = get_basket(context)
+    duration = sum(service.duration for service in services)
+    free_minutes = free_run_minutes(
+        int(context.user_data['barber_id']), context.user_data['date'], context.user_data['time'], query.from_user.id
+    )
+    if not services or duration > free_minutes:
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text(
+            f"😔 Выбранные услуги ({duration} мин) не помещаются: с {context.user_data['time']} свободно {free_minutes} мин. "
+            "Выберите другое время.",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+        return ConversationHandler.END
+    # The hold grows from the start slot to the basket's whole interval
+    if not slot_holds.acquire(int(context.user_data['barber_id']), context.user_data['date'],
+                              context.user_data['time'], query.from_user.id, duration):
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text(
+            "⏳ Часть этого времени только что выбрал другой клиент. Выберите другое.",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+        return ConversationHandler.END
+    # The first service stays in appointments.service_id; the full basket goes to appointment_services
+    context.user_data['service_id'] = str(services[0].id)
+    
+    profile = get_client_profile(query.from_user.id)
+    if profile:
+        name, phone = profile
+        keyboard = [
+            [InlineKeyboardButton("✅ Записаться", callback_data='use_profile')],
+            [InlineKeyboardButton("✏️ Другие имя и телефон", callback_data='enter_details')],
+            [InlineKeyboardButton("🔙 Назад", callback_data=service_back_callback(context))]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text(
+            f"✂️ *Вы выбрали:* {' + '.join(service.name for service in services)} "
+            f"({sum(service.price for service in services)}₽, {duration} мин)\n\n"
+            f"👤 *Имя:* {escape_markdown(name)}\n📞 *Телефон:* {escape_markdown(phone)}",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+        return CONFIRM_PROFILE
+    return await ask_name(query, context)
+
+async def ask_name(query, context: ContextTypes.DEFAULT_TYPE):
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=service_back_callback(context))]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text("👤 *Введите ваше имя:*", reply_markup=reply_markup, parse_mode='Markdown')
+    context.user_data['awaiting_name'] = True
+    return ENTER_NAME
+
+async def enter_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    return await ask_name(query, context)
+
+async def use_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    profile = get_client_profile(query.from_user.id)
+    if not profile:
+        return await ask_name(query, context)
+    context.user_data['client_name'], context.user_data['client_phone'] = profile
+    return await finalize_booking(update, context)
+
+async def handle_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.user_data.get('awaiting_name'):
+        return
+    
+    client_name = update.message.text.strip()
+    if not client_name:
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=service_back_callback(context))]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await update.message.reply_text("❌ *Имя не может быть пустым.* Введите ваше имя:", reply_markup=reply_markup, parse_mode='Markdown')
+        return ENTER_NAME
+    
+    context.user_data['client_name'] = client_name
+    context.user_data['awaiting_name'] = False
+    
+    services = get_basket(context)
+    service_name = ' + '.join(service.name for service in services)
+    price = sum(service.price for service in services)
+    duration = sum(service.duration for service in services)
+    
+    confirmation_text = (
+        f"✂️ *Вы выбрали:* {service_name} ({price}₽, {duration} мин)\n\n"
+        f"👤 *Имя:* {client_name}\n\n"
+        "📞 *Введите ваш номер телефона* для подтверждения записи (например, +79991234567):"
+    )
+    
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=service_back_callback(context))]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await update.message.reply_text(confirmation_text, reply_markup=reply_markup, parse_mode='Markdown')
+    context.user_data['awaiting_phone'] = True
+    return ENTER_PHONE
+
+async def handle_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.user_data.get('awaiting_phone'):
+        return
+    
+    phone = update.message.text.strip()
+    cleaned_phone = ''.join(c for c in phone if c.isdigit() or c == '+')
+    
+    if not cleaned_phone.startswith('+') or len(cleaned_phone) < 8:
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=service_back_callback(context))]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await update.message.reply_text(
+            "❌ *Неверный формат номера.* Пример: +79991234567",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+        return ENTER_PHONE
+    
+    context.user_data['client_phone'] = cleaned_phone
+    context.user_data['awaiting_phone'] = False
+    return await finalize_booking(update, context)
+
+async def finalize_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Shared by the phone step and the one-tap confirmation of a saved profile
+    user = update.effective_user
+    message = update.effective_message
+    client_name, cleaned_phone = context.user_data['client_name'], context.user_data['client_phone']
+    barber_id, date, time = int(context.user_data['barber_id']), context.user_data['date'], context.user_data['time']
+    services = get_basket(context)
+    service_name = ' + '.join(service.name for service in services)
+    price = sum(service.price for service in services)
+    duration = sum(service.duration for service in services)
+    start = to_minutes(time)
+    
+    conn = get_db_connection()
+    c = conn.cursor()
+    busy = day_busy_mask(c, barber_id, date)
+    # Slots offered to other waitlisted clients stay theirs until the offer expires
+    for offered in get_offered_slots(barber_id, date, user.id):
+        busy |= minute_mask(to_minutes(offered), to_minutes(offered) + SLOT_MINUTES)
+    if (busy & minute_mask(start, start + duration) or on_time_off(barber_id, day_number(date))
+            or not slot_holds.acquire(barber_id, date, time, user.id, duration)):
+        conn.close()
+        release_slot_hold(context, user.id)
+        keyboard = [[InlineKeyboardButton("🔙 Выбрать другое время", callback_data=f'barber_{barber_id}')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await message.reply_text("😔 *Это время уже заняли.* Выберите другое.", reply_markup=reply_markup, parse_mode='Markdown')
+        return ConversationHandler.END
+    c.execute(
+        "INSERT INTO appointments (user_id, client_name, client_phone, barber_id, service_id, date, time, status, duration, price, day_num, start_min) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (str(user.id), client_name, cleaned_phone, 
+         barber_id, int(context.user_data['service_id']), date, time, 'pending', duration, price, day_number(date), start)
+    )
+    appointment_id = c.lastrowid
+    save_client_profile(c, user.id, client_name, cleaned_phone)
+    c.executemany(
+        "INSERT INTO appointment_services (appointment_id, service_id) VALUES (?, ?)",
+        [(appointment_id, service.id) for service in services]
+    )
+    enqueue_barber_notification(c, appointment_id, "🆕 *Новая запись*")
+    if context.user_data.get('waitlist_id'):
+        c.execute("UPDATE waitlist SET status = 'booked' WHERE id = ?", (context.user_data.pop('waitlist_id'),))
+    conn.commit()
+    client_profiles[str(user.id)] = (client_name, cleaned_phone)
+    slot_holds.release(user.id)
+    event_bus.publish(context.bot, AppointmentBooked(appointment_id, barber_id, date, time, str(user.id)))
+    
+    c.execute("SELECT name FROM barbers WHERE id = ?", (barber_id,))
+    barber_name = c.fetchone()[0]
+    conn.close()
+    context.user_data['basket'] = []
+    
+    excel_path = generate_appointments_excel(user_id=user.id)
+    keyboard = [recurring_keyboard(appointment_id), [InlineKeyboardButton("🔙 Назад", callback_data='back_to_start')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    confirmation_text = (
+        f"🎉 *Запись подтверждена!*\n\n"
+        f"👤 *Мастер:* {barber_name}\n"
+        f"✂️ *Услуги:* {service_name} ({price}₽, {duration} мин)\n"
+        f"📅 *Дата и время:* {context.user_data['date']} {context.user_data['time']}\n"
+        f"👤 *Имя:* {client_name}\n"
+        f"📞 *Ваш номер:* {cleaned_phone}\n\n"
+        f"Спасибо, что выбрали нас! 😊\n\n"
+        f"{SUPPORT_MESSAGE_RU}"
+    )
+    await message.reply_text(confirmation_text, reply_markup=reply_markup, parse_mode='Markdown')
+    await message.reply_document(document=open(excel_path, 'rb'), caption="📋 Ваши записи")
+    return ConversationHandler.END
+
+async def my_appointments(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    await render_my_appointments(query)
+
+async def render_my_appointments(query):
+    # Shared by the list buttons and the handlers that change it; the caller
+    # answers the callback query, which Telegram accepts only once
+    user_id = str(query.from_user.id)
+    cursor, backwards = parse_page_request(query.data, 'myapp')
+    appointments, more = fetch_appointments_page("a.user_id = ? AND a.status = 'pending'", [user_id], cursor, backwards)
+    has_prev, has_next = page_flags(cursor, backwards, more)
+    rules = []
+    if not has_prev:
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute(
+            "SELECT r.id, r.interval_weeks, r.time, b.name FROM recurring_rules r JOIN barbers b ON r.barber_id = b.id "
+            "WHERE r.user_id = ? AND r.status = 'active' ORDER BY r.id",
+            (user_id,)
+        )
+        rules = c.fetchall()
+        conn.close()
+
+    keyboard = [
+        [InlineKeyboardButton(f"❌ {datetime.strptime(date, '%Y-%m-%d'):%d.%m} {time} — {barber}, {service}", callback_data=f'cancel_{appt_id}')]
+        for appt_id, date, time, _, barber, service in appointments
+    ]
+    keyboard += [
+        [InlineKeyboardButton(f"⏹ Повтор каждые {weeks} нед. в {time} — {barber}", callback_data=f'stop_repeat_{rule_id}')]
+        for rule_id, weeks, time, barber in rules
+    ]
+    if appointments:
+        keyboard += page_navigation(
+            'myapp', page_key(*appointments[0][:3]), page_key(*appointments[-1][:3]), has_prev, has_next
+        )
+    keyboard.append([InlineKeyboardButton("📜 История", callback_data='myhist')])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='back_to_start')])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    text = "📋 *Ваши записи* (нажмите, чтобы отменить):" if appointments or rules else "📋 *У вас нет активных записей.*"
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def my_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    cursor, backwards = parse_page_request(query.data, 'myhist')
+    rows, more = await asyncio.to_thread(fetch_history_page, "user_id = ?", [str(query.from_user.id)], cursor, backwards)
+    has_prev, has_next = page_flags(cursor, backwards, more)
+
+    keyboard = []
+    if rows:
+        # Newest first: "previous" is newer, "next" is older
+        keyboard += page_navigation('myhist', page_key(rows[0][0], rows[0][6], rows[0][7]),
+                                    page_key(rows[-1][0], rows[-1][6], rows[-1][7]), has_prev, has_next)
+    keyboard.append([InlineKeyboardButton("🔙 К записям", callback_data='my_appointments')])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    lines = format_history_rows(rows) if rows else ["Пока пусто."]
+    await query.edit_message_text("📜 *История записей*\n\n" + '\n'.join(lines), reply_markup=reply_markup, parse_mode='Markdown')
+
+def archive_cancelled_appointment(c, appointment_id):
+    # Cancelled bookings leave the live table right away
+    move_to_archive(c, "a.id = ?", [appointment_id], now_local().strftime('%Y-%m-%d %H:%M:%S'), status='cancelled')
+
+async def cancel_appointment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    appointment_id = query.data.split('_')[1]
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        "SELECT 1 FROM appointments WHERE id = ? AND user_id = ? AND status = 'pending'",
+        (appointment_id, str(query.from_user.id))
+    )
+    event = None
+    if c.fetchone():
+        event = appointment_event(AppointmentCancelled, c, appointment_id)
+        enqueue_barber_notification(c, appointment_id, "❌ *Клиент отменил запись*")
+        archive_cancelled_appointment(c, appointment_id)
+        conn.commit()
+    conn.close()
+
+    if event:
+        event_bus.publish(context.bot, event)
+    await query.answer("✅ Запись отменена" if event else "Запись не найдена")
+    await render_my_appointments(query)
+
+# Booking shortcuts
+# Deep links (t.me/<bot>?start=book_<barber>_<service> or slot_<barber>_<YYYYMMDD>_<HHMM>)
+# and inline mode (@<bot> <master>) skip the menus and land on a bookable slot
+def deep_link(bot, payload):
+    return f"https://t.me/{bot.username}?start={payload}"
+
+def slot_payload(barber_id, date, time):
+    return f"slot_{barber_id}_{date.replace('-', '')}_{time.replace(':', '')}"
+
+def free_times(barber_id, date, user_id=None, offered=None):
+    # Bookable start times: not taken, not held for someone else, not past.
+    # offered: waitlist offers of that day already loaded by the caller
+    now = now_local()
+    earliest = now.strftime('%H:%M') if date == now.strftime('%Y-%m-%d') else ''
+    if offered is None:
+        offered = get_offered_slots(barber_id, date, user_id)
+    held = offered | slot_holds.held(barber_id, date, user_id)
+    return [
+        time for time, is_booked in get_available_time_slots(barber_id, date)
+        if not is_booked and time not in held and time > earliest
+    ]
+
+def upcoming_free_slots(barbers, user_id):
+    # (barber_id, name, date, time), nearest day first. Waitlist offers for
+    # the whole range come from one query; slots from the availability cache.
+    now = now_local()
+    dates = [(now + timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(INLINE_SLOT_DAYS)]
+    offered = load_offered_slots(dates[0], dates[-1], user_id)
+    for date in dates:
+        for barber_id, name in barbers:
+            for time in free_times(barber_id, date, user_id, offered.get((barber_id, date), set())):
+                yield barber_id, name, date, time
+
+def date_picker_keyboard():
+    keyboard = [
+        [
+            InlineKeyboardButton("Сегодня", callback_data='date_today'),
+            InlineKeyboardButton("Завтра", callback_data='date_tomorrow')
+        ],
+        [InlineKeyboardButton("Другие даты", callback_data='date_other')],
+        [InlineKeyboardButton("🔙 Назад", callback_data='book_appointment')]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+async def open_start_link(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    # Returns False for payloads that are not booking shortcuts, so start
+    # falls back to the main menu
+    kind, _, rest = payload.partition('_')
+    parts = rest.split('_')
+    if kind not in ('book', 'slot') or not all(part.isdigit() for part in parts):
+        return False
+    if (kind == 'book' and len(parts) not in (1, 2)) or (kind == 'slot' and len(parts) != 3):
+        return False
+
+    barber = load_barber(parts[0])
+    if not barber or not barber.is_active:
+        return False
+    barber_id = barber.id
+    service = get_services().get(int(parts[1])) if kind == 'book' and len(parts) == 2 else None
+
+    user_id = update.effective_user.id
+    release_slot_hold(context, user_id)
+    context.user_data['barber_id'] = str(barber_id)
+    context.user_data.pop('preset_service', None)
+    if kind == 'book':
+        text = f"💇‍♂️ *Мастер:* {escape_markdown(barber.name)}"
+        if service:
+            context.user_data['preset_service'] = service.id
+            text += f"\n✂️ *Услуга:* {escape_markdown(service.name)}"
+        await update.message.reply_text(text + "\n\n📅 *Выберите день записи:*", reply_markup=date_picker_keyboard(), parse_mode='Markdown')
+        return True
+
+    try:
+        date = datetime.strptime(parts[1], '%Y%m%d').strftime('%Y-%m-%d')
+        time = datetime.strptime(parts[2], '%H%M').strftime('%H:%M')
+    except ValueError:
+        return False
+    context.user_data['date'] = date
+    if time not in free_times(barber_id, date, user_id):
+        keyboard = [
+            [InlineKeyboardButton("📅 Выбрать другое время", callback_data=f'barber_{barber_id}')],
+            [InlineKeyboardButton("🔙 В меню", callback_data='back_to_start')]
+        ]
+        await update.message.reply_text("😔 Это время уже занято.", reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+        return True
+    keyboard = [
+        [InlineKeyboardButton("✂️ Выбрать услугу", callback_data=f'time_{time}')],
+        [InlineKeyboardButton("📅 Другое время", callback_data=f'barber_{barber_id}')],
+        [InlineKeyboardButton("🔙 В меню", callback_data='back_to_start')]
+    ]
+    await update.message.reply_text(
+        f"💇‍♂️ *Мастер:* {escape_markdown(barber.name)}\n📅 {datetime.strptime(date, '%Y-%m-%d'):%d.%m.%Y} в {time}",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode='Markdown'
+    )
+    return True
+
+async def inline_slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Free slots of the masters whose name matches the query, nearest first.
+    # Served from the availability cache, so typing costs no slot queries
+    # for days that were already looked at.
+    inline_query = update.inline_query
+    needle = inline_query.query.strip().lower()
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT id, name FROM barbers WHERE is_active = 1 ORDER BY id")
+    barbers = [(barber_id, name) for barber_id, name in c.fetchall() if needle in name.lower()]
+    conn.close()
+
+    results = []
+    for barber_id, name, date, time in islice(upcoming_free_slots(barbers, inline_query.from_user.id), INLINE_MAX_RESULTS):
+        label = f"{datetime.strptime(date, '%Y-%m-%d'):%d.%m} {time}"
+        results.append(InlineQueryResultArticle(
+            id=f"{barber_id}_{date}_{time}",
+            title=f"{name} — {label}",
+            description="Свободно, нажмите, чтобы поделиться",
+            input_message_content=InputTextMessageContent(
+                f"💈 Свободное время: *{escape_markdown(name)}*, {label}", parse_mode='Markdown'
+            ),
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+                "📅 Записаться", url=deep_link(context.bot, slot_payload(barber_id, date, time))
+            )]])
+        ))
+    await inline_query.answer(results, cache_time=INLINE_CACHE_SECONDS, is_personal=True)
+
+# Client profiles
+# Last used name and phone per Telegram user, so returning clients confirm a
+# booking with one tap instead of typing both again
+client_profiles = {}
+
+def get_client_profile(user_id):
+    user_id = str(user_id)
+    if user_id in client_profiles:
+        metrics.inc('barbershop_cache_hits_total', 'clients')
+        return client_profiles[user_id]
+    metrics.inc('barbershop_cache_misses_total', 'clients')
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT name, phone FROM clients WHERE user_id = ?", (user_id,))
+    profile = c.fetchone()
+    conn.close()
+    if len(client_profiles) >= CLIENT_CACHE_SIZE:
+        client_profiles.clear()
+    # New users are cached too, so they cost one query, not one per booking step
+    client_profiles[user_id] = profile
+    return profile
+
+def save_client_profile(c, user_id, name, phone):
+    c.execute(
+        "INSERT INTO clients (user_id, name, phone, updated_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET name = excluded.name, phone = excluded.phone, updated_at = excluded.updated_at",
+        (str(user_id), name, phone, now_local().strftime('%Y-%m-%d %H:%M:%S'))
+    )
+
+# Slot holds
+class SlotHolds:
+    # Short-lived in-memory reservations of the slots a client picked while
+    # they choose services and type their name and phone. One hold per
+    # client, covering every slot of the chosen interval; expired holds are
+    # dropped lazily on access and by the periodic prune job.
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.days = defaultdict(dict)  # (barber_id, date) -> {time: (user_id, expires)}
+        self.by_user = {}  # user_id -> (barber_id, date, times)
+        self.lock = threading.Lock()  # the waitlist matcher reads from a worker thread
+
+    def acquire(self, barber_id, date, time, user_id, duration=SLOT_MINUTES):
+        # Holds every slot from time until time + duration
+        start = to_minutes(time)
+        times = [
+            f"{minute // 60:02d}:{minute % 60:02d}"
+            for minute in range(start, start + max(duration, SLOT_MINUTES), SLOT_MINUTES)
+        ]
+        now = monotonic()
+        with self.lock:
+            day = self.days[(barber_id, date)]
+            holders = {day[slot][0] for slot in times if slot in day and day[slot][0] != user_id}
+            if any(day[slot][1] > now for slot in times if slot in day and day[slot][0] != user_id):
+                metrics.inc('barbershop_slot_holds_total', 'conflict')
+                return False
+            for holder in holders:
+                self._release(holder)
+            self._release(user_id)
+            day = self.days[(barber_id, date)]
+            for slot in times:
+                day[slot] = (user_id, now + self.ttl)
+            self.by_user[user_id] = (barber_id, date, times)
+        metrics.inc('barbershop_slot_holds_total', 'acquired')
+        return True
+
+    def release(self, user_id):
+        with self.lock:
+            self._release(user_id)
+
+    def _release(self, user_id):
+        key = self.by_user.pop(user_id, None)
+        if key is None:
+            return
+        barber_id, date, times = key
+        day = self.days.get((barber_id, date), {})
+        for time in times:
+            if day.get(time, (None,))[0] == user_id:
+                del day[time]
+        if not day:
+            self.days.pop((barber_id, date), None)
+
+    def held(self, barber_id, date, user_id=None):
+        # Times held by anyone other than user_id
+        now = monotonic()
+        with self.lock:
+            day = self.days.get((barber_id, date), {})
+            return {time for time, (holder, expires) in day.items() if holder != user_id and expires > now}
+
+    def prune(self):
+        now = monotonic()
+        with self.lock:
+            # by_user and days always agree, and all slots of a hold share one expiry
+            expired = [user_id for user_id, (barber_id, date, times) in self.by_user.items()
+                       if self.days[(barber_id, date)][times[0]][1] <= now]
+            for user_id in expired:
+                self._release(user_id)
+        if expired:
+            metrics.inc('barbershop_slot_holds_total', 'expired', len(expired))
+
+slot_holds = SlotHolds(SLOT_HOLD_SECONDS)
+
+def release_slot_hold(context: ContextTypes.DEFAULT_TYPE, user_id):
+    slot_holds.release(user_id)
+    context.user_data.pop('time', None)
+
+async def booking_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    release_slot_hold(context, update.effective_user.id)
+    context.user_data['awaiting_name'] = False
+    context.user_data['awaiting_phone'] = False
+    if update.effective_chat:
+        await context.bot.send_message(
+            update.effective_chat.id,
+            "⌛ *Время на оформление записи истекло.* Начните запись заново: /start",
+            parse_mode='Markdown'
+        )
+
+# Waitlist
+WAITLIST_WINDOWS = [
+    ("🕘 Любое время", "00:00", "24:00"),
+    ("🌅 Утро (до 12:00)", "00:00", "12:00"),
+    ("☀️ День (12:00–16:00)", "12:00", "16:00"),
+    ("🌆 Вечер (после 16:00)", "16:00", "24:00"),
+]
+
+def get_offered_slots(barber_id, date, user_id=None):
+    # Slots currently held for waitlisted clients; the client holding the
+    # offer still sees the slot as free
+    now = now_local().strftime('%Y-%m-%d %H:%M:%S')
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        "SELECT offered_time FROM waitlist "
+        "WHERE barber_id = ? AND date = ? AND status = 'offered' AND offer_expires_at > ? AND user_id != ?",
+        (barber_id, date, now, str(user_id))
+    )
+    held = {row[0] for row in c.fetchall()}
+    conn.close()
+    return held
+
+def load_offered_slots(date_from, date_to, user_id=None):
+    # get_offered_slots for every barber and day in [date_from, date_to]:
+    # {(barber_id, date): {time, ...}}
+    now = now_local().strftime('%Y-%m-%d %H:%M:%S')
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        "SELECT barber_id, date, offered_time FROM waitlist "
+        "WHERE date BETWEEN ? AND ? AND status = 'offered' AND offer_expires_at > ? AND user_id != ?",
+        (date_from, date_to, now, str(user_id))
+    )
+    offered = defaultdict(set)
+    for barber_id, date, time in c.fetchall():
+        offered[(barber_id, date)].add(time)
+    conn.close()
+    return offered
+
+def time_slot_keyboard(context, time_slots, user_id):
+    barber_id, date = int(context.user_data['barber_id']), context.user_data['date']
+    held = get_offered_slots(barber_id, date, user_id) | slot_holds.held(barber_id, date, user_id)
+    keyboard = []
+    for time, is_booked in time_slots:
+        if is_booked or time in held:
+            keyboard.append([InlineKeyboardButton(f"❌ {time}", callback_data='time_booked')])
+        else:
+            keyboard.append([InlineKeyboardButton(f"✅ {time}", callback_data=f'time_{time}')])
+    keyboard.append([InlineKeyboardButton("🔔 Лист ожидания", callback_data='waitlist_join')])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')])
+    return InlineKeyboardMarkup(keyboard)
+
+def match_waitlist(barber_id, date, slots, held):
+    # Offers every free slot of one barber's day to the longest-waiting
+    # clients whose window contains it. Returns the number of offers made.
+    # Runs in a worker thread: slots and held come from the event loop,
+    # which owns the availability cache and the slot holds.
+    now = now_local()
+    if date < now.strftime('%Y-%m-%d'):
+        return 0
+    current_time = now.strftime('%H:%M') if date == now.strftime('%Y-%m-%d') else '00:00'
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        "SELECT id, user_id, time_from, time_to FROM waitlist "
+        "WHERE barber_id = ? AND date = ? AND status = 'waiting' ORDER BY id",
+        (barber_id, date)
+    )
+    waiting = c.fetchall()
+    if not waiting:
+        conn.close()
+        return 0
+
+    c.execute(
+        "SELECT offered_time FROM waitlist WHERE barber_id = ? AND date = ? AND status = 'offered' AND offer_expires_at > ?",
+        (barber_id, date, now.strftime('%Y-%m-%d %H:%M:%S'))
+    )
+    held = {row[0] for row in c.fetchall()} | held
+    free = [
+        time for time, is_booked in slots
+        if not is_booked and time not in held and time > current_time
+    ]
+    c.execute("SELECT name FROM barbers WHERE id = ?", (barber_id,))
+    barber_name = c.fetchone()[0]
+    expires_at = now + timedelta(minutes=WAITLIST_OFFER_MINUTES)
+
+    offers = 0
+    for waitlist_id, user_id, time_from, time_to in waiting:
+        time = next((time for time in free if time_from <= time < time_to), None)
+        if time is None:
+            continue
+        free.remove(time)
+        c.execute(
+            "UPDATE waitlist SET status = 'offered', offered_time = ?, offer_expires_at = ? WHERE id = ?",
+            (time, expires_at.strftime('%Y-%m-%d %H:%M:%S'), waitlist_id)
+        )
+        keyboard = InlineKeyboardMarkup([[
+            InlineKeyboardButton("✅ Записаться", callback_data=f'waitlist_accept_{waitlist_id}'),
+            InlineKeyboardButton("❌ Отказаться", callback_data=f'waitlist_decline_{waitlist_id}')
+        ]])
+        enqueue_notification(
+            c, user_id,
+            f"🔔 *Освободилось время!*\n\n"
+            f"💇‍♂️ Мастер: {escape_markdown(barber_name)}\n"
+            f"📅 {datetime.strptime(date, '%Y-%m-%d'):%d.%m.%Y} в {time}\n\n"
+            f"Время закреплено за вами до {expires_at:%H:%M}.",
+            keyboard
+        )
+        offers += 1
+        if not free:
+            break
+    conn.commit()
+    conn.close()
+    return offers
+
+def waiting_dates(barber_id):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        "SELECT DISTINCT date FROM waitlist WHERE barber_id = ? AND date >= ? AND status = 'waiting'",
+        (barber_id, now_local().strftime('%Y-%m-%d'))
+    )
+    dates = [row[0] for row in c.fetchall()]
+    conn.close()
+    return dates
+
+waitlist_lock = asyncio.Lock()
+
+async def offer_freed_slots(barber_id, dates):
+    # One matcher at a time, so two runs never offer the same slot
+    async with waitlist_lock:
+        offers = 0
+        for date in dates:
+            slots = get_available_time_slots(barber_id, date)
+            held = slot_holds.held(barber_id, date)
+            offers += await asyncio.to_thread(match_waitlist, barber_id, date, slots, held)
+    if offers:
+        logger.info("offer_freed_slots: Made %d waitlist offers for barber %s", offers, barber_id)
+        outbox_wakeup.set()
+
+@subscribe(AppointmentCancelled)
+async def match_waitlist_on_cancel(bot, event):
+    await offer_freed_slots(event.barber_id, [event.date])
+
+@subscribe(ScheduleChanged)
+async def match_waitlist_on_schedule(bot, event):
+    dates = [event.date] if event.date else await asyncio.to_thread(waiting_dates, event.barber_id)
+    await offer_freed_slots(event.barber_id, dates)
+
+def expire_waitlist():
+    # Returns the (barber_id, date) days whose lapsed offers freed a slot
+    now = now_local()
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        "SELECT DISTINCT barber_id, date FROM waitlist WHERE status = 'offered' AND offer_expires_at <= ?",
+        (now.strftime('%Y-%m-%d %H:%M:%S'),)
+    )
+    days = c.fetchall()
+    c.execute(
+        "UPDATE waitlist SET status = 'expired' WHERE status = 'offered' AND offer_expires_at <= ?",
+        (now.strftime('%Y-%m-%d %H:%M:%S'),)
+    )
+    c.execute(
+        "UPDATE waitlist SET status = 'expired' WHERE status = 'waiting' AND date < ?",
+        (now.strftime('%Y-%m-%d'),)
+    )
+    conn.commit()
+    conn.close()
+    return days
+
+async def expire_waitlist_job(context: ContextTypes.DEFAULT_TYPE):
+    for barber_id, date in await asyncio.to_thread(expire_waitlist):
+        await offer_freed_slots(barber_id, [date])
+
+async def waitlist_join(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    if 'barber_id' not in context.user_data or 'date' not in context.user_data:
+        await start(update, context)
+        return
+
+    keyboard = [
+        [InlineKeyboardButton(label, callback_data=f'waitlist_{index}')]
+        for index, (label, _, _) in enumerate(WAITLIST_WINDOWS)
+    ]
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    date_obj = datetime.strptime(context.user_data['date'], '%Y-%m-%d')
+    await query.edit_message_text(
+        f"🔔 *Лист ожидания на {date_obj:%d.%m.%Y}*\n\nКакое время вам подходит? "
+        f"Когда оно освободится, мы предложим его вам первым.",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+
+async def waitlist_subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    if 'barber_id' not in context.user_data or 'date' not in context.user_data:
+        await start(update, context)
+        return
+
+    _, time_from, time_to = WAITLIST_WINDOWS[int(query.data.split('_')[1])]
+    barber_id = int(context.user_data['barber_id'])
+    date = context.user_data['date']
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        "INSERT INTO waitlist (user_id, barber_id, date, time_from, time_to, status, created_at) VALUES (?, ?, ?, ?, ?, 'waiting', ?)",
+        (str(query.from_user.id), barber_id, date, time_from, time_to, now_local().strftime('%Y-%m-%d %H:%M:%S'))
+    )
+    conn.commit()
+    conn.close()
+
+    keyboard = [[InlineKeyboardButton("🔙 В начало", callback_data='back_to_start')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(
+        "✅ *Вы в листе ожидания.* Мы напишем, как только нужное время освободится.",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+    # The day may already have a free slot in the chosen window
+    await offer_freed_slots(barber_id, [date])
+
+async def waitlist_accept(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    waitlist_id = query.data.split('_')[2]
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        "SELECT barber_id, date, offered_time FROM waitlist "
+        "WHERE id = ? AND user_id = ? AND status = 'offered' AND offer_expires_at > ?",
+        (waitlist_id, str(query.from_user.id), now_local().strftime('%Y-%m-%d %H:%M:%S'))
+    )
+    result = c.fetchone()
+    conn.close()
+    if not result:
+        keyboard = [[InlineKeyboardButton("🔙 В начало", callback_data='back_to_start')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text("⌛ *Предложение больше не действует.*", reply_markup=reply_markup, parse_mode='Markdown')
+        return
+
+    barber_id, date, time = result
+    # The offer already keeps the slot for this client; the hold covers the
+    # rest of the conversation
+    slot_holds.acquire(barber_id, date, time, query.from_user.id)
+    context.user_data.update(barber_id=str(barber_id), date=date, time=time, waitlist_id=int(waitlist_id), basket=[])
+    await ask_service(query, context)
+
+async def waitlist_decline(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    waitlist_id = query.data.split('_')[2]
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT barber_id, date FROM waitlist WHERE id = ? AND user_id = ?", (waitlist_id, str(query.from_user.id)))
+    result = c.fetchone()
+    c.execute(
+        "UPDATE waitlist SET status = 'declined' WHERE id = ? AND user_id = ? AND status = 'offered'",
+        (waitlist_id, str(query.from_user.id))
+    )
+    declined = c.rowcount
+    conn.commit()
+    conn.close()
+
+    keyboard = [[InlineKeyboardButton("🔙 В начало", callback_data='back_to_start')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text("👌 *Вы отказались от предложенного времени.*", reply_markup=reply_markup, parse_mode='Markdown')
+    if declined:
+        await offer_freed_slots(result[0], [result[1]])
+
+# Recurring appointments
+# A rule is expanded lazily: availability and conflict checks generate its
+# occurrences on the fly, and only the next RECURRING_MATERIALIZE_DAYS are
+# written to appointments by a nightly job.
+def to_minutes(time):
+    hours, minutes = time.split(':')
+    return int(hours) * 60 + int(minutes)
+
+def rule_occurrences(start_date, interval_weeks, date_from, date_to):
+    # Dates in [date_from, date_to] of a rule repeating every interval_weeks
+    start = datetime.strptime(start_date, '%Y-%m-%d').date()
+    date_from = datetime.strptime(date_from, '%Y-%m-%d').date()
+    date_to = datetime.strptime(date_to, '%Y-%m-%d').date()
+    step = interval_weeks * 7
+    skip = max(0, -(-(date_from - start).days // step))
+    current = start + timedelta(days=skip * step)
+    while current <= date_to:
+        yield current.strftime('%Y-%m-%d')
+        current += timedelta(days=step)
+
+def recurring_intervals(c, barber_id, date):
+    # Chair time taken on this day by rules that have not been materialized yet
+    c.execute(
+        "SELECT r.time, COALESCE(r.duration, s.duration) FROM recurring_rules r JOIN services s ON r.service_id = s.id "
+        "WHERE r.barber_id = ? AND r.status = 'active' AND r.start_date <= ? AND r.materialized_until < ? "
+        "AND CAST(julianday(?) - julianday(r.start_date) AS INTEGER) % (r.interval_weeks * 7) = 0",
+        (barber_id, date, date, date)
+    )
+    return [(to_minutes(time), to_minutes(time) + duration) for time, duration in c.fetchall()]
+
+def find_recurring_conflicts(c, barber_id, dates, time, duration, exclude_rule=None):
+    # One range query plus the expansion of the barber's other rules, then an
+    # interval overlap test per occurrence; days off always conflict. Days off
+    # are read through the cursor, not time_off_index: materialize_recurring
+    # runs in a worker thread.
+    if not dates:
+        return []
+    busy = defaultdict(int)
+    c.execute(
+        f"SELECT a.day_num, a.start_min, {APPOINTMENT_DURATION_SQL} FROM appointments a JOIN services s ON a.service_id = s.id "
+        "WHERE a.barber_id = ? AND a.day_num BETWEEN ? AND ? AND a.status = 'pending'",
+        (barber_id, day_number(dates[0]), day_number(dates[-1]))
+    )
+    for day_num, start, length in c.fetchall():
+        busy[day_date(day_num)] |= minute_mask(start, start + length)
+    c.execute(
+        "SELECT r.id, r.start_date, r.interval_weeks, r.materialized_until, r.time, COALESCE(r.duration, s.duration) "
+        "FROM recurring_rules r JOIN services s ON r.service_id = s.id WHERE r.barber_id = ? AND r.status = 'active'",
+        (barber_id,)
+    )
+    for rule_id, start_date, interval_weeks, materialized_until, start, length in c.fetchall():
+        if rule_id == exclude_rule:
+            continue
+        for date in rule_occurrences(start_date, interval_weeks, max(dates[0], materialized_until), dates[-1]):
+            if date > materialized_until:
+                busy[date] |= minute_mask(to_minutes(start), to_minutes(start) + length)
+
+    c.execute(
+        "SELECT start_date, end_date FROM time_off WHERE barber_id = ? AND start_date <= ? AND end_date >= ?",
+        (barber_id, dates[-1], dates[0])
+    )
+    days_off = c.fetchall()
+
+    wanted = minute_mask(to_minutes(time), to_minutes(time) + duration)
+    return [
+        date for date in dates
+        if busy[date] & wanted or any(start <= date <= end for start, end in days_off)
+    ]
+
+def materialize_recurring():
+    # Writes rule occurrences up to the materialization horizon as regular
+    # appointments, skipping occurrences that collide with other bookings.
+    # Returns the ids of barbers whose days changed.
+    until = (now_local() + timedelta(days=RECURRING_MATERIALIZE_DAYS)).strftime('%Y-%m-%d')
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        "SELECT r.id, r.user_id, r.client_name, r.client_phone, r.barber_id, r.service_id, r.start_date, "
+        "r.time, r.interval_weeks, r.materialized_until, COALESCE(r.duration, s.duration), r.price "
+        "FROM recurring_rules r JOIN services s ON r.service_id = s.id "
+        "WHERE r.status = 'active' AND r.materialized_until < ?",
+        (until,)
+    )
+    changed = set()
+    for (rule_id, user_id, client_name, client_phone, barber_id, service_id, start_date,
+         time, interval_weeks, materialized_until, duration, price) in c.fetchall():
+        first = (datetime.strptime(materialized_until, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        dates = list(rule_occurrences(start_date, interval_weeks, first, until))
+        conflicts = set(find_recurring_conflicts(c, barber_id, dates, time, duration, exclude_rule=rule_id))
+        rows = [
+            (user_id, client_name, client_phone, barber_id, service_id, date, time, 'pending', duration, price,
+             day_number(date), to_minutes(time))
+            for date in dates if date not in conflicts
+        ]
+        c.executemany(
+            "INSERT INTO appointments (user_id, client_name, client_phone, barber_id, service_id, date, time, status, duration, price, day_num, start_min) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        for date in sorted(conflicts):
+            enqueue_notification(
+                c, user_id,
+                f"⚠️ *Регулярная запись на {datetime.strptime(date, '%Y-%m-%d'):%d.%m.%Y} в {time} пропущена:* "
+                f"это время уже занято или мастер не работает. Запишитесь на другое время через /start."
+            )
+        c.execute("UPDATE recurring_rules SET materialized_until = ? WHERE id = ?", (until, rule_id))
+        if rows or conflicts:
+            changed.add(barber_id)
+    conn.commit()
+    conn.close()
+    return changed
+
+async def materialize_recurring_job(context: ContextTypes.DEFAULT_TYPE):
+    for barber_id in await asyncio.to_thread(materialize_recurring):
+        event_bus.publish(context.bot, ScheduleChanged(barber_id))
+    outbox_wakeup.set()
+
+def recurring_keyboard(appointment_id):
+    return [
+        InlineKeyboardButton(f"🔁 Каждые {weeks} нед.", callback_data=f'repeat_{appointment_id}_{weeks}')
+        for weeks in RECURRING_INTERVALS
+    ]
+
+async def repeat_appointment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    _, appointment_id, weeks = query.data.split('_')
+    weeks = int(weeks)
+    user_id = str(query.from_user.id)
+    keyboard = [[InlineKeyboardButton("🔙 В начало", callback_data='back_to_start')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        f"SELECT a.client_name, a.client_phone, a.barber_id, a.service_id, a.date, a.time, {APPOINTMENT_DURATION_SQL}, "
+        f"{APPOINTMENT_PRICE_SQL} FROM appointments a JOIN services s ON a.service_id = s.id WHERE a.id = ? AND a.user_id = ?",
+        (appointment_id, user_id)
+    )
+    result = c.fetchone()
+    if not result:
+        conn.close()
+        await query.message.reply_text("❌ *Запись не найдена.*", reply_markup=reply_markup, parse_mode='Markdown')
+        return
+    client_name, client_phone, barber_id, service_id, date, time, duration, price = result
+    # Only a rule that itself lands on this date repeats it; the same time on
+    # another weekday (or in the off week of a biweekly rule) is a new rule
+    c.execute(
+        "SELECT 1 FROM recurring_rules WHERE user_id = ? AND barber_id = ? AND time = ? AND status = 'active' "
+        "AND CAST(julianday(?) - julianday(start_date) AS INTEGER) % (interval_weeks * 7) = 0",
+        (user_id, barber_id, time, date)
+    )
+    if c.fetchone():
+        conn.close()
+        await query.message.reply_text("🔁 *Эта запись уже повторяется.*", reply_markup=reply_markup, parse_mode='Markdown')
+        return
+
+    horizon = (now_local() + timedelta(days=RECURRING_HORIZON_DAYS)).strftime('%Y-%m-%d')
+    next_date = (datetime.strptime(date, '%Y-%m-%d') + timedelta(weeks=weeks)).strftime('%Y-%m-%d')
+    conflicts = find_recurring_conflicts(c, barber_id, list(rule_occurrences(date, weeks, next_date, horizon)), time, duration)
+    # The booked appointment is the first occurrence, so expansion starts after it
+    c.execute(
+        "INSERT INTO recurring_rules (user_id, client_name, client_phone, barber_id, service_id, duration, price, "
+        "start_date, time, interval_weeks, materialized_until, status, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'active', ?)",
+        (user_id, client_name, client_phone, barber_id, service_id, duration, price, date, time, weeks, date,
+         now_local().strftime('%Y-%m-%d %H:%M:%S'))
+    )
+    conn.commit()
+    conn.close()
+    event_bus.publish(context.bot, ScheduleChanged(barber_id))
+
+    text = f"🔁 *Готово!* Запись будет повторяться каждые {weeks} нед. в {time}."
+    if conflicts:
+        shown = ', '.join(f"{datetime.strptime(d, '%Y-%m-%d'):%d.%m}" for d in conflicts[:5])
+        text += f"\n\n⚠️ Эти даты уже заняты и будут пропущены: {shown}" + (" …" if len(conflicts) > 5 else "")
+    await query.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def stop_repeat(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    rule_id = query.data.split('_')[2]
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT barber_id FROM recurring_rules WHERE id = ? AND user_id = ? AND status = 'active'",
+              (rule_id, str(query.from_user.id)))
+    result = c.fetchone()
+    if result:
+        # Appointments already materialized stay booked and can be cancelled one by one
+        c.execute("UPDATE recurring_rules SET status = 'cancelled' WHERE id = ?", (rule_id,))
+        conn.commit()
+    conn.close()
+
+    if result:
+        event_bus.publish(context.bot, ScheduleChanged(result[0]))
+    await query.answer("✅ Повтор отключён" if result else "Повтор не найден")
+    await render_my_appointments(query)
+
+# Time off
+# Vacations and other days off, whole days with both ends included. Each
+# barber's periods are kept in memory as merged, sorted runs of day numbers,
+# so checking a day is one bisect and slot generation never reads the table.
+time_off_index = {}  # barber_id -> (starts, ends)
+
+VACATION_PATTERN = re.compile(r'^\s*(\d{2}\.\d{2}\.\d{4})(?:\s*-\s*(\d{2}\.\d{2}\.\d{4}))?\s*(.*)$', re.S)
+
+def load_time_off_index(barber_id):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT start_date, end_date FROM time_off WHERE barber_id = ? ORDER BY start_date", (barber_id,))
+    starts, ends = [], []
+    for start_date, end_date in c.fetchall():
+        start, end = day_number(start_date), day_number(end_date)
+        if ends and start <= ends[-1] + 1:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+    conn.close()
+    return starts, ends
+
+def on_time_off(barber_id, day_num):
+    barber_id = int(barber_id)
+    index = time_off_index.get(barber_id)
+    if index is None:
+        index = time_off_index[barber_id] = load_time_off_index(barber_id)
+    starts, ends = index
+    position = bisect.bisect_right(starts, day_num) - 1
+    return position >= 0 and day_num <= ends[position]
+
+@subscribe(ScheduleChanged)
+def drop_time_off_index(event):
+    if event.date is None:
+        time_off_index.pop(event.barber_id, None)
+
+def add_time_off(barber_id, start_date, end_date, reason):
+    # Saves the period and cancels the bookings it covers; their clients are
+    # notified through the outbox in the same transaction. Returns the
+    # cancellation events to publish.
+    barber = load_barber(barber_id)
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        "INSERT INTO time_off (barber_id, start_date, end_date, reason, created_at) VALUES (?, ?, ?, ?, ?)",
+        (barber_id, start_date, end_date, reason, now_local().strftime('%Y-%m-%d %H:%M:%S'))
+    )
+    c.execute(
+        "SELECT id, user_id, date, time FROM appointments "
+        "WHERE barber_id = ? AND day_num BETWEEN ? AND ? AND status = 'pending' ORDER BY day_num, start_min",
+        (barber_id, day_number(start_date), day_number(end_date))
+    )
+    events = []
+    for appointment_id, user_id, date, time in c.fetchall():
+        events.append(AppointmentCancelled(appointment_id, barber_id, date, time, user_id))
+        enqueue_notification(
+            c, user_id,
+            f"❌ *Запись на {datetime.strptime(date, '%Y-%m-%d'):%d.%m.%Y} в {time} отменена:* "
+            f"мастер {escape_markdown(barber.name)} в этот день не работает. "
+            "Запишитесь на другое время через /start."
+        )
+        archive_cancelled_appointment(c, appointment_id)
+    conn.commit()
+    conn.close()
+    return events
+
+def format_period(start_date, end_date):
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    if start_date == end_date:
+        return f"{start:%d.%m.%Y}"
+    return f"{start:%d.%m.%Y}–{datetime.strptime(end_date, '%Y-%m-%d'):%d.%m.%Y}"
+
+async def set_vacation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    barber = get_barber(update)
+    if not barber:
+        return ConversationHandler.END
+
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        "SELECT id, start_date, end_date, reason FROM time_off WHERE barber_id = ? AND end_date >= ? ORDER BY start_date",
+        (barber[0], now_local().strftime('%Y-%m-%d'))
+    )
+    periods = c.fetchall()
+    conn.close()
+
+    keyboard = [
+        [InlineKeyboardButton(f"🗑 {format_period(start, end)}" + (f" — {reason}" if reason else ""), callback_data=f'vacation_del_{period_id}')]
+        for period_id, start, end, reason in periods
+    ]
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='vacation_done')])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    text = (
+        "🌴 *Отпуск и выходные*\n\n"
+        + ("Запланировано (нажмите, чтобы удалить):" if periods else "Ничего не запланировано.")
+        + "\n\nВведите даты в формате ДД.ММ.ГГГГ-ДД.ММ.ГГГГ и, если нужно, причину, "
+        "например: 03.08.2026-16.08.2026 отпуск. Для одного дня достаточно одной даты.\n"
+        "Записи на эти дни будут отменены, клиенты получат уведомление."
+    )
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    return ENTER_VACATION
+
+async def handle_vacation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    barber = get_barber(update)
+    if not barber:
+        return ConversationHandler.END
+
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='vacation_done')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    match = VACATION_PATTERN.match(update.message.text)
+    try:
+        if not match:
+            raise ValueError
+        start_date = datetime.strptime(match.group(1), '%d.%m.%Y').strftime('%Y-%m-%d')
+        end_date = datetime.strptime(match.group(2) or match.group(1), '%d.%m.%Y').strftime('%Y-%m-%d')
+    except ValueError:
+        await update.message.reply_text("❌ *Неверный формат.* Пример: 03.08.2026-16.08.2026 отпуск",
+                                        reply_markup=reply_markup, parse_mode='Markdown')
+        return ENTER_VACATION
+    if end_date < start_date or end_date < now_local().strftime('%Y-%m-%d'):
+        await update.message.reply_text("❌ *Период уже прошёл или заканчивается раньше, чем начинается.*",
+                                        reply_markup=reply_markup, parse_mode='Markdown')
+        return ENTER_VACATION
+
+    events = add_time_off(barber[0], start_date, end_date, match.group(3).strip() or None)
+    event_bus.publish(context.bot, ScheduleChanged(barber[0]))
+    for event in events:
+        event_bus.publish(context.bot, event)
+
+    keyboard = [[InlineKeyboardButton("🔙 В меню мастера", callback_data='back_to_barber')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    text = f"✅ *Сохранено:* {format_period(start_date, end_date)}"
+    if events:
+        text += f"\nОтменено записей: {len(events)}, клиенты получат уведомление."
+    await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    return ConversationHandler.END
+
+async def delete_vacation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    barber = get_barber(update)
+    if not barber:
+        await update.callback_query.answer()
+        return ConversationHandler.END
+
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("DELETE FROM time_off WHERE id = ? AND barber_id = ?", (update.callback_query.data.split('_')[2], barber[0]))
+    conn.commit()
+    conn.close()
+    # Cancelled bookings stay cancelled; the days simply become bookable again
+    event_bus.publish(context.bot, ScheduleChanged(barber[0]))
+    return await set_vacation(update, context)
+
+async def cancel_vacation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await barber_menu(update, context)
+    return ConversationHandler.END
+
+# Barber Menu
+barber_dashboards = {}
+
+def get_barber(update: Update):
+    user = update.effective_user
+    identifiers = [str(user.id)]
+    if user.username:
+        identifiers.append(f"@{user.username}")
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        f"SELECT id, name FROM barbers WHERE telegram_id IN ({', '.join('?' * len(identifiers))})",
+        identifiers
+    )
+    result = c.fetchone()
+    conn.close()
+    return result
+
+def get_barber_day(barber_id, date):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        f"SELECT a.id, a.time, a.client_name, a.client_phone, {APPOINTMENT_SERVICES_SQL}, {APPOINTMENT_DURATION_SQL}, a.status "
+        "FROM appointments a JOIN services s ON a.service_id = s.id "
+        "WHERE a.barber_id = ? AND a.day_num = ? AND a.status IN ('pending', 'completed') "
+        "ORDER BY a.start_min",
+        (barber_id, day_number(date))
+    )
+    rows = [Appointment(*row) for row in c.fetchall()]
+    conn.close()
+    return rows
+
+def format_barber_day(barber_name, date, rows):
+    date_obj = datetime.strptime(date, '%Y-%m-%d')
+    lines = [f"📅 *{escape_markdown(barber_name)}, записи на {date_obj:%d.%m.%Y}*", ""]
+    for appointment in rows:
+        mark = '✅' if appointment.status == 'completed' else '⏳'
+        lines.append(
+            f"{mark} {appointment.time} — {escape_markdown(appointment.client_name)} ({escape_markdown(appointment.client_phone)}), "
+            f"{escape_markdown(appointment.services)}, {appointment.duration} мин"
+        )
+    if not rows:
+        lines.append("Записей нет 🙌")
+    lines += ["", f"🔄 Обновлено в {now_local():%H:%M}"]
+    return '\n'.join(lines)
+
+def barber_day_keyboard():
+    keyboard = [
+        [InlineKeyboardButton("✅ Завершить запись", callback_data='complete_appointment')],
+        [InlineKeyboardButton("🔙 Назад", callback_data='back_to_barber')]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+@subscribe(AppointmentBooked, AppointmentCancelled, AppointmentCompleted, ScheduleChanged)
+async def refresh_barber_dashboard(bot, event):
+    barber_id = event.barber_id
+    dashboard = barber_dashboards.get(barber_id)
+    if not dashboard or (event.date is not None and event.date != dashboard['date']):
+        return
+
+    rows = await asyncio.to_thread(get_barber_day, barber_id, dashboard['date'])
+    # The timestamp line changes on every render, so compare the bookings only
+    if rows == dashboard['rows']:
+        return
+    dashboard['rows'] = rows
+    try:
+        await bot.edit_message_text(
+            format_barber_day(dashboard['barber_name'], dashboard['date'], rows),
+            chat_id=dashboard['chat_id'],
+            message_id=dashboard['message_id'],
+            reply_markup=barber_day_keyboard(),
+            parse_mode='Markdown'
+        )
+    except telegram.error.BadRequest as e:
+        # The message was deleted or replaced by another menu
+        logger.debug("refresh_barber_dashboard: Dropping dashboard of barber %s: %s", barber_id, e)
+        barber_dashboards.pop(barber_id, None)
+
+async def barber_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    barber = get_barber(update)
+    if not barber:
+        return
+
+    cursor, backwards = parse_page_request(query.data, 'blist')
+    today = now_local().strftime('%Y-%m-%d')
+    rows, more = fetch_appointments_page(
+        "a.barber_id = ? AND a.day_num >= ? AND a.status = 'pending'", [barber[0], day_number(today)], cursor, backwards
+    )
+    has_prev, has_next = page_flags(cursor, backwards, more)
+    lines = [
+        f"• {datetime.strptime(date, '%Y-%m-%d'):%d.%m} {time} — {escape_markdown(client_name)}, {escape_markdown(service)}"
+        for _, date, time, client_name, _, service in rows
+    ] or ["Предстоящих записей нет."]
+
+    keyboard = []
+    if rows:
+        keyboard += page_navigation('blist', page_key(*rows[0][:3]), page_key(*rows[-1][:3]), has_prev, has_next)
+    keyboard.append([InlineKeyboardButton("📜 История", callback_data='bhist')])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='back_to_barber')])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text("📋 *Предстоящие записи*\n\n" + '\n'.join(lines), reply_markup=reply_markup, parse_mode='Markdown')
+
+async def barber_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    support_text = (
-        "💬 *Техническая поддержка и разработка* 💬\n\n"
-        "🛠️ **Индивидуальная разработка:**\n"
-        "• Настройка под ваши потребности\n"
-        "• Добавление новых функций\n"
-        "• Интеграция с внешними системами\n"
-        "• Кастомизация интерфейса\n\n"
-        "🔧 **Техническая поддержка:**\n"
-        "• Помощь с установкой и настройкой\n"
-        "• Решение технических проблем\n"
-        "• Консультации по использованию\n"
-        "• Обновления и улучшения\n\n"
-        "📞 **Связь с разработчиком:**\n"
-        f"Telegram: @werybos\n\n"
-        "🌐 **Поддерживаемые языки:**\n"
-        "Русский, English\n\n"
-        "⚡ Быстрый отклик и профессиональный подход!"
-    )
-    keyboard = [[InlineKeyboardButton("📱 Написать в Telegram", url="https://t.me/werybos")],
-                [InlineKeyboardButton("🔙 Назад", callback_data='back_to_start')]]
+    barber = get_barber(update)
+    if not barber:
+        return
+
+    cursor, backwards = parse_page_request(query.data, 'bhist')
+    rows, more = await asyncio.to_thread(fetch_history_page, "barber_id = ?", [barber[0]], cursor, backwards)
+    has_prev, has_next = page_flags(cursor, backwards, more)
+
+    keyboard = []
+    if rows:
+        keyboard += page_navigation('bhist', page_key(rows[0][0], rows[0][6], rows[0][7]),
+                                    page_key(rows[-1][0], rows[-1][6], rows[-1][7]), has_prev, has_next)
+    keyboard.append([InlineKeyboardButton("🔙 К записям", callback_data='blist')])
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(support_text, reply_markup=reply_markup, parse_mode='Markdown')
+    lines = format_history_rows(rows, show_client=True) if rows else ["Пока пусто."]
+    await query.edit_message_text("📜 *История записей*\n\n" + '\n'.join(lines), reply_markup=reply_markup, parse_mode='Markdown')
 
-async def book_appointment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def barber_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    barber = get_barber(update)
+    if not barber:
+        if update.callback_query:
+            await update.callback_query.answer()
+            await update.callback_query.message.reply_text("❌ *Доступ запрещён.*", parse_mode='Markdown')
+        else:
+            await update.message.reply_text("❌ *Доступ запрещён.*", parse_mode='Markdown')
+        return
+
+    # Leaving the day view: stop live updates of that message
+    barber_dashboards.pop(barber[0], None)
+    keyboard = [
+        [InlineKeyboardButton("📅 Записи на сегодня", callback_data='barber_appointments')],
+        [InlineKeyboardButton("📋 Все записи", callback_data='blist')],
+        [InlineKeyboardButton("✅ Завершить запись", callback_data='complete_appointment')],
+        [InlineKeyboardButton("🌴 Отпуск", callback_data='set_vacation')],
+        [InlineKeyboardButton("🔙 Назад", callback_data='back_to_start')]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    text = f"💇‍♂️ *Меню мастера:* {escape_markdown(barber[1])}"
+
+    if update.callback_query:
+        await update.callback_query.answer()
+        await update.callback_query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    else:
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def barber_appointments(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    
+    barber = get_barber(update)
+    if not barber:
+        return
+
+    barber_id, barber_name = barber
+    date = now_local().strftime('%Y-%m-%d')
+    rows = get_barber_day(barber_id, date)
+    await query.edit_message_text(
+        format_barber_day(barber_name, date, rows),
+        reply_markup=barber_day_keyboard(),
+        parse_mode='Markdown'
+    )
+    # From now on this message is edited in place whenever the day changes
+    barber_dashboards[barber_id] = {
+        'chat_id': query.message.chat_id,
+        'message_id': query.message.message_id,
+        'barber_name': barber_name,
+        'date': date,
+        'rows': rows,
+    }
+
+async def complete_appointment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    barber = get_barber(update)
+    if not barber:
+        return
+    await render_complete_list(query, barber)
+
+async def render_complete_list(query, barber):
+    # The caller answers the callback query
+    barber_dashboards.pop(barber[0], None)
+    date = now_local().strftime('%Y-%m-%d')
+    pending = [appointment for appointment in get_barber_day(barber[0], date) if appointment.status == 'pending']
+    keyboard = [
+        [InlineKeyboardButton(f"{appointment.time} — {appointment.client_name}, {appointment.services}",
+                              callback_data=f'complete_{appointment.id}')]
+        for appointment in pending
+    ]
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='barber_appointments')])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    text = "✅ *Выберите завершённую запись:*" if pending else "🙌 *Незавершённых записей на сегодня нет.*"
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def mark_complete(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    barber = get_barber(update)
+    if not barber:
+        await query.answer()
+        return
+
+    appointment_id = query.data.split('_')[1]
     conn = get_db_connection()
     c = conn.cursor()
+    c.execute(
+        "UPDATE appointments SET status = 'completed' WHERE id = ? AND barber_id = ? AND status = 'pending'",
+        (appointment_id, barber[0])
+    )
+    updated = c.rowcount
+    event = appointment_event(AppointmentCompleted, c, appointment_id) if updated else None
+    conn.commit()
+    conn.close()
+
+    if event:
+        event_bus.publish(context.bot, event)
+    await query.answer("✅ Запись завершена" if updated else "Запись уже завершена или отменена")
+    await render_complete_list(query, barber)
+
+# Admin Menu
+async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        if update.callback_query:
+            await update.callback_query.answer()
+            await update.callback_query.message.reply_text("❌ *Доступ запрещён.*", parse_mode='Markdown')
+        else:
+            await update.message.reply_text("❌ *Доступ запрещён.*", parse_mode='Markdown')
+        return
+    
+    keyboard = [
+        [
+            InlineKeyboardButton("👤 Мастера", callback_data='admin_barbers'),
+            InlineKeyboardButton("✂️ Услуги", callback_data='admin_services')
+        ],
+        [
+            InlineKeyboardButton("📅 Все записи", callback_data='admin_appointments'),
+            InlineKeyboardButton("📢 Рассылка", callback_data='admin_broadcast')
+        ],
+        [
+            InlineKeyboardButton("⚙️ Настройки", callback_data='admin_settings'),
+            InlineKeyboardButton("📊 Статистика", callback_data='admin_stats')
+        ],
+        [
+            InlineKeyboardButton("🗄 Архив записей", callback_data='admin_archive'),
+            InlineKeyboardButton("📥 Импорт", callback_data='admin_import')
+        ],
+        [
+            InlineKeyboardButton("💬 Поддержка", callback_data='support_info'),
+            InlineKeyboardButton("🔙 Назад", callback_data='back_to_start')
+        ]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    text = "👑 *Админ-панель:*"
+    
+    if update.callback_query:
+        await update.callback_query.answer()
+        await update.callback_query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    else:
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def admin_barbers(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    keyboard = [
+        [
+            InlineKeyboardButton("➕ Добавить мастера", callback_data='add_barber'),
+            InlineKeyboardButton("❌ Удалить мастера", callback_data='delete_barber')
+        ],
+        [
+            InlineKeyboardButton("✏️ Редактировать мастера", callback_data='edit_barber'),
+            InlineKeyboardButton("⚙️ График мастера", callback_data='manage_schedule')
+        ],
+        [InlineKeyboardButton("🔙 Назад", callback_data='back_to_admin')]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text("👤 *Управление мастерами:*", reply_markup=reply_markup, parse_mode='Markdown')
+
+async def add_barber(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(
+        "➕ *Введите имя мастера:*",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+    context.user_data['awaiting_barber_data'] = True
+    logger.debug("add_barber: Prompted for name for user %s", query.from_user.id)
+    return ENTER_NAME
+
+async def handle_barber_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        c.execute("SELECT id, name FROM barbers WHERE is_active = 1")
-        barbers = c.fetchall()
-        
-        if not barbers:
-            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='back_to_start')]]
+        name = update.message.text.strip()
+        logger.info("Received barber name: %s from user %s", name, update.effective_user.id)
+        if not name:
+            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
-                "❌ *Нет доступных мастеров.* Обратитесь к администратору.",
+            await update.message.reply_text(
+                "❌ *Ошибка:* Имя мастера не может быть пустым.",
                 reply_markup=reply_markup,
                 parse_mode='Markdown'
             )
-            return
+            return ENTER_NAME
         
-        keyboard = [[InlineKeyboardButton(name, callback_data=f"barber_{id}")] for id, name in barbers]
-        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='back_to_start')])
+        context.user_data['barber_name'] = name
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await update.message.reply_text(
+            f"✅ Имя мастера: *{name}*\nТеперь введите Telegram ID (числа) или username (начинается с @):",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+        logger.info("Sent Telegram ID request for barber %s", name)
+        return ENTER_TELEGRAM
+    except Exception as e:
+        logger.error("Error in handle_barber_name: %s", e)
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
         reply_markup = InlineKeyboardMarkup(keyboard)
+        await update.message.reply_text(
+            "❌ Произошла ошибка. Попробуйте снова.",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+        return ENTER_NAME
+
+async def handle_barber_telegram(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        telegram_info = update.message.text.strip()
+        name = context.user_data.get('barber_name')
+        logger.info("Received Telegram ID/username: %s for barber %s", telegram_info, name)
         
-        await query.edit_message_text(
-            "💇‍♂️ *Выберите мастера:*",
+        if not name:
+            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await update.message.reply_text(
+                "❌ *Ошибка:* Сначала введите имя мастера.",
+                reply_markup=reply_markup,
+                parse_mode='Markdown'
+            )
+            return ENTER_NAME
+        
+        if not (telegram_info.isdigit() or (telegram_info.startswith('@') and len(telegram_info) > 1)):
+            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await update.message.reply_text(
+                "❌ *Неверный формат.* Введите Telegram ID (числа) или username (начинается с @).",
+                reply_markup=reply_markup,
+                parse_mode='Markdown'
+            )
+            return ENTER_TELEGRAM
+        
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("INSERT INTO barbers (name, telegram_id, is_active) VALUES (?, ?, ?)", 
+                 (name, telegram_info, 1))
+        conn.commit()
+        event_bus.publish(context.bot, CatalogChanged('barbers'))
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await update.message.reply_text(
+            f"✅ *Мастер {name} добавлен с Telegram ID/username: {telegram_info}.*",
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
-    finally:
         conn.close()
+        context.user_data.pop('barber_name', None)
+        context.user_data['awaiting_barber_data'] = False
+        return ConversationHandler.END
+    except sqlite3.IntegrityError:
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await update.message.reply_text(
+            f"❌ *Ошибка:* Мастер с Telegram ID/username {telegram_info} уже существует.",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+        conn.close()
+        return ENTER_TELEGRAM
+    except Exception as e:
+        logger.error("Error in handle_barber_telegram: %s", e)
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await update.message.reply_text(
+            "❌ Произошла ошибка. Попробуйте снова.",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+        conn.close()
+        return ENTER_TELEGRAM
 
-async def select_date_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    barber_id = query.data.split('_')[1]
-    context.user_data['barber_id'] = barber_id
-    keyboard = [
-        [
-            InlineKeyboardButton("Сегодня", callback_data='date_today'),
-            InlineKeyboardButton("Завтра", callback_data='date_tomorrow')
-        ],
-        [InlineKeyboardButton("Другие даты", callback_data='date_other')],
-        [InlineKeyboardButton("🔙 Назад", callback_data='book_appointment')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text("📅 *Выберите день записи:*", reply_markup=reply_markup, parse_mode='Markdown')
-
-async def select_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def cancel_add_barber(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    date_choice = query.data.split('_')[1]
-    today = datetime.now()
-    if date_choice == 'today':
-        context.user_data['date'] = today.strftime('%Y-%m-%d')
-    elif date_choice == 'tomorrow':
-        context.user_data['date'] = (today + timedelta(days=1)).strftime('%Y-%m-%d')
-    else:
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("📅 Введите дату в формате ДД.ММ.ГГГГ:", reply_markup=reply_markup, parse_mode='Markdown')
-        context.user_data['awaiting_date'] = True
-        return
+    context.user_data['awaiting_barber_data'] = False
+    await admin_barbers(update, context)
+    return ConversationHandler.END
+
+async def delete_barber(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT id, name FROM barbers")
+    barbers = c.fetchall()
+    conn.close()
     
-    time_slots = get_available_time_slots(context.user_data['barber_id'], context.user_data['date'])
-    if not time_slots:
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')]]
+    if not barbers:
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("😔 Нет доступного времени на выбранный день.", reply_markup=reply_markup, parse_mode='Markdown')
+        await query.edit_message_text("😔 Нет мастеров для удаления.", reply_markup=reply_markup, parse_mode='Markdown')
         return
     
-    keyboard = []
-    for time, is_booked in time_slots:
-        if is_booked:
-            keyboard.append([InlineKeyboardButton(f"❌ {time}", callback_data='time_booked')])
-        else:
-            keyboard.append([InlineKeyboardButton(f"✅ {time}", callback_data=f'time_{time}')])
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')])
+    keyboard = [[InlineKeyboardButton(name, callback_data=f'delete_barber_{id}')] for id, name in barbers]
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')])
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text("⏰ *Выберите время (❌ - занято):*", reply_markup=reply_markup, parse_mode='Markdown')
-
-async def handle_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.user_data.get('awaiting_date'):
-        return
-    
-    date_text = update.message.text
-    try:
-        date = datetime.strptime(date_text, '%d.%m.%Y').strftime('%Y-%m-%d')
-        context.user_data['date'] = date
-        context.user_data['awaiting_date'] = False
-        time_slots = get_available_time_slots(context.user_data['barber_id'], date)
-        
-        if not time_slots:
-            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text("😔 Нет доступного времени на выбранный день.", reply_markup=reply_markup, parse_mode='Markdown')
-            return
-        
-        keyboard = []
-        for time, is_booked in time_slots:
-            if is_booked:
-                keyboard.append([InlineKeyboardButton(f"❌ {time}", callback_data='time_booked')])
-            else:
-                keyboard.append([InlineKeyboardButton(f"✅ {time}", callback_data=f'time_{time}')])
-        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("⏰ *Выберите время (❌ - занято):*", reply_markup=reply_markup, parse_mode='Markdown')
-    except ValueError:
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("❌ Неверный формат даты. Пример: 25.12.2025", reply_markup=reply_markup, parse_mode='Markdown')
+    await query.edit_message_text("❌ *Выберите мастера для удаления:*", reply_markup=reply_markup, parse_mode='Markdown')
 
-async def select_service(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def confirm_delete_barber(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    time_choice = query.data.split('_')[1]
-    if time_choice == 'booked':
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("❌ Это время уже занято. Выберите другое.", reply_markup=reply_markup, parse_mode='Markdown')
-        return
+    barber_id = query.data.split('_')[2]
     
-    context.user_data['time'] = time_choice
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT id, name FROM categories")
-    categories = c.fetchall()
-    
-    if not categories:
-        c.execute("SELECT id, name, price, duration FROM services")
-        services = c.fetchall()
-        if not services:
-            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text("😔 Нет доступных услуг.", reply_markup=reply_markup, parse_mode='Markdown')
-            conn.close()
-            return
-        
-        keyboard = [[InlineKeyboardButton(f"{name} ({price}₽, {duration} мин)", callback_data=f'service_{id}')] for id, name, price, duration in services]
-        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("✂️ *Выберите услугу:*", reply_markup=reply_markup, parse_mode='Markdown')
-    else:
-        keyboard = [[InlineKeyboardButton(name, callback_data=f'category_{id}')] for id, name in categories]
-        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f'barber_{context.user_data["barber_id"]}')])
+    c.execute("SELECT name FROM barbers WHERE id = ?", (barber_id,))
+    result = c.fetchone()
+    if not result:
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='delete_barber')]]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("📋 *Выберите категорию услуг:*", reply_markup=reply_markup, parse_mode='Markdown')
+        await query.edit_message_text("❌ *Мастер уже удалён или не существует.*", reply_markup=reply_markup, parse_mode='Markdown')
+        conn.close()
+        return
     
+    barber_name = result[0]
+    c.execute("DELETE FROM barbers WHERE id = ?", (barber_id,))
+    conn.commit()
     conn.close()
+    event_bus.publish(context.bot, CatalogChanged('barbers'))
+    
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='delete_barber')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(f"✅ *Мастер {barber_name} удалён.*", reply_markup=reply_markup, parse_mode='Markdown')
 
-async def select_service_from_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def edit_barber(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    category_id = query.data.split('_')[1]
-    context.user_data['category_id'] = category_id
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT id, name, price, duration FROM services WHERE category_id = ?", (category_id,))
-    services = c.fetchall()
+    c.execute("SELECT id, name FROM barbers")
+    barbers = c.fetchall()
     conn.close()
     
-    if not services:
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='book_appointment')]]
+    if not barbers:
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("😔 В этой категории нет услуг.", reply_markup=reply_markup, parse_mode='Markdown')
+        await query.edit_message_text("😔 Нет мастеров для редактирования.", reply_markup=reply_markup, parse_mode='Markdown')
         return
     
-    keyboard = [[InlineKeyboardButton(f"{name} ({price}₽, {duration} мин)", callback_data=f'service_{id}')] for id, name, price, duration in services]
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='book_appointment')])
+    keyboard = [[InlineKeyboardButton(name, callback_data=f'edit_barber_select_{id}')] for id, name in barbers]
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')])
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text("✂️ *Выберите услугу:*", reply_markup=reply_markup, parse_mode='Markdown')
+    await query.edit_message_text("✏️ *Выберите мастера для редактирования:*", reply_markup=reply_markup, parse_mode='Markdown')
 
-async def request_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def edit_barber_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    service_id = query.data.split('_')[1]
-    context.user_data['service_id'] = service_id
+    barber_id = query.data.split('_')[3]
+    context.user_data['barber_id_edit'] = barber_id
     
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=f'category_{context.user_data.get("category_id", "none")}')]]
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='edit_barber')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text("👤 *Введите ваше имя:*", reply_markup=reply_markup, parse_mode='Markdown')
-    context.user_data['awaiting_name'] = True
-    return ENTER_NAME
+    await query.edit_message_text(
+        "✏️ *Введите новое имя мастера:*",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+    context.user_data['awaiting_barber_edit'] = True
 
-async def handle_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.user_data.get('awaiting_name'):
+async def handle_edit_barber(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.user_data.get('awaiting_barber_edit'):
         return
     
-    client_name = update.message.text.strip()
-    if not client_name:
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=f'category_{context.user_data.get("category_id", "none")}')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("❌ *Имя не может быть пустым.* Введите ваше имя:", reply_markup=reply_markup, parse_mode='Markdown')
-        return ENTER_NAME
-    
-    context.user_data['client_name'] = client_name
-    context.user_data['awaiting_name'] = False
+    name = update.message.text.strip()
+    barber_id = context.user_data['barber_id_edit']
     
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT name, price, duration FROM services WHERE id = ?", (context.user_data['service_id'],))
-    service_name, price, duration = c.fetchone()
+    c.execute("UPDATE barbers SET name = ? WHERE id = ?", (name, barber_id))
+    conn.commit()
     conn.close()
+    event_bus.publish(context.bot, CatalogChanged('barbers'))
     
-    confirmation_text = (
-        f"✂️ *Вы выбрали услугу:* {service_name} ({price}₽, {duration} мин)\n\n"
-        f"👤 *Имя:* {client_name}\n\n"
-        "📞 *Введите ваш номер телефона* для подтверждения записи (например, +79991234567):"
-    )
-    
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=f'category_{context.user_data.get("category_id", "none")}')]]
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='edit_barber')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(confirmation_text, reply_markup=reply_markup, parse_mode='Markdown')
-    context.user_data['awaiting_phone'] = True
-    return ENTER_PHONE
-
-async def handle_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.user_data.get('awaiting_phone'):
-        return
-    
-    phone = update.message.text.strip()
-    cleaned_phone = ''.join(c for c in phone if c.isdigit() or c == '+')
-    
-    if not cleaned_phone.startswith('+') or len(cleaned_phone) < 8:
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=f'category_{context.user_data.get("category_id", "none")}')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            "❌ *Неверный формат номера.* Пример: +79991234567",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
-        return ENTER_PHONE
-    
-    context.user_data['client_phone'] = cleaned_phone
-    context.user_data['awaiting_phone'] = False
-    user = update.effective_user
+    await update.message.reply_text(f"✅ *Имя мастера обновлено на {name}.*", reply_markup=reply_markup, parse_mode='Markdown')
     
+    context.user_data['awaiting_barber_edit'] = False
+
+async def manage_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute(
-        "INSERT INTO appointments (user_id, client_name, client_phone, barber_id, service_id, date, time, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-        (str(user.id), context.user_data['client_name'], cleaned_phone, 
-         int(context.user_data['barber_id']), int(context.user_data['service_id']), 
-         context.user_data['date'], context.user_data['time'], 'pending')
-    )
-    conn.commit()
-    
-    c.execute("SELECT name FROM barbers WHERE id = ?", (int(context.user_data['barber_id']),))
-    barber_name = c.fetchone()[0]
-    c.execute("SELECT name, price, duration FROM services WHERE id = ?", (int(context.user_data['service_id']),))
-    service_name, price, duration = c.fetchone()
+    c.execute("SELECT id, name FROM barbers")
+    barbers = c.fetchall()
     conn.close()
     
-    excel_path = generate_appointments_excel(user_id=user.id)
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='back_to_start')]]
+    if not barbers:
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text("😔 Нет мастеров для управления графиком.", reply_markup=reply_markup, parse_mode='Markdown')
+        return
+    
+    keyboard = [[InlineKeyboardButton(name, callback_data=f'manage_schedule_{id}')] for id, name in barbers]
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')])
     reply_markup = InlineKeyboardMarkup(keyboard)
-    confirmation_text = (
-        f"🎉 *Запись подтверждена!*\n\n"
-        f"👤 *Мастер:* {barber_name}\n"
-        f"✂️ *Услуга:* {service_name} ({price}₽, {duration} мин)\n"
-        f"📅 *Дата и время:* {context.user_data['date']} {context.user_data['time']}\n"
-        f"👤 *Имя:* {context.user_data['client_name']}\n"
-        f"📞 *Ваш номер:* {cleaned_phone}\n\n"
-        f"Спасибо, что выбрали нас! 😊\n\n"
-        f"{SUPPORT_MESSAGE_RU}"
+    await query.edit_message_text("⚙️ *Выберите мастера для управления графиком:*", reply_markup=reply_markup, parse_mode='Markdown')
+
+async def manage_schedule_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    barber_id = query.data.split('_')[2]
+    context.user_data['barber_id_schedule'] = barber_id
+    
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='manage_schedule')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(
+        "📅 *Введите новый график:* в формате 'Пн-Пт 09:00-18:00' или 'Пн,Ср,Пт 10:00-17:00'",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
     )
-    await update.message.reply_text(confirmation_text, reply_markup=reply_markup, parse_mode='Markdown')
-    await update.message.reply_document(document=open(excel_path, 'rb'), caption="📋 Ваши записи")
-    return ConversationHandler.END
+    context.user_data['awaiting_admin_schedule'] = True
 
-# Admin Menu
-async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update):
-        if update.callback_query:
-            await update.callback_query.answer()
-            await update.callback_query.message.reply_text("❌ *Доступ запрещён.*", parse_mode='Markdown')
-        else:
-            await update.message.reply_text("❌ *Доступ запрещён.*", parse_mode='Markdown')
+async def handle_admin_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.user_data.get('awaiting_admin_schedule'):
         return
     
-    keyboard = [
-        [
-            InlineKeyboardButton("👤 Мастера", callback_data='admin_barbers'),
-            InlineKeyboardButton("✂️ Услуги", callback_data='admin_services')
-        ],
-        [
-            InlineKeyboardButton("📅 Все записи", callback_data='admin_appointments'),
-            InlineKeyboardButton("📢 Рассылка", callback_data='admin_broadcast')
-        ],
-        [
-            InlineKeyboardButton("⚙️ Настройки", callback_data='admin_settings'),
-            InlineKeyboardButton("📊 Статистика", callback_data='admin_stats')
-        ],
-        [
-            InlineKeyboardButton("💬 Поддержка", callback_data='support_info'),
-            InlineKeyboardButton("🔙 Назад", callback_data='back_to_start')
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    text = "👑 *Админ-панель:*"
+    schedule_text = update.message.text
+    try:
+        days, hours = schedule_text.split(' ', 1)
+        schedule = Schedule(days, hours)
+        
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("UPDATE barbers SET schedule = ? WHERE id = ?", 
+                 (schedule.to_json(), context.user_data['barber_id_schedule']))
+        conn.commit()
+        conn.close()
+        event_bus.publish(context.bot, ScheduleChanged(int(context.user_data['barber_id_schedule'])))
+        
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='manage_schedule')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await update.message.reply_text("✅ *График мастера обновлён.*", reply_markup=reply_markup, parse_mode='Markdown')
+    except ValueError:
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='manage_schedule')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await update.message.reply_text("❌ *Неверный формат.* Пример: 'Пн-Пт 09:00-18:00'", 
+                                       reply_markup=reply_markup, parse_mode='Markdown')
     
-    if update.callback_query:
-        await update.callback_query.answer()
-        await update.callback_query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
-    else:
-        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    context.user_data['awaiting_admin_schedule'] = False
 
-async def admin_barbers(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def admin_services(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     keyboard = [
         [
-            InlineKeyboardButton("➕ Добавить мастера", callback_data='add_barber'),
-            InlineKeyboardButton("❌ Удалить мастера", callback_data='delete_barber')
+            InlineKeyboardButton("➕ Добавить категорию", callback_data='add_category'),
+            InlineKeyboardButton("❌ Удалить категорию", callback_data='delete_category')
         ],
         [
-            InlineKeyboardButton("✏️ Редактировать мастера", callback_data='edit_barber'),
-            InlineKeyboardButton("⚙️ График мастера", callback_data='manage_schedule')
+            InlineKeyboardButton("➕ Добавить услугу", callback_data='add_service'),
+            InlineKeyboardButton("✏️ Редактировать услугу", callback_data='edit_service')
         ],
         [InlineKeyboardButton("🔙 Назад", callback_data='back_to_admin')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text("👤 *Управление мастерами:*", reply_markup=reply_markup, parse_mode='Markdown')
+    await query.edit_message_text("✂️ *Управление услугами:*", reply_markup=reply_markup, parse_mode='Markdown')
+
+async def add_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_services')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text("📋 *Введите название категории услуг:*", reply_markup=reply_markup, parse_mode='Markdown')
+    context.user_data['awaiting_category'] = True
+
+async def handle_add_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.user_data.get('awaiting_category'):
+        return
+    
+    category_name = update.message.text.strip()
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("INSERT INTO categories (name) VALUES (?)", (category_name,))
+        conn.commit()
+        event_bus.publish(context.bot, CatalogChanged('categories'))
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_services')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await update.message.reply_text(f"✅ *Категория '{category_name}' добавлена.*", reply_markup=reply_markup, parse_mode='Markdown')
+    except sqlite3.IntegrityError:
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_services')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await update.message.reply_text(f"❌ *Ошибка:* Категория '{category_name}' уже существует.", 
+                                       reply_markup=reply_markup, parse_mode='Markdown')
+    finally:
+        conn.close()
+    
+    context.user_data['awaiting_category'] = False
+
+async def delete_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT id, name FROM categories")
+    categories = c.fetchall()
+    conn.close()
+    
+    if not categories:
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_services')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text("😔 Нет категорий для удаления.", reply_markup=reply_markup, parse_mode='Markdown')
+        return
+    
+    keyboard = [[InlineKeyboardButton(name, callback_data=f'delete_category_{id}')] for id, name in categories]
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='admin_services')])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text("❌ *Выберите категорию для удаления:*", reply_markup=reply_markup, parse_mode='Markdown')
 
-async def add_barber(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def confirm_delete_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
+    category_id = query.data.split('_')[2]
+    
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT name FROM categories WHERE id = ?", (category_id,))
+    category_name = c.fetchone()[0]
+    c.execute("DELETE FROM categories WHERE id = ?", (category_id,))
+    c.execute("DELETE FROM services WHERE category_id = ?", (category_id,))
+    conn.commit()
+    conn.close()
+    event_bus.publish(context.bot, CatalogChanged('categories'))
+    
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='delete_category')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(
-        "➕ *Введите имя мастера:*",
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
-    context.user_data['awaiting_barber_data'] = True
-    logger.debug(f"add_barber: Prompted for name for user {query.from_user.id}")
-    return ENTER_NAME
+    await query.edit_message_text(f"✅ *Категория '{category_name}' удалена.*", reply_markup=reply_markup, parse_mode='Markdown')
 
-async def handle_barber_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        name = update.message.text.strip()
-        logger.info(f"Received barber name: {name} from user {update.effective_user.id}")
-        if not name:
-            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(
-                "❌ *Ошибка:* Имя мастера не может быть пустым.",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-            return ENTER_NAME
-        
-        context.user_data['barber_name'] = name
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
+async def add_service(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT id, name FROM categories")
+    categories = c.fetchall()
+    conn.close()
+    
+    if not categories:
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_services')]]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            f"✅ Имя мастера: *{name}*\nТеперь введите Telegram ID (числа) или username (начинается с @):",
+        await query.edit_message_text(
+            "📋 *Введите данные услуги:* в формате 'Название Цена Длительность(мин)'\n(Категория не выбрана, услуга будет без категории)",
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
-        logger.info(f"Sent Telegram ID request for barber {name}")
-        return ENTER_TELEGRAM
-    except Exception as e:
-        logger.error(f"Error in handle_barber_name: {e}")
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
+        context.user_data['awaiting_service'] = True
+        context.user_data['category_id'] = None
+    else:
+        keyboard = [[InlineKeyboardButton(name, callback_data=f'service_category_{id}')] for id, name in categories]
+        keyboard.append([InlineKeyboardButton("Без категории", callback_data='service_category_none')])
+        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='admin_services')])
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            "❌ Произошла ошибка. Попробуйте снова.",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
-        return ENTER_NAME
+        await query.edit_message_text("📋 *Выберите категорию для услуги:*", reply_markup=reply_markup, parse_mode='Markdown')
 
-async def handle_barber_telegram(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def select_service_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    category_id = query.data.split('_')[2] if query.data != 'service_category_none' else None
+    context.user_data['category_id'] = category_id
+    
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='add_service')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(
+        "➕ *Введите данные услуги:* в формате 'Название Цена Длительность(мин)'",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+    context.user_data['awaiting_service'] = True
+
+async def handle_add_service(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.user_data.get('awaiting_service'):
+        return
+    
     try:
-        telegram_info = update.message.text.strip()
-        name = context.user_data.get('barber_name')
-        logger.info(f"Received Telegram ID/username: {telegram_info} for barber {name}")
-        
-        if not name:
-            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(
-                "❌ *Ошибка:* Сначала введите имя мастера.",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-            return ENTER_NAME
-        
-        if not (telegram_info.isdigit() or (telegram_info.startswith('@') and len(telegram_info) > 1)):
-            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(
-                "❌ *Неверный формат.* Введите Telegram ID (числа) или username (начинается с @).",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-            return ENTER_TELEGRAM
+        parts = update.message.text.rsplit(' ', 2)
+        if len(parts) != 3:
+            raise ValueError("Invalid format")
+        name, price, duration = parts
+        price = float(price)
+        duration = int(duration)
+        category_id = context.user_data.get('category_id')
         
         conn = get_db_connection()
         c = conn.cursor()
-        c.execute("INSERT INTO barbers (name, telegram_id, is_active) VALUES (?, ?, ?)", 
-                 (name, telegram_info, 1))
+        c.execute("INSERT INTO services (name, price, duration, category_id) VALUES (?, ?, ?, ?)", 
+                 (name, price, duration, category_id))
         conn.commit()
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            f"✅ *Мастер {name} добавлен с Telegram ID/username: {telegram_info}.*",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
         conn.close()
-        context.user_data.pop('barber_name', None)
-        context.user_data['awaiting_barber_data'] = False
-        return ConversationHandler.END
-    except sqlite3.IntegrityError:
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
+        event_bus.publish(context.bot, CatalogChanged('services'))
+        
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_services')]]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            f"❌ *Ошибка:* Мастер с Telegram ID/username {telegram_info} уже существует.",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
-        conn.close()
-        return ENTER_TELEGRAM
-    except Exception as e:
-        logger.error(f"Error in handle_barber_telegram: {e}")
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
+        await update.message.reply_text(f"✅ *Услуга '{name}' добавлена.*", reply_markup=reply_markup, parse_mode='Markdown')
+    except ValueError:
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='add_service')]]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            "❌ Произошла ошибка. Попробуйте снова.",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
-        conn.close()
-        return ENTER_TELEGRAM
-
-async def cancel_add_barber(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    context.user_data['awaiting_barber_data'] = False
-    await admin_barbers(update, context)
-    return ConversationHandler.END
+        await update.message.reply_text("❌ *Неверный формат.* Пример: 'Стрижка 1000 30'", 
+                                       reply_markup=reply_markup, parse_mode='Markdown')
+    
+    context.user_data['awaiting_service'] = False
 
-async def delete_barber(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def edit_service(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT id, name FROM barbers")
-    barbers = c.fetchall()
+    c.execute("SELECT id, name, price, duration, category_id FROM services")
+    services = c.fetchall()
     conn.close()
     
-    if not barbers:
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
+    if not services:
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_services')]]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("😔 Нет мастеров для удаления.", reply_markup=reply_markup, parse_mode='Markdown')
+        await query.edit_message_text("😔 Нет услуг для редактирования.", reply_markup=reply_markup, parse_mode='Markdown')
         return
     
-    keyboard = [[InlineKeyboardButton(name, callback_data=f'delete_barber_{id}')] for id, name in barbers]
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')])
+    keyboard = [[InlineKeyboardButton(f"{name} ({price}₽, {duration} мин)", callback_data=f'edit_service_{id}')] 
+                for id, name, price, duration, _ in services]
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='admin_services')])
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text("❌ *Выберите мастера для удаления:*", reply_markup=reply_markup, parse_mode='Markdown')
+    await query.edit_message_text("✏️ *Выберите услугу для редактирования или удаления:*", 
+                                 reply_markup=reply_markup, parse_mode='Markdown')
 
-async def confirm_delete_barber(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def edit_service_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    barber_id = query.data.split('_')[2]
+    service_id = query.data.split('_')[2]
+    context.user_data['service_id_edit'] = service_id
     
+    keyboard = [
+        [InlineKeyboardButton("✏️ Изменить", callback_data='edit_service_data')],
+        [InlineKeyboardButton("❌ Удалить", callback_data=f'delete_service_{service_id}')],
+        [InlineKeyboardButton("🔙 Назад", callback_data='edit_service')]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text("⚙️ *Выберите действие для услуги:*", reply_markup=reply_markup, parse_mode='Markdown')
+
+async def edit_service_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT name FROM barbers WHERE id = ?", (barber_id,))
-    result = c.fetchone()
-    if not result:
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='delete_barber')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("❌ *Мастер уже удалён или не существует.*", reply_markup=reply_markup, parse_mode='Markdown')
-        conn.close()
-        return
-    
-    barber_name = result[0]
-    c.execute("DELETE FROM barbers WHERE id = ?", (barber_id,))
-    conn.commit()
+    c.execute("SELECT id, name FROM categories")
+    categories = c.fetchall()
     conn.close()
     
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='delete_barber')]]
+    keyboard = [[InlineKeyboardButton(name, callback_data=f'edit_service_category_{id}')] for id, name in categories]
+    keyboard.append([InlineKeyboardButton("Без категории", callback_data='edit_service_category_none')])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f'edit_service_{context.user_data["service_id_edit"]}')])
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(f"✅ *Мастер {barber_name} удалён.*", reply_markup=reply_markup, parse_mode='Markdown')
+    await query.edit_message_text(
+        "📋 *Выберите новую категорию для услуги (или без категории):*",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
 
-async def edit_barber(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def edit_service_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
+    category_id = query.data.split('_')[3] if query.data != 'edit_service_category_none' else None
+    context.user_data['category_id_edit'] = category_id
+    
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='edit_service_data')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(
+        "✏️ *Введите новые данные услуги:* в формате 'Название Цена Длительность(мин)'",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+    context.user_data['awaiting_service_edit'] = True
+async def handle_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.user_data.get('awaiting_broadcast'):
+        return
+    
+    broadcast_message = update.message.text
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT id, name FROM barbers")
-    barbers = c.fetchall()
-    conn.close()
-    
-    if not barbers:
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("😔 Нет мастеров для редактирования.", reply_markup=reply_markup, parse_mode='Markdown')
-        return
-    
-    keyboard = [[InlineKeyboardButton(name, callback_data=f'edit_barber_select_{id}')] for id, name in barbers]
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text("✏️ *Выберите мастера для редактирования:*", reply_markup=reply_markup, parse_mode='Markdown')
-
-async def edit_barber_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    barber_id = query.data.split('_')[3]
-    context.user_data['barber_id_edit'] = barber_id
-    
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='edit_barber')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(
-        "✏️ *Введите новое имя мастера:*",
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
-    context.user_data['awaiting_barber_edit'] = True
-
-async def handle_edit_barber(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.user_data.get('awaiting_barber_edit'):
-        return
-    
-    name = update.message.text.strip()
-    barber_id = context.user_data['barber_id_edit']
-    
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("UPDATE barbers SET name = ? WHERE id = ?", (name, barber_id))
-    conn.commit()
-    conn.close()
-    
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='edit_barber')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(f"✅ *Имя мастера обновлено на {name}.*", reply_markup=reply_markup, parse_mode='Markdown')
-    
-    context.user_data['awaiting_barber_edit'] = False
-
-async def manage_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT id, name FROM barbers")
-    barbers = c.fetchall()
-    conn.close()
-    
-    if not barbers:
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("😔 Нет мастеров для управления графиком.", reply_markup=reply_markup, parse_mode='Markdown')
-        return
-    
-    keyboard = [[InlineKeyboardButton(name, callback_data=f'manage_schedule_{id}')] for id, name in barbers]
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='admin_barbers')])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text("⚙️ *Выберите мастера для управления графиком:*", reply_markup=reply_markup, parse_mode='Markdown')
-
-async def manage_schedule_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    barber_id = query.data.split('_')[2]
-    context.user_data['barber_id_schedule'] = barber_id
-    
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='manage_schedule')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(
-        "📅 *Введите новый график:* в формате 'Пн-Пт 09:00-18:00' или 'Пн,Ср,Пт 10:00-17:00'",
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
-    context.user_data['awaiting_admin_schedule'] = True
-
-async def handle_admin_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.user_data.get('awaiting_admin_schedule'):
-        return
-    
-    schedule_text = update.message.text
-    try:
-        days, hours = schedule_text.split(' ', 1)
-        start_time, end_time = hours.split('-')
-        datetime.strptime(start_time, '%H:%M')
-        datetime.strptime(end_time, '%H:%M')
-        schedule = {'days': days, 'hours': hours}
-        
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("UPDATE barbers SET schedule = ? WHERE id = ?", 
-                 (json.dumps(schedule), context.user_data['barber_id_schedule']))
-        conn.commit()
-        conn.close()
-        
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='manage_schedule')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("✅ *График мастера обновлён.*", reply_markup=reply_markup, parse_mode='Markdown')
-    except ValueError:
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='manage_schedule')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("❌ *Неверный формат.* Пример: 'Пн-Пт 09:00-18:00'", 
-                                       reply_markup=reply_markup, parse_mode='Markdown')
-    
-    context.user_data['awaiting_admin_schedule'] = False
-
-async def admin_services(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    keyboard = [
-        [
-            InlineKeyboardButton("➕ Добавить категорию", callback_data='add_category'),
-            InlineKeyboardButton("❌ Удалить категорию", callback_data='delete_category')
-        ],
-        [
-            InlineKeyboardButton("➕ Добавить услугу", callback_data='add_service'),
-            InlineKeyboardButton("✏️ Редактировать услугу", callback_data='edit_service')
-        ],
-        [InlineKeyboardButton("🔙 Назад", callback_data='back_to_admin')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text("✂️ *Управление услугами:*", reply_markup=reply_markup, parse_mode='Markdown')
-
-async def add_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_services')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text("📋 *Введите название категории услуг:*", reply_markup=reply_markup, parse_mode='Markdown')
-    context.user_data['awaiting_category'] = True
-
-async def handle_add_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.user_data.get('awaiting_category'):
-        return
-    
-    category_name = update.message.text.strip()
-    conn = get_db_connection()
-    c = conn.cursor()
-    try:
-        c.execute("INSERT INTO categories (name) VALUES (?)", (category_name,))
-        conn.commit()
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_services')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(f"✅ *Категория '{category_name}' добавлена.*", reply_markup=reply_markup, parse_mode='Markdown')
-    except sqlite3.IntegrityError:
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_services')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(f"❌ *Ошибка:* Категория '{category_name}' уже существует.", 
-                                       reply_markup=reply_markup, parse_mode='Markdown')
-    finally:
-        conn.close()
-    
-    context.user_data['awaiting_category'] = False
-
-async def delete_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT id, name FROM categories")
-    categories = c.fetchall()
-    conn.close()
-    
-    if not categories:
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_services')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("😔 Нет категорий для удаления.", reply_markup=reply_markup, parse_mode='Markdown')
-        return
-    
-    keyboard = [[InlineKeyboardButton(name, callback_data=f'delete_category_{id}')] for id, name in categories]
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='admin_services')])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text("❌ *Выберите категорию для удаления:*", reply_markup=reply_markup, parse_mode='Markdown')
-
-async def confirm_delete_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    category_id = query.data.split('_')[2]
-    
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT name FROM categories WHERE id = ?", (category_id,))
-    category_name = c.fetchone()[0]
-    c.execute("DELETE FROM categories WHERE id = ?", (category_id,))
-    c.execute("DELETE FROM services WHERE category_id = ?", (category_id,))
-    conn.commit()
-    conn.close()
-    
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='delete_category')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(f"✅ *Категория '{category_name}' удалена.*", reply_markup=reply_markup, parse_mode='Markdown')
-
-async def add_service(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT id, name FROM categories")
-    categories = c.fetchall()
-    conn.close()
-    
-    if not categories:
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_services')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "📋 *Введите данные услуги:* в формате 'Название Цена Длительность(мин)'\n(Категория не выбрана, услуга будет без категории)",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
-        context.user_data['awaiting_service'] = True
-        context.user_data['category_id'] = None
-    else:
-        keyboard = [[InlineKeyboardButton(name, callback_data=f'service_category_{id}')] for id, name in categories]
-        keyboard.append([InlineKeyboardButton("Без категории", callback_data='service_category_none')])
-        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='admin_services')])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("📋 *Выберите категорию для услуги:*", reply_markup=reply_markup, parse_mode='Markdown')
-
-async def select_service_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    category_id = query.data.split('_')[2] if query.data != 'service_category_none' else None
-    context.user_data['category_id'] = category_id
-    
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='add_service')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(
-        "➕ *Введите данные услуги:* в формате 'Название Цена Длительность(мин)'",
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
-    context.user_data['awaiting_service'] = True
-
-async def handle_add_service(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.user_data.get('awaiting_service'):
-        return
-    
-    try:
-        parts = update.message.text.rsplit(' ', 2)
-        if len(parts) != 3:
-            raise ValueError("Invalid format")
-        name, price, duration = parts
-        price = float(price)
-        duration = int(duration)
-        category_id = context.user_data.get('category_id')
-        
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("INSERT INTO services (name, price, duration, category_id) VALUES (?, ?, ?, ?)", 
-                 (name, price, duration, category_id))
-        conn.commit()
-        conn.close()
-        
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_services')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(f"✅ *Услуга '{name}' добавлена.*", reply_markup=reply_markup, parse_mode='Markdown')
-    except ValueError:
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='add_service')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("❌ *Неверный формат.* Пример: 'Стрижка 1000 30'", 
-                                       reply_markup=reply_markup, parse_mode='Markdown')
-    
-    context.user_data['awaiting_service'] = False
-
-async def edit_service(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT id, name, price, duration, category_id FROM services")
-    services = c.fetchall()
-    conn.close()
-    
-    if not services:
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='admin_services')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("😔 Нет услуг для редактирования.", reply_markup=reply_markup, parse_mode='Markdown')
-        return
-    
-    keyboard = [[InlineKeyboardButton(f"{name} ({price}₽, {duration} мин)", callback_data=f'edit_service_{id}')] 
-                for id, name, price, duration, _ in services]
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='admin_services')])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text("✏️ *Выберите услугу для редактирования или удаления:*", 
-                                 reply_markup=reply_markup, parse_mode='Markdown')
-
-async def edit_service_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    service_id = query.data.split('_')[2]
-    context.user_data['service_id_edit'] = service_id
-    
-    keyboard = [
-        [InlineKeyboardButton("✏️ Изменить", callback_data='edit_service_data')],
-        [InlineKeyboardButton("❌ Удалить", callback_data=f'delete_service_{service_id}')],
-        [InlineKeyboardButton("🔙 Назад", callback_data='edit_service')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text("⚙️ *Выберите действие для услуги:*", reply_markup=reply_markup, parse_mode='Markdown')
-
-async def edit_service_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT id, name FROM categories")
-    categories = c.fetchall()
-    conn.close()
-    
-    keyboard = [[InlineKeyboardButton(name, callback_data=f'edit_service_category_{id}')] for id, name in categories]
-    keyboard.append([InlineKeyboardButton("Без категории", callback_data='edit_service_category_none')])
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f'edit_service_{context.user_data["service_id_edit"]}')])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(
-        "📋 *Выберите новую категорию для услуги (или без категории):*",
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
-
-async def edit_service_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    category_id = query.data.split('_')[3] if query.data != 'edit_service_category_none' else None
-    context.user_data['category_id_edit'] = category_id
-    
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='edit_service_data')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(
-        "✏️ *Введите новые данные услуги:* в формате 'Название Цена Длительность(мин)'",
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
-    context.user_data['awaiting_service_edit'] = True
-async def handle_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.user_data.get('awaiting_broadcast'):
-        return
-    
-    broadcast_message = update.message.text
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT DISTINCT user_id FROM appointments")
-    users = c.fetchall()
+    c.execute("SELECT DISTINCT user_id FROM appointments")
+    users = c.fetchall()
     conn.close()
     
     for user_id in users:
         try:
             await context.bot.send_message(chat_id=user_id[0], text=broadcast_message, parse_mode='Markdown')
         except Exception as e:
-            logger.error(f"Failed to send broadcast to user {user_id[0]}: {e}")
+            logger.error("Failed to send broadcast to user %s: %s", user_id[0], e)
     
     keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='back_to_admin')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1205,6 +4600,7 @@ async def handle_edit_service(update: Update, context: ContextTypes.DEFAULT_TYPE
                  (name, price, duration, category_id, service_id))
         conn.commit()
         conn.close()
+        event_bus.publish(context.bot, CatalogChanged('services'))
         
         keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='edit_service')]]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1278,6 +4674,7 @@ async def delete_service(update: Update, context: ContextTypes.DEFAULT_TYPE):
     c.execute("DELETE FROM services WHERE id = ?", (service_id,))
     conn.commit()
     conn.close()
+    event_bus.publish(context.bot, CatalogChanged('services'))
     
     keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='edit_service')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1290,6 +4687,107 @@ async def admin_appointments(update: Update, context: ContextTypes.DEFAULT_TYPE)
     excel_path = generate_appointments_excel(is_admin=True)
     await query.message.reply_document(document=open(excel_path, 'rb'), caption="📋 Все записи")
 
+async def admin_archive(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    await asyncio.to_thread(archive_past_appointments)
+    excel_path = await asyncio.to_thread(generate_archive_excel)
+    await query.message.reply_document(document=open(excel_path, 'rb'), caption="🗄 Архив записей")
+
+async def perf_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        await update.message.reply_text("❌ *Доступ запрещён.*", parse_mode='Markdown')
+        return
+    await update.message.reply_text(format_perf_summary())
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        await update.message.reply_text("❌ *Доступ запрещён.*", parse_mode='Markdown')
+        return
+
+    action = context.args[0] if context.args else 'status'
+    if action == 'start':
+        selected = [arg for arg in context.args[1:] if arg != 'memory']
+        profiler.start(selected, memory='memory' in context.args[1:])
+        target = ', '.join(selected) if selected else 'все обработчики'
+        await update.message.reply_text(f"🔬 Профилирование запущено: {target}. Остановить: /profile stop")
+    elif action == 'stop':
+        if not profiler.running:
+            await update.message.reply_text("ℹ️ Профилирование не запущено.")
+            return
+        paths = await asyncio.to_thread(dump_profile, *profiler.stop())
+        for path in paths:
+            await update.message.reply_document(document=open(path, 'rb'), caption=os.path.basename(path))
+    elif profiler.running:
+        await update.message.reply_text(f"🔬 Профилирование идёт с {profiler.started_at:%H:%M:%S}. Остановить: /profile stop")
+    else:
+        await update.message.reply_text(
+            "ℹ️ Использование: /profile start [обработчик ...] [memory] | /profile stop\n"
+            "Обработчик - имя функции (select_time) или шаблон (^date_)."
+        )
+
+async def admin_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='back_to_admin')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(
+        "📥 *Отправьте файл CSV или XLSX.* Тип данных определяется по колонкам:\n\n"
+        "👤 Мастера: `name, telegram_id`\n"
+        "✂️ Услуги: `category, name, price, duration`\n"
+        "📅 Записи: `user_id, client_name, client_phone, barber, service, date, time[, status]`\n\n"
+        "Прошедшие записи попадают в архив. Если в файле есть ошибки, ничего не импортируется.",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+    context.user_data['awaiting_import'] = True
+
+async def handle_import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.user_data.get('awaiting_import') or not is_admin(update):
+        return
+
+    document = update.message.document
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data='back_to_admin')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    file_name = document.file_name or ''
+    if not file_name.lower().endswith(('.csv', '.xlsx', '.xls')):
+        await update.message.reply_text("❌ *Нужен файл CSV или XLSX.*", reply_markup=reply_markup, parse_mode='Markdown')
+        return
+
+    telegram_file = await document.get_file()
+    content = bytes(await telegram_file.download_as_bytearray())
+    try:
+        df = await asyncio.to_thread(read_import_table, file_name, content)
+    except (ValueError, UnicodeDecodeError) as e:
+        logger.error("handle_import_document: Cannot read %s: %s", file_name, e)
+        await update.message.reply_text("❌ *Не удалось прочитать файл.*", reply_markup=reply_markup, parse_mode='Markdown')
+        return
+
+    kind = detect_import_kind(df.columns)
+    if kind is None:
+        await update.message.reply_text(
+            "❌ *Не удалось определить тип данных по колонкам.*",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+        return
+
+    imported, errors = await asyncio.to_thread(import_records, kind, df)
+    if errors:
+        lines = [f"• строка {line}: {message}" for line, message in errors[:IMPORT_MAX_ERRORS_SHOWN]]
+        if len(errors) > IMPORT_MAX_ERRORS_SHOWN:
+            lines.append(f"… и ещё {len(errors) - IMPORT_MAX_ERRORS_SHOWN}")
+        await update.message.reply_text(
+            f"❌ Импорт отменён, ошибок: {len(errors)}\n\n" + "\n".join(lines),
+            reply_markup=reply_markup
+        )
+        return
+
+    context.user_data['awaiting_import'] = False
+    event_bus.publish(context.bot, CatalogChanged(kind))
+    logger.info("handle_import_document: Imported %d %s from %s", imported, kind, file_name)
+    await update.message.reply_text(f"✅ *Импортировано строк: {imported}.*", reply_markup=reply_markup, parse_mode='Markdown')
+
 async def admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -1312,7 +4810,12 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     active_barbers = c.fetchone()[0]
     c.execute("SELECT COUNT(*) FROM appointments WHERE status = 'pending'")
     pending_appointments = c.fetchone()[0]
-    c.execute("SELECT COUNT(*) FROM appointments WHERE status = 'completed'")
+    # Past completed bookings are archived; cold months are left out to keep
+    # the screen cheap
+    c.execute(
+        "SELECT (SELECT COUNT(*) FROM appointments WHERE status = 'completed') + "
+        "(SELECT COUNT(*) FROM archive_appointments WHERE status = 'completed')"
+    )
     completed_appointments = c.fetchone()[0]
     c.execute("SELECT AVG(rating) FROM barbers WHERE rating_count > 0")
     avg_rating = c.fetchone()[0] or 0.0
@@ -1331,6 +4834,8 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.edit_message_text(stats_text, reply_markup=reply_markup, parse_mode='Markdown')
 
 async def back_to_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    release_slot_hold(context, update.effective_user.id)
+    context.user_data.pop('preset_service', None)
     await start(update, context)
 
 async def back_to_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1339,14 +4844,36 @@ async def back_to_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def back_to_barber(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await barber_menu(update, context)
 
+async def on_startup(application):
+    await start_metrics(application)
+    application.bot_data['outbox_task'] = asyncio.create_task(run_outbox_dispatcher(application.bot))
+
+async def on_shutdown(application):
+    application.bot_data['outbox_task'].cancel()
+    await stop_metrics(application)
+    await event_bus.drain()
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.error(f"Update {update} caused error {context.error}")
+    update_id = update.update_id if isinstance(update, Update) else None
+    logger.error("Update %s caused error %s", update_id, context.error, exc_info=context.error)
 # States for conversation handlers
 ENTER_NAME, ENTER_PHONE, ENTER_TELEGRAM = range(3)
-def main():
-    init_db()
+def create_application(builder):
+    # Everything main() runs, minus the token and polling, so the benchmarks
+    # drive exactly the production middleware and routing
+    application = (
+        builder
+        .concurrent_updates(UserOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES))
+        .rate_limiter(rate_limiter)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .defaults(Defaults(tzinfo=SHOP_TZ))
+        .build()
+    )
     
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Logging context and flood protection run before every other handler group
+    application.add_handler(TypeHandler(Update, bind_update_context), group=-2)
+    application.add_handler(TypeHandler(Update, flood_guard), group=-1)
     
     # Conversation handler for booking
     booking_conv_handler = ConversationHandler(
@@ -1354,8 +4881,14 @@ def main():
         states={
             ENTER_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_name)],
             ENTER_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_phone)],
+            CONFIRM_PROFILE: [
+                CallbackQueryHandler(use_profile, pattern='^use_profile$'),
+                CallbackQueryHandler(enter_details, pattern='^enter_details$'),
+            ],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, booking_timeout)],
         },
         fallbacks=[CallbackQueryHandler(back_to_start, pattern='^back_to_start$')],
+        conversation_timeout=SLOT_HOLD_SECONDS,
     )
     
     # Conversation handler for adding barber
@@ -1368,34 +4901,57 @@ def main():
         fallbacks=[CallbackQueryHandler(cancel_add_barber, pattern='^admin_barbers$')],
     )
     
+    # Conversation handler for barber time off
+    vacation_conv_handler = ConversationHandler(
+        entry_points=[CallbackQueryHandler(set_vacation, pattern='^set_vacation$')],
+        states={
+            ENTER_VACATION: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_vacation),
+                CallbackQueryHandler(delete_vacation, pattern=r'^vacation_del_\d+$'),
+            ],
+        },
+        fallbacks=[CallbackQueryHandler(cancel_vacation, pattern='^vacation_done$')],
+        allow_reentry=True,
+    )
+    
     # Command handlers
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(InlineQueryHandler(inline_slots))
     application.add_handler(CommandHandler("admin", admin_menu))
     application.add_handler(CommandHandler("barber", barber_menu))
+    application.add_handler(CommandHandler("backup", backup_command))
+    application.add_handler(CommandHandler("perf", perf_command))
+    application.add_handler(CommandHandler("profile", profile_command))
     
     # Callback query handlers
     application.add_handler(CallbackQueryHandler(about_us, pattern='^about_us$'))
     application.add_handler(CallbackQueryHandler(support_info, pattern='^support_info$'))
     application.add_handler(CallbackQueryHandler(book_appointment, pattern='^book_appointment$'))
-    application.add_handler(CallbackQueryHandler(select_date_time, pattern='^barber_'))
+    application.add_handler(CallbackQueryHandler(select_date_time, pattern=r'^barber_\d+$'))
     application.add_handler(CallbackQueryHandler(select_time, pattern='^date_'))
+    application.add_handler(CallbackQueryHandler(show_calendar, pattern='^cal_'))
     application.add_handler(CallbackQueryHandler(select_service, pattern='^time_'))
     application.add_handler(CallbackQueryHandler(select_service_from_category, pattern='^category_'))
-    application.add_handler(CallbackQueryHandler(my_appointments, pattern='^my_appointments$'))
+    application.add_handler(CallbackQueryHandler(toggle_basket_service, pattern=r'^basket_\d+$'))
+    application.add_handler(CallbackQueryHandler(show_categories, pattern='^categories_list$'))
+    application.add_handler(CallbackQueryHandler(my_appointments, pattern=r'^(my_appointments$|myapp_)'))
+    application.add_handler(CallbackQueryHandler(my_history, pattern='^myhist'))
     application.add_handler(CallbackQueryHandler(cancel_appointment, pattern='^cancel_'))
+    application.add_handler(CallbackQueryHandler(repeat_appointment, pattern=r'^repeat_\d+_\d+$'))
+    application.add_handler(CallbackQueryHandler(stop_repeat, pattern='^stop_repeat_'))
+    application.add_handler(CallbackQueryHandler(waitlist_join, pattern='^waitlist_join$'))
+    application.add_handler(CallbackQueryHandler(waitlist_subscribe, pattern=r'^waitlist_\d+$'))
+    application.add_handler(CallbackQueryHandler(waitlist_accept, pattern='^waitlist_accept_'))
+    application.add_handler(CallbackQueryHandler(waitlist_decline, pattern='^waitlist_decline_'))
     application.add_handler(CallbackQueryHandler(working_hours, pattern='^working_hours$'))
-    application.add_handler(CallbackQueryHandler(rate_barber, pattern='^rate_barber$'))
-    application.add_handler(CallbackQueryHandler(select_rating, pattern='^rate_barber_'))
-    application.add_handler(CallbackQueryHandler(handle_rating, pattern='^rating_'))
     
     # Barber menu handlers
     application.add_handler(CallbackQueryHandler(barber_appointments, pattern='^barber_appointments$'))
-    application.add_handler(CallbackQueryHandler(toggle_accepting, pattern='^toggle_accepting$'))
-    application.add_handler(CallbackQueryHandler(set_schedule, pattern='^set_schedule$'))
-    application.add_handler(CallbackQueryHandler(set_vacation, pattern='^set_vacation$'))
+    application.add_handler(CallbackQueryHandler(barber_list, pattern='^blist'))
+    application.add_handler(CallbackQueryHandler(barber_history, pattern='^bhist'))
+    application.add_handler(CallbackQueryHandler(back_to_barber, pattern='^back_to_barber$'))
     application.add_handler(CallbackQueryHandler(complete_appointment, pattern='^complete_appointment$'))
     application.add_handler(CallbackQueryHandler(mark_complete, pattern='^complete_'))
-    application.add_handler(CallbackQueryHandler(barber_reviews, pattern='^barber_reviews$'))
     
     # Admin menu handlers
     application.add_handler(CallbackQueryHandler(admin_barbers, pattern='^admin_barbers$'))
@@ -1417,14 +4973,20 @@ def main():
     application.add_handler(CallbackQueryHandler(edit_service_category, pattern='^edit_service_category_'))
     application.add_handler(CallbackQueryHandler(delete_service, pattern='^delete_service_'))
     application.add_handler(CallbackQueryHandler(admin_appointments, pattern='^admin_appointments$'))
+    application.add_handler(CallbackQueryHandler(admin_archive, pattern='^admin_archive$'))
+    application.add_handler(CallbackQueryHandler(admin_import, pattern='^admin_import$'))
     application.add_handler(CallbackQueryHandler(admin_broadcast, pattern='^admin_broadcast$'))
     application.add_handler(CallbackQueryHandler(admin_settings, pattern='^admin_settings$'))
     application.add_handler(CallbackQueryHandler(change_working_hours, pattern='^change_working_hours$'))
     
+    # Conversation handlers: after the callback handlers, so their entry
+    # patterns cannot shadow more specific buttons, and before the generic
+    # text handlers, because only the first matching handler of a group runs
+    application.add_handler(booking_conv_handler)
+    application.add_handler(add_barber_conv_handler)
+    application.add_handler(vacation_conv_handler)
+    
     # Message handlers
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & filters.Regex(r'^\d{2}\.\d{2}\.\d{4}$'), handle_date))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_comment))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_schedule))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_admin_schedule))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_add_category))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_add_service))
@@ -1432,14 +4994,29 @@ def main():
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_edit_barber))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_broadcast))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_working_hours))
+    application.add_handler(MessageHandler(filters.Document.ALL, handle_import_document))
     
-    # Conversation handlers
-    application.add_handler(booking_conv_handler)
-    application.add_handler(add_barber_conv_handler)
+    # Per-handler latency metrics; must run after all handlers are added
+    instrument_handlers(application)
     
     # Error handler
     application.add_error_handler(error_handler)
     
+    # Scheduled jobs
+    application.job_queue.run_daily(archive_maintenance_job, time=dtime(hour=ARCHIVE_MAINTENANCE_HOUR))
+    application.job_queue.run_daily(backup_job, time=dtime(hour=BACKUP_HOUR))
+    application.job_queue.run_repeating(prune_flood_state_job, interval=300)
+    application.job_queue.run_repeating(expire_waitlist_job, interval=WAITLIST_EXPIRE_INTERVAL)
+    application.job_queue.run_daily(materialize_recurring_job, time=dtime(hour=RECURRING_MATERIALIZE_HOUR))
+    return application
+
+def main():
+    # Configured here rather than at import, so importing the module (the
+    # benchmarks do) leaves the importer's logging alone
+    setup_logging()
+    init_db()
+    
+    application = create_application(Application.builder().token(BOT_TOKEN))
     application.run_polling()
 
 if __name__ == '__main__':
@@ -0,0 +1,138 @@
+# Load test for the booking funnel.
+#
+# Every virtual client walks the booking funnel with synthetic updates:
+# start -> book_appointment -> select_date_time -> select_time -> select_service
+# -> (select_service_from_category) -> request_name -> handle_name -> handle_phone
+# (or use_profile for returning clients), choosing buttons from the keyboards
+# the bot actually sent. Updates go through the application built by
+# barbershop_bot.create_application, so step latency includes the flood guard,
+# the capped per-user update processor, conversation routing and the outbound
+# rate limiter. Clients pause --think-ms between taps, as people do; faster clients
+# are throttled by the flood guard exactly as in production. Bot API calls are
+# answered by a fake request object, optionally with simulated network latency.
+#
+#   python -m benchmarks.bench_booking --clients 20 --bookings 5 --months 12
+#   python -m benchmarks.bench_booking --max-p95-ms 150   # non-zero exit on regression
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+from time import monotonic
+
+from benchmarks.support import (
+    SyntheticClient, build_application, db_time_total, latency_row, print_latency_table,
+    seed_dataset, stop_application, use_temporary_database,
+)
+
+
+class FunnelFailed(Exception):
+    pass
+
+
+def pick(request, chat_id, prefix, rng):
+    choices = [data for data in request.buttons(chat_id) if data.startswith(prefix) and data != 'time_booked']
+    if not choices:
+        raise FunnelFailed(f"no '{prefix}' button")
+    return rng.choice(choices)
+
+
+async def book_once(client, request, rng, timings, think):
+    chat_id = client.chat['id']
+
+    async def step(name, update):
+        await asyncio.sleep(think)
+        started = monotonic()
+        await client.send(update)
+        timings.setdefault(name, []).append(monotonic() - started)
+
+    await step('start', client.text_update('/start'))
+    await step('book_appointment', client.callback_update('book_appointment'))
+    await step('select_date_time', client.callback_update(pick(request, chat_id, 'barber_', rng)))
+    await step('select_time', client.callback_update('date_tomorrow'))
+    await step('select_service', client.callback_update(pick(request, chat_id, 'time_', rng)))
+    if any(data.startswith('category_') for data in request.buttons(chat_id)):
+        await step('select_service_from_category', client.callback_update(pick(request, chat_id, 'category_', rng)))
+    await step('request_name', client.callback_update(pick(request, chat_id, 'service_', rng)))
+    if 'use_profile' in request.buttons(chat_id):
+        # Returning client: the saved name and phone are confirmed with one tap
+        await step('use_profile', client.callback_update('use_profile'))
+    else:
+        await step('handle_name', client.text_update(f"Клиент {chat_id}"))
+        await step('handle_phone', client.text_update(f"+7999{chat_id:07d}"))
+    if not any(data.startswith('repeat_') for data in request.buttons(chat_id)):
+        raise FunnelFailed("booking was not confirmed")
+
+
+async def run_client(application, request, user_id, bookings, seed, think, timings, totals):
+    client = SyntheticClient(application, user_id)
+    rng = random.Random(seed)
+    for _ in range(bookings):
+        started = monotonic()
+        try:
+            await book_once(client, request, rng, timings, think)
+        except FunnelFailed:
+            totals['failed'] += 1
+            continue
+        timings.setdefault('booking (end to end)', []).append(monotonic() - started)
+        totals['booked'] += 1
+
+
+def write_report(path, report):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+async def main(args):
+    logging.getLogger().setLevel(logging.WARNING)
+    use_temporary_database(args.db)
+    if not args.db:
+        history = seed_dataset(args.barbers, args.services, args.months, seed=args.seed)
+        print(f"Seeded {args.barbers} barbers, {args.services} services, {history} archived appointments")
+
+    application, request = await build_application(args.api_latency_ms / 1000)
+    timings = {}
+    totals = {'booked': 0, 'failed': 0}
+    db_before = db_time_total()
+    started = monotonic()
+    await asyncio.gather(*[
+        run_client(application, request, 10_000 + client_no, args.bookings, args.seed + client_no,
+                   args.think_ms / 1000, timings, totals)
+        for client_no in range(args.clients)
+    ])
+    wall = monotonic() - started
+    db_time = db_time_total() - db_before
+    await stop_application(application)
+
+    rows = [latency_row(name, samples) for name, samples in timings.items()]
+    print_latency_table(rows)
+    updates = sum(len(samples) for name, samples in timings.items() if name != 'booking (end to end)')
+    print(f"\nbookings: {totals['booked']} ok, {totals['failed']} failed in {wall:.2f}s "
+          f"({totals['booked'] / wall:.1f} bookings/s, {updates / wall:.1f} updates/s)")
+    print(f"DB time: {db_time:.2f}s ({db_time / wall:.0%} of wall time), Bot API calls: {request.calls}")
+
+    if args.json:
+        await asyncio.to_thread(write_report, args.json, {'steps': rows, 'wall_s': wall, 'db_s': db_time, **totals})
+
+    slow = [row for row in rows if args.max_p95_ms and row['name'] != 'booking (end to end)' and row['p95_ms'] > args.max_p95_ms]
+    for row in slow:
+        print(f"REGRESSION: {row['name']} p95 {row['p95_ms']:.1f} ms > {args.max_p95_ms} ms", file=sys.stderr)
+    return 1 if slow else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Booking funnel load test')
+    parser.add_argument('--clients', type=int, default=10, help='concurrent virtual clients')
+    parser.add_argument('--bookings', type=int, default=3, help='bookings per client')
+    parser.add_argument('--barbers', type=int, default=5)
+    parser.add_argument('--services', type=int, default=20)
+    parser.add_argument('--months', type=int, default=6, help='months of archived appointments to seed')
+    parser.add_argument('--db', help='use an existing database instead of seeding a new one')
+    parser.add_argument('--api-latency-ms', type=float, default=0.0, help='simulated Bot API round trip')
+    parser.add_argument('--think-ms', type=float, default=1000.0, help='pause before every tap')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='also write results to this JSON file')
+    parser.add_argument('--max-p95-ms', type=float, help='fail if any step p95 exceeds this')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,124 @@
+# Micro-benchmarks for the heaviest pure functions of the bot:
+# available time slots (uncached query and cache hit), archive_past_appointments
+# and generate_appointments_excel, measured on seeded datasets of growing size.
+#
+#   python -m benchmarks.bench_functions --scales 1000,10000,100000
+#   python -m benchmarks.bench_functions --json functions.json
+
+import argparse
+import json
+import logging
+import random
+import sqlite3
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+from time import monotonic
+
+import barbershop_bot as bot
+from benchmarks.support import latency_row, seed_dataset, use_temporary_database
+
+
+def insert_appointments(count, days_from, days_to, rng, user_ids=None):
+    conn = sqlite3.connect(bot.DATABASE_PATH)
+    c = conn.cursor()
+    c.execute("SELECT id FROM barbers")
+    barber_ids = [row[0] for row in c.fetchall()]
+    c.execute("SELECT id FROM services")
+    service_ids = [row[0] for row in c.fetchall()]
+    today = datetime.now().date()
+    rows = []
+    for _ in range(count):
+        date = (today + timedelta(days=rng.randint(days_from, days_to))).strftime('%Y-%m-%d')
+        time = f"{rng.randint(9, 17):02d}:{rng.choice(('00', '30'))}"
+        user_id = rng.choice(user_ids) if user_ids else str(rng.randrange(10 ** 6, 10 ** 7))
+        rows.append((user_id, 'Клиент', '+79990000000', rng.choice(barber_ids), rng.choice(service_ids), date, time, 'pending',
+                     bot.day_number(date), bot.to_minutes(time)))
+    c.executemany(
+        "INSERT INTO appointments (user_id, client_name, client_phone, barber_id, service_id, date, time, status, day_num, start_min) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+    conn.commit()
+    conn.close()
+
+
+def measure(name, scale, func, repeats):
+    samples = []
+    for _ in range(repeats):
+        started = monotonic()
+        func()
+        samples.append(monotonic() - started)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    row = latency_row(name, samples)
+    row.update({'scale': scale, 'peak_kib': peak / 1024})
+    return row
+
+
+def bench_scale(scale, args):
+    rng = random.Random(args.seed)
+    use_temporary_database()
+    seed_dataset(args.barbers, args.services, months=0, seed=args.seed)
+    insert_appointments(scale, 0, 60, rng, user_ids=[str(n) for n in range(1, 1000)])
+    conn = sqlite3.connect(bot.DATABASE_PATH)
+    barber_ids = [row[0] for row in conn.execute("SELECT id FROM barbers")]
+    conn.close()
+    today = datetime.now().date()
+
+    def slots():
+        date = (today + timedelta(days=rng.randint(0, 60))).strftime('%Y-%m-%d')
+        bot.load_available_time_slots(rng.choice(barber_ids), date)
+
+    def cached_slots():
+        bot.get_available_time_slots(barber_ids[0], today.strftime('%Y-%m-%d'))
+
+    def month():
+        bot.load_month_availability(rng.choice(barber_ids), today.strftime('%Y-%m'))
+
+    def archive():
+        # Every run archives a fresh batch of past appointments, sized as a
+        # tenth of the dataset
+        insert_appointments(max(scale // 10, 1), -30, -1, rng)
+        bot.archive_past_appointments()
+
+    rows = [
+        measure('load_available_time_slots', scale, slots, args.repeats * 10),
+        measure('get_available_time_slots (cached)', scale, cached_slots, args.repeats * 10),
+        measure('load_month_availability', scale, month, args.repeats * 10),
+        measure('generate_appointments_excel (client)', scale, lambda: bot.generate_appointments_excel(user_id='1'), args.repeats),
+        measure('generate_appointments_excel (admin)', scale, lambda: bot.generate_appointments_excel(is_admin=True), args.repeats),
+        measure('archive_past_appointments', scale, archive, args.repeats),
+    ]
+    return rows
+
+
+def main(args):
+    logging.getLogger().setLevel(logging.WARNING)
+    results = []
+    print(f"{'function':<40} {'rows':>8} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9} {'peak KiB':>9}")
+    for scale in args.scales:
+        for row in bench_scale(scale, args):
+            results.append(row)
+            print(f"{row['name']:<40} {scale:>8} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} "
+                  f"{row['mean_ms']:>9.2f} {row['peak_kib']:>9.0f}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for slot, archive and export functions')
+    parser.add_argument('--scales', type=lambda value: [int(part) for part in value.split(',')],
+                        default=[1000, 10000, 100000], help='comma separated appointment counts')
+    parser.add_argument('--barbers', type=int, default=10)
+    parser.add_argument('--services', type=int, default=30)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='also write results to this JSON file')
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,274 @@
+# Synthetic data generator for large barbershop datasets.
+#
+# Populates barbers with schedules, categories, services, years of archived
+# history, upcoming appointments and reviews with realistic shapes: evening
+# and Saturday peaks, quiet Mondays, a pool of regular clients, cancellations
+# and no-shows. Rows are produced lazily and written with executemany in
+# large batches inside one transaction.
+#
+#   python -m benchmarks.generate_data --db big.db --barbers 30 --years 3
+#   python -m benchmarks.generate_data --db big.db --barbers 100 --years 5 --fill 0.8   # ~1M+ rows
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from itertools import islice
+from time import monotonic
+
+import barbershop_bot
+
+BATCH_SIZE = 50_000
+
+SCHEDULES = [
+    ({'days': 'Пн-Вс', 'hours': '09:00-18:00'}, 4),
+    ({'days': 'Пн-Пт', 'hours': '10:00-20:00'}, 3),
+    ({'days': 'Вт-Сб', 'hours': '11:00-21:00'}, 2),
+    ({'days': 'Пн,Ср,Пт', 'hours': '09:00-15:00'}, 1),
+]
+
+CATALOG = {
+    'Стрижки': [('Мужская стрижка', 1200, 60), ('Стрижка машинкой', 700, 30), ('Детская стрижка', 800, 30),
+                ('Стрижка ножницами', 1500, 60), ('Fade', 1400, 60)],
+    'Борода': [('Моделирование бороды', 800, 30), ('Королевское бритьё', 1200, 60), ('Оформление усов', 400, 30)],
+    'Уход': [('Камуфляж седины', 900, 30), ('Укладка', 500, 30), ('Мытьё головы', 300, 30)],
+    'Комплексы': [('Стрижка + борода', 1800, 90), ('Отец + сын', 1900, 90)],
+}
+
+# Relative demand by hour of day and by weekday (Monday first)
+HOUR_WEIGHTS = {9: 2, 10: 4, 11: 5, 12: 6, 13: 5, 14: 5, 15: 6, 16: 7, 17: 9, 18: 10, 19: 9, 20: 6}
+WEEKDAY_WEIGHTS = [0.6, 0.8, 0.9, 0.9, 1.1, 1.3, 0.8]
+
+# Outcome of past appointments
+PAST_STATUSES = (('completed', 0.88), ('cancelled', 0.09), ('no_show', 0.03))
+RATING_WEIGHTS = ((5, 0.62), (4, 0.24), (3, 0.08), (2, 0.04), (1, 0.02))
+COMMENTS = [None, None, "Отличная стрижка!", "Всё понравилось", "Буду приходить ещё", "Немного задержали", "Лучший мастер"]
+
+
+def working_slots(schedule):
+    start, end = schedule['hours'].split('-')
+    start_minutes = int(start[:2]) * 60 + int(start[3:])
+    end_minutes = int(end[:2]) * 60 + int(end[3:])
+    return [f"{minutes // 60:02d}:{minutes % 60:02d}" for minutes in range(start_minutes, end_minutes, 30)]
+
+
+def working_weekdays(days):
+    names = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+    if '-' in days:
+        first, last = (names.index(part) for part in days.split('-'))
+        return set(range(first, last + 1))
+    return {names.index(part) for part in days.split(',')}
+
+
+def client_pool(rng, size):
+    # A small share of regulars makes most of the visits (Pareto-like)
+    clients = [(str(rng.randrange(10 ** 8, 10 ** 9)), f"Клиент {n}", f"+79{rng.randrange(10 ** 8, 10 ** 9)}") for n in range(size)]
+    weights = [1 / (rank + 1) ** 0.8 for rank in range(size)]
+    return clients, weights
+
+
+def generate_appointments(rng, barbers, service_ids, service_weights, clients, client_weights,
+                          first_day, last_day, fill, today):
+    client_cum = _cumulative(client_weights)
+    service_cum = _cumulative(service_weights)
+    barbers = [(barber_id, slots, _cumulative(slot_weights), weekdays) for barber_id, slots, slot_weights, weekdays in barbers]
+    day = first_day
+    while day <= last_day:
+        weekday = day.weekday()
+        date = day.strftime('%Y-%m-%d')
+        # Upcoming days fill up as they approach
+        horizon_factor = 1.0 if day < today else max(0.15, 1 - (day - today).days / 21)
+        for barber_id, slots, slot_cum, weekdays in barbers:
+            if weekday not in weekdays:
+                continue
+            wanted = int(len(slots) * fill * WEEKDAY_WEIGHTS[weekday] * horizon_factor * rng.uniform(0.7, 1.1))
+            if wanted <= 0:
+                continue
+            # Weighted draws with repeats collapse into distinct slots, which
+            # also makes the busiest hours saturate first
+            taken = sorted(set(rng.choices(slots, cum_weights=slot_cum, k=min(wanted, len(slots)))))
+            picked_clients = rng.choices(clients, cum_weights=client_cum, k=len(taken))
+            picked_services = rng.choices(service_ids, cum_weights=service_cum, k=len(taken))
+            for time, client, service_id in zip(taken, picked_clients, picked_services):
+                yield (barber_id, service_id, date, time) + client
+        day += timedelta(days=1)
+
+
+def _cumulative(weights):
+    total = 0.0
+    cumulative = []
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    return cumulative
+
+
+def _threshold_picker(rng, choices):
+    values = [value for value, _ in choices]
+    cumulative = _cumulative([weight for _, weight in choices])
+
+    def pick():
+        return values[min(bisect_right(cumulative, rng.random() * cumulative[-1]), len(values) - 1)]
+    return pick
+
+
+def batched(iterable, size=BATCH_SIZE):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def generate_dataset(db_path, barbers=20, services=None, history_days=365, future_days=30, fill=0.6,
+                     review_rate=0.15, clients=None, seed=1):
+    rng = random.Random(seed)
+    barbershop_bot.DATABASE_PATH = db_path
+    barbershop_bot.init_db()
+
+    conn = sqlite3.connect(db_path)
+    # Generation is reproducible, so durability is traded for speed
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA journal_mode = MEMORY")
+    c = conn.cursor()
+    counts = {}
+
+    # Bulk loading into unindexed tables and building the indexes once at the
+    # end is several times faster than maintaining them row by row
+    c.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+        "AND tbl_name IN ('appointments', 'archive_appointments', 'reviews')"
+    )
+    indexes = c.fetchall()
+    for name, _ in indexes:
+        c.execute(f"DROP INDEX {name}")
+
+    schedules = [rng.choices([schedule for schedule, _ in SCHEDULES], weights=[weight for _, weight in SCHEDULES])[0]
+                 for _ in range(barbers)]
+    c.executemany(
+        "INSERT INTO barbers (name, telegram_id, is_active, schedule) VALUES (?, ?, ?, ?)",
+        [(f"Мастер {n}", str(9 * 10 ** 8 + rng.randrange(10 ** 8)), 1 if rng.random() > 0.05 else 0, json.dumps(schedule, ensure_ascii=False))
+         for n, schedule in enumerate(schedules, 1)]
+    )
+    counts['barbers'] = barbers
+
+    c.executemany("INSERT OR IGNORE INTO categories (name) VALUES (?)", [(name,) for name in CATALOG])
+    c.execute("SELECT id, name FROM categories")
+    category_ids = {name: category_id for category_id, name in c.fetchall()}
+    catalog = [(category, name, price, duration) for category, items in CATALOG.items() for name, price, duration in items]
+    service_rows = []
+    for n in range(services or len(catalog)):
+        category, name, price, duration = catalog[n % len(catalog)]
+        suffix = '' if n < len(catalog) else f" #{n // len(catalog) + 1}"
+        service_rows.append((category_ids[category], name + suffix, price + 100 * (n // len(catalog)), duration))
+    c.executemany("INSERT INTO services (category_id, name, price, duration) VALUES (?, ?, ?, ?)", service_rows)
+    counts['services'] = len(service_rows)
+
+    c.execute("SELECT id, schedule FROM barbers WHERE telegram_id != '' ORDER BY id DESC LIMIT ?", (barbers,))
+    barber_rows = []
+    for barber_id, schedule_json in c.fetchall():
+        schedule = json.loads(schedule_json)
+        slots = working_slots(schedule)
+        barber_rows.append((barber_id, slots, [HOUR_WEIGHTS.get(int(slot[:2]), 3) for slot in slots], working_weekdays(schedule['days'])))
+    c.execute("SELECT id FROM services ORDER BY id DESC LIMIT ?", (len(service_rows),))
+    service_ids = [row[0] for row in c.fetchall()]
+    # Cheaper services are booked more often
+    service_weights = [1 / (1 + rng.random() * 3) for _ in service_ids]
+    client_rows, client_weights = client_pool(rng, clients or max(barbers * 400, 1000))
+
+    today = datetime.now().date()
+    archived_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    pick_status = _threshold_picker(rng, PAST_STATUSES)
+    pick_rating = _threshold_picker(rng, RATING_WEIGHTS)
+    reviews = []
+
+    def archive_rows():
+        for barber_id, service_id, date, time, user_id, name, phone in generate_appointments(
+                rng, barber_rows, service_ids, service_weights, client_rows, client_weights,
+                today - timedelta(days=history_days), today - timedelta(days=1), fill, today):
+            status = pick_status()
+            if status == 'completed' and rng.random() < review_rate:
+                reviews.append((barber_id, name, pick_rating(), rng.choice(COMMENTS), date))
+            yield (user_id, name, phone, barber_id, service_id, date, time, status, archived_at)
+
+    counts['archive_appointments'] = 0
+    for batch in batched(archive_rows()):
+        # Archive ids come from the appointments sequence, as in the bot
+        first_id = barbershop_bot.reserve_appointment_ids(c, len(batch))
+        c.executemany(
+            "INSERT INTO archive_appointments (id, user_id, client_name, client_phone, barber_id, service_id, date, time, status, archived_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(first_id + index,) + row for index, row in enumerate(batch)]
+        )
+        counts['archive_appointments'] += len(batch)
+    barbershop_bot.fill_archive_totals(c)
+
+    def upcoming_rows():
+        for barber_id, service_id, date, time, user_id, name, phone in generate_appointments(
+                rng, barber_rows, service_ids, service_weights, client_rows, client_weights,
+                today + timedelta(days=1), today + timedelta(days=future_days), fill, today):
+            yield (user_id, name, phone, barber_id, service_id, date, time, 'pending',
+                   barbershop_bot.day_number(date), barbershop_bot.to_minutes(time))
+
+    counts['appointments'] = 0
+    if future_days > 0:
+        for batch in batched(upcoming_rows()):
+            c.executemany(
+                "INSERT INTO appointments (user_id, client_name, client_phone, barber_id, service_id, date, time, status, day_num, start_min) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                batch
+            )
+            counts['appointments'] += len(batch)
+
+    for batch in batched(reviews):
+        c.executemany("INSERT INTO reviews (barber_id, client_name, rating, comment, date) VALUES (?, ?, ?, ?, ?)", batch)
+    counts['reviews'] = len(reviews)
+    ratings = {}
+    for barber_id, _, rating, _, _ in reviews:
+        total, count = ratings.get(barber_id, (0, 0))
+        ratings[barber_id] = (total + rating, count + 1)
+    c.executemany(
+        "UPDATE barbers SET rating = ?, rating_count = ? WHERE id = ?",
+        [(total / count, count, barber_id) for barber_id, (total, count) in ratings.items()]
+    )
+
+    for _, sql in indexes:
+        c.execute(sql)
+    conn.commit()
+    conn.close()
+    return counts
+
+
+def main(args):
+    if args.reset and os.path.exists(args.db):
+        os.remove(args.db)
+    started = monotonic()
+    counts = generate_dataset(
+        args.db, barbers=args.barbers, services=args.services, history_days=int(args.years * 365),
+        future_days=args.future_days, fill=args.fill, review_rate=args.review_rate, clients=args.clients, seed=args.seed,
+    )
+    elapsed = monotonic() - started
+    total = sum(counts.values())
+    print(', '.join(f"{table}: {count}" for table, count in counts.items()))
+    print(f"{total} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s) -> {args.db}")
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic barbershop database')
+    parser.add_argument('--db', default='barbershop_generated.db')
+    parser.add_argument('--reset', action='store_true', help='delete the database file first')
+    parser.add_argument('--barbers', type=int, default=20)
+    parser.add_argument('--services', type=int, help='number of services (default: built-in catalog)')
+    parser.add_argument('--years', type=float, default=1.0, help='years of archived history')
+    parser.add_argument('--future-days', type=int, default=30, help='days of upcoming appointments')
+    parser.add_argument('--fill', type=float, default=0.6, help='average share of booked slots')
+    parser.add_argument('--review-rate', type=float, default=0.15, help='share of completed visits with a review')
+    parser.add_argument('--clients', type=int, help='size of the client pool')
+    parser.add_argument('--seed', type=int, default=1)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,192 @@
+# Shared helpers for the benchmark scripts: a fake Telegram Bot API, synthetic
+# updates, dataset seeding and latency reporting.
+# Run the scripts from the repository root, e.g. python -m benchmarks.bench_booking
+
+import asyncio
+import json
+import math
+import os
+import tempfile
+from datetime import datetime
+from itertools import count
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+import barbershop_bot
+from benchmarks.generate_data import generate_dataset
+
+
+class FakeRequest(BaseRequest):
+    # Answers Bot API calls locally with well-formed responses and remembers
+    # the last inline keyboard shown in every chat, so a benchmark client can
+    # "tap" buttons the same way a user would
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.message_ids = count(1000)
+        self.calls = 0
+        self.keyboards = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+
+        if endpoint == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif endpoint in ('sendMessage', 'sendDocument', 'editMessageText'):
+            chat_id = params.get('chat_id')
+            if 'reply_markup' in params:
+                self.keyboards[chat_id] = params['reply_markup']
+            result = {
+                'message_id': params.get('message_id') or next(self.message_ids),
+                'date': int(datetime.now().timestamp()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    def buttons(self, chat_id):
+        markup = self.keyboards.get(chat_id) or {}
+        return [
+            button['callback_data']
+            for row in markup.get('inline_keyboard', [])
+            for button in row
+            if 'callback_data' in button
+        ]
+
+
+async def build_application(latency=0.0):
+    # The bot's own application (rate limiter, flood guard, conversation
+    # routing, handler metrics) with the network replaced by FakeRequest
+    request = FakeRequest(latency)
+    application = barbershop_bot.create_application(
+        Application.builder()
+        .token('123456:BENCHMARK')
+        .request(request)
+        .get_updates_request(FakeRequest())
+    )
+    await application.initialize()
+    await application.start()
+    return application, request
+
+
+async def stop_application(application):
+    await application.stop()
+    await application.shutdown()
+
+
+class SyntheticClient:
+    # One fake Telegram user whose updates are built as real telegram.Update
+    # objects bound to the benchmark application's bot
+    update_ids = count(1)
+    message_ids = count(1)
+
+    def __init__(self, application, user_id):
+        self.application = application
+        self.user = {'id': user_id, 'is_bot': False, 'first_name': f'Client{user_id}'}
+        self.chat = {'id': user_id, 'type': 'private'}
+        self.message_id = None
+
+    def text_update(self, text):
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(datetime.now().timestamp()),
+            'chat': self.chat,
+            'from': self.user,
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return Update.de_json({'update_id': next(self.update_ids), 'message': message}, self.application.bot)
+
+    def callback_update(self, data):
+        callback_query = {
+            'id': str(next(self.update_ids)),
+            'from': self.user,
+            'chat_instance': str(self.user['id']),
+            'data': data,
+            'message': {
+                'message_id': self.message_id or 1,
+                'date': int(datetime.now().timestamp()),
+                'chat': self.chat,
+                'text': '',
+            },
+        }
+        return Update.de_json({'update_id': next(self.update_ids), 'callback_query': callback_query}, self.application.bot)
+
+    async def send(self, update):
+        # Processes the update the way polling does: through the application's
+        # update processor, every handler group and the conversation handlers
+        application = self.application
+        await application.update_processor.process_update(update, application.process_update(update))
+
+
+def use_temporary_database(path=None):
+    # Points the bot module at a scratch database and working directory, so
+    # generated Excel files and the database never touch the real ones
+    workdir = tempfile.mkdtemp(prefix='barbershop_bench_')
+    os.chdir(workdir)
+    barbershop_bot.DATABASE_PATH = path or os.path.join(workdir, 'bench.db')
+    barbershop_bot.availability_cache.clear()
+    barbershop_bot.init_db()
+    return barbershop_bot.DATABASE_PATH
+
+
+def seed_dataset(barbers=5, services=20, months=6, seed=1, future_days=0, fill=0.6):
+    counts = generate_dataset(
+        barbershop_bot.DATABASE_PATH, barbers=barbers, services=services, history_days=months * 30,
+        future_days=future_days, fill=fill, seed=seed,
+    )
+    return counts['archive_appointments']
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # Nearest-rank percentile
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def latency_row(name, samples):
+    return {
+        'name': name,
+        'count': len(samples),
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'mean_ms': (sum(samples) / len(samples) * 1000) if samples else 0.0,
+    }
+
+
+def print_latency_table(rows):
+    print(f"{'step':<32} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'mean ms':>9}")
+    for row in rows:
+        print(f"{row['name']:<32} {row['count']:>7} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} "
+              f"{row['p99_ms']:>9.2f} {row['mean_ms']:>9.2f}")
+
+
+def db_time_total():
+    histograms = barbershop_bot.metrics.histograms
+    return sum(
+        histogram.total
+        for name in ('barbershop_db_query_seconds', 'barbershop_db_fetch_seconds')
+        for histogram in histograms.get(name, {}).values()
+    )
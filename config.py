@@ -17,3 +17,85 @@ WELCOME_MESSAGE = (
     "Мы создадим для вас идеальный стиль!\n"
     "Выберите действие:"
 )
+
+# Archive retention: rows of archive_appointments older than this many days
+# are moved out of the main database into per-month files in ARCHIVE_COLD_DIR
+ARCHIVE_RETENTION_DAYS = 180
+ARCHIVE_COLD_DIR = "archive"
+ARCHIVE_MAINTENANCE_HOUR = 3  # час ежедневного обслуживания архива
+
+# Online backups of DATABASE_PATH made with the SQLite backup API
+BACKUP_DIR = "backups"
+BACKUP_KEEP = 7  # сколько последних копий хранить
+BACKUP_HOUR = 4  # час ежедневного резервного копирования
+
+# Bulk import of barbers, services and appointments from CSV/XLSX
+IMPORT_MAX_ERRORS_SHOWN = 20
+
+# Flood protection: per-user token bucket, repeated button taps, global cap
+FLOOD_RATE = 1.0  # обновлений в секунду на пользователя
+FLOOD_BURST = 6  # допустимая серия обновлений подряд
+DUPLICATE_CALLBACK_WINDOW = 2.0  # сек, повторное нажатие той же кнопки игнорируется
+MAX_CONCURRENT_UPDATES = 8  # обновлений разных пользователей, обрабатываемых одновременно
+MAX_PENDING_UPDATES = 256  # обновлений в работе и в очереди к своему пользователю
+
+# Outbound Telegram API rate limits (see core.telegram.org/bots/faq)
+TELEGRAM_GLOBAL_RATE = 25  # запросов в секунду на весь бот
+TELEGRAM_GROUP_CHAT_RATE = 20 / 60  # сообщений в секунду в группу
+TELEGRAM_MAX_RETRIES = 3  # повторов после RetryAfter
+
+# Metrics: Prometheus text endpoint on METRICS_HOST:METRICS_PORT (None disables)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+EVENT_LOOP_LAG_INTERVAL = 1.0  # сек между замерами задержки event loop
+
+# Logging: "text" or "json" lines, written off the event loop by a queue listener
+LOG_LEVEL = "INFO"
+LOG_FORMAT = "text"
+LOG_FILE = None  # путь к файлу логов, None - вывод в консоль
+LOG_DEBUG_SAMPLE_RATE = 0.1  # доля DEBUG-сообщений, попадающих в лог
+
+# On-demand profiling of handlers (/profile start|stop)
+PROFILE_DIR = "profiles"
+PROFILE_SAMPLE_RATE = 1.0  # доля вызовов обработчиков, попадающих в профиль
+
+# Free-slot cache per (barber, date), invalidated by booking events
+AVAILABILITY_CACHE_SIZE = 2048  # максимум закэшированных дней
+
+# Notification outbox, drained in batches by a background dispatcher
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_POLL_INTERVAL = 5.0  # секунд между проверками, если новых событий нет
+OUTBOX_LEASE_SECONDS = 60  # через сколько неподтверждённая пачка снова доступна
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_BASE = 10  # секунд, удваивается с каждой попыткой
+OUTBOX_KEEP_DAYS = 30  # сколько хранить доставленные уведомления
+
+# Waitlist: freed slots are offered to waiting clients with a short hold
+WAITLIST_OFFER_MINUTES = 15  # сколько минут слот закреплён за клиентом
+WAITLIST_EXPIRE_INTERVAL = 60  # секунд между проверками просроченных предложений
+
+# Slot holds: a picked time is kept for the client while they enter name and phone
+SLOT_HOLD_SECONDS = 600  # также тайм-аут диалога записи
+
+# Recurring appointments: rules are expanded lazily, only the near future is materialized
+RECURRING_INTERVALS = (2, 3, 4)  # варианты повтора, недель
+RECURRING_MATERIALIZE_DAYS = 14  # на сколько дней вперёд создаются реальные записи
+RECURRING_HORIZON_DAYS = 180  # окно проверки конфликтов при создании правила
+RECURRING_MATERIALIZE_HOUR = 2
+
+# Client profiles: last used name and phone, cached in memory
+CLIENT_CACHE_SIZE = 10000  # максимум профилей в памяти
+
+# Paginated appointment lists
+LIST_PAGE_SIZE = 8  # записей на странице
+
+# Booking shortcuts: inline mode (@bot <мастер>) lists free slots with deep links
+INLINE_SLOT_DAYS = 3  # на сколько дней вперёд искать свободное время
+INLINE_MAX_RESULTS = 50  # предел Telegram для одного ответа
+INLINE_CACHE_SECONDS = 30  # сколько Telegram кэширует ответ
+
+# Calendar date picker
+CALENDAR_MONTHS_AHEAD = 3  # на сколько месяцев вперёд можно листать календарь
+
+# Shop timezone: all dates, slot times and nightly jobs follow the shop's local clock
+SHOP_TIMEZONE = 'Europe/Moscow'